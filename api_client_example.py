@@ -7,94 +7,128 @@ This script demonstrates how to interact with the CertMate API
 import requests
 import json
 import os
-from typing import Optional, Dict, Any
+import tempfile
+from typing import Optional, Dict, Any, Tuple
 
 class CertMateClient:
-    def __init__(self, base_url: str, api_token: str):
+    def __init__(self, base_url: str, api_token: str, timeout: float = 30):
         """
         Initialize the CertMate API client
         
         Args:
             base_url: Base URL of the CertMate server (e.g., http://localhost:8000)
             api_token: Bearer token for authentication
+            timeout: Seconds to wait for the server on each request
         """
         self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
         self.headers = {
             'Authorization': f'Bearer {api_token}',
             'Content-Type': 'application/json'
         }
+        # One session for all calls, so connections are kept alive between them
+        self.session = requests.Session()
+    
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Send a request to the server with the client's headers and timeout"""
+        headers = dict(self.headers)
+        headers.update(kwargs.pop('headers', {}))
+        return self.session.request(method, f"{self.base_url}{path}", headers=headers,
+                                    timeout=self.timeout, **kwargs)
     
     def health_check(self) -> Dict[str, Any]:
         """Check if the server is healthy"""
-        response = requests.get(f"{self.base_url}/health")
+        response = self._request('GET', '/health')
         return response.json()
     
     def get_settings(self) -> Dict[str, Any]:
         """Get current settings"""
-        response = requests.get(f"{self.base_url}/api/settings", headers=self.headers)
+        response = self._request('GET', '/api/settings')
         response.raise_for_status()
         return response.json()
     
     def update_settings(self, settings: Dict[str, Any]) -> Dict[str, Any]:
         """Update settings"""
-        response = requests.post(
-            f"{self.base_url}/api/settings",
-            headers=self.headers,
-            json=settings
-        )
+        response = self._request('POST', '/api/settings', json=settings)
         response.raise_for_status()
         return response.json()
     
     def list_certificates(self) -> list:
         """List all certificates"""
-        response = requests.get(f"{self.base_url}/api/certificates", headers=self.headers)
+        response = self._request('GET', '/api/certificates')
         response.raise_for_status()
         return response.json()
     
     def create_certificate(self, domain: str) -> Dict[str, Any]:
         """Create a new certificate"""
-        response = requests.post(
-            f"{self.base_url}/api/certificates/create",
-            headers=self.headers,
-            json={'domain': domain}
-        )
+        response = self._request('POST', '/api/certificates/create', json={'domain': domain})
         response.raise_for_status()
         return response.json()
     
     def renew_certificate(self, domain: str) -> Dict[str, Any]:
         """Renew a certificate"""
-        response = requests.post(
-            f"{self.base_url}/api/certificates/{domain}/renew",
-            headers=self.headers
-        )
+        response = self._request('POST', f'/api/certificates/{domain}/renew')
         response.raise_for_status()
         return response.json()
     
     def download_certificate(self, domain: str, output_file: str) -> bool:
         """Download certificate as ZIP file"""
-        response = requests.get(
-            f"{self.base_url}/api/certificates/{domain}/download",
-            headers=self.headers
-        )
+        response = self._request('GET', f'/api/certificates/{domain}/download')
         response.raise_for_status()
         
-        with open(output_file, 'wb') as f:
-            f.write(response.content)
-        
+        write_file_atomic(output_file, response.content)
         return True
     
     def download_certificate_simple(self, domain: str, output_file: str) -> bool:
         """Download certificate using the simple /domain/tls endpoint"""
-        response = requests.get(
-            f"{self.base_url}/{domain}/tls",
-            headers=self.headers
-        )
+        response = self._request('GET', f'/{domain}/tls')
         response.raise_for_status()
         
-        with open(output_file, 'wb') as f:
-            f.write(response.content)
-        
+        write_file_atomic(output_file, response.content)
         return True
+    
+    def download_certificate_if_changed(self, domain: str, etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Download the certificate ZIP of a domain unless it still matches etag
+        
+        Returns:
+            (content, etag); content is None when the certificate is unchanged
+        """
+        headers = {'If-None-Match': f'"{etag}"'} if etag else {}
+        response = self._request('GET', f'/{domain}/tls', headers=headers)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return response.content, response.headers.get('ETag', '').strip('"') or None
+    
+    def get_certificate_changes(self, since: int = 0, limit: int = 500) -> Optional[Dict[str, Any]]:
+        """
+        Get certificates published, replaced or removed since a sequence number
+        
+        Returns:
+            The change feed page, or None if the server has no change feed
+            (inventory store disabled)
+        """
+        response = self._request('GET', '/api/certificates/changes', params={'since': since, 'limit': limit})
+        if response.status_code == 501:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+def write_file_atomic(path: str, content: bytes, mode: int = 0o644) -> None:
+    """Write a file through a temporary file and rename, so readers never see it half-written"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 def main():
     """Example usage of the CertMate API client"""
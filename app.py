@@ -1,38 +1,78 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Blueprint, Response, render_template, request, jsonify, send_file, g
 from flask_cors import CORS
-from flask_restx import Api, Resource, fields, Namespace
+from flask_restx import Api, Resource, fields, Namespace, inputs, marshal
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.x509.oid import NameOID
 from functools import wraps
 import os
 import json
 import subprocess
 import tempfile
 import zipfile
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import threading
-from apscheduler.schedulers.background import BackgroundScheduler
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 from pathlib import Path
 import ssl
 import socket
-from urllib.parse import urlparse
-import requests
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
 import fcntl  # For file locking
 import re
 import secrets
 import atexit
+import sqlite3
+import time
+import random
+import math
+import base64
+import signal
+import hashlib
+import hmac
+import shutil
+import shlex
+from collections import deque, OrderedDict
+import heapq
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+import io
+import struct
+import gzip
+import zlib
+import ipaddress
+import select
+from urllib.parse import urlparse
+
+# Dependencies that only rarely used subsystems need are imported where they
+# are used, so that starting a worker stays cheap: requests (OCSP fetching,
+# webhook and HTTP deploy delivery), cryptography's OCSP module,
+# multiprocessing (key pool refills and bulk imports), configparser (imports)
+# and ctypes (the inotify watcher). APScheduler is imported by
+# start_scheduler, so that only the worker running background services
+# loads it.
+
+# orjson is optional: when installed, large JSON responses are serialized with
+# it instead of the standard library json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# Initialize Flask app
-app = Flask(__name__)
-# Generate a secure random secret key if not provided
-default_secret = os.urandom(32).hex() if not os.getenv('SECRET_KEY') else 'your-secret-key-here'
-app.secret_key = os.getenv('SECRET_KEY', default_secret)
-CORS(app)
+# dnspython is optional: without it the CAA and DNS delegation preflight
+# checks are skipped and orders only get their domain validated up front
+try:
+    import dns.nameserver
+    import dns.resolver
+except ImportError:
+    dns = None
 
-# Initialize Flask-RESTX
+# Initialize Flask-RESTX (bound to the app in create_app)
 api = Api(
-    app,
     version='1.0',
     title='CertMate API',
     description='SSL Certificate Management API with Cloudflare DNS Challenge',
@@ -40,41 +80,308 @@ api = Api(
     prefix='/api'
 )
 
+# Web interface and download routes
+web = Blueprint('web', __name__)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Directories with proper error handling
-try:
-    CERT_DIR = Path("certificates")
-    DATA_DIR = Path("data")
-    CERT_DIR.mkdir(exist_ok=True)
-    DATA_DIR.mkdir(exist_ok=True)
-    
-    # Verify directory permissions
-    if not os.access(CERT_DIR, os.W_OK):
-        logger.error(f"No write permission for certificates directory: {CERT_DIR}")
-    if not os.access(DATA_DIR, os.W_OK):
-        logger.error(f"No write permission for data directory: {DATA_DIR}")
-        
-except Exception as e:
-    logger.error(f"Failed to create required directories: {e}")
-    # Use temporary directories as fallback
-    CERT_DIR = Path(tempfile.mkdtemp(prefix="certmate_certs_"))
-    DATA_DIR = Path(tempfile.mkdtemp(prefix="certmate_data_"))
-    logger.warning(f"Using temporary directories - certificates may not persist")
+# Directories (created by init_directories when the app is created)
+CERT_DIR = Path("certificates")
+DATA_DIR = Path("data")
 
 # Settings file
 SETTINGS_FILE = DATA_DIR / "settings.json"
 
-# Initialize scheduler with error handling
-try:
-    scheduler = BackgroundScheduler()
-    scheduler.start()
-    logger.info("Background scheduler started successfully")
-except Exception as e:
-    logger.error(f"Failed to start background scheduler: {e}")
-    scheduler = None
+# Inventory store (SQLite index of domains, certificate metadata and history).
+# Set CERTMATE_INVENTORY_BACKEND=none to fall back to settings/directory scans.
+INVENTORY_ENABLED = os.getenv('CERTMATE_INVENTORY_BACKEND', 'sqlite').lower() == 'sqlite'
+INVENTORY_DB_FILE = Path(os.getenv('CERTMATE_INVENTORY_DB', str(DATA_DIR / "inventory.db")))
+
+# Certificates with fewer days left than this are renewed
+RENEWAL_THRESHOLD_DAYS = 30
+
+# Certificate list pagination: supported sort orders and page size cap
+CERTIFICATE_SORT_ORDERS = ('expiry', '-expiry', 'domain')
+MAX_PAGE_SIZE = 1000
+
+# Dashboard: rows rendered server-side on first paint, and limits for the
+# batched deployment probe of visible rows
+DASHBOARD_PAGE_SIZE = 50
+MAX_DEPLOYMENT_BATCH = 50
+DEPLOYMENT_CHECK_WORKERS = 16
+
+# Large JSON responses: gzip-compressed when the client accepts it and the body
+# is at least GZIP_MIN_BYTES; NDJSON streams are sent in chunks of about
+# NDJSON_CHUNK_BYTES
+NDJSON_MIMETYPE = 'application/x-ndjson'
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+NDJSON_CHUNK_BYTES = 64 * 1024
+
+# Certificate files published for each issuance, and how many old versions
+# (CERT_DIR/<domain>/v<serial>/) to keep; override with certificate_versions_to_keep
+CERTIFICATE_FILES = ('cert.pem', 'chain.pem', 'fullchain.pem', 'privkey.pem')
+DEFAULT_CERTIFICATE_VERSIONS_KEPT = 5
+
+# Downloaded ZIP bundles cached per worker
+BUNDLE_CACHE_SIZE = 256
+# Lock and result files of calls shared between workers (shared_singleflight)
+SINGLEFLIGHT_DIR = DATA_DIR / "singleflight"
+
+# Certbot's local configuration, work and log directories
+LETSENCRYPT_DIR = Path("letsencrypt")
+
+# Change watcher for CERT_DIR, certbot's live directory and settings.json:
+# 'auto' uses inotify when available, 'scan' always stat-scans, 'off' disables it
+WATCHER_MODE = os.getenv('CERTMATE_WATCHER', 'auto').lower()
+WATCHER_SCAN_INTERVAL = int(os.getenv('CERTMATE_WATCHER_SCAN_INTERVAL', '60'))
+WATCHER_DEBOUNCE_SECONDS = 0.5
+
+# Number of certificate change feed entries kept in the inventory
+CHANGE_FEED_RETENTION = 10000
+
+# Per-domain key settings (key_type, key_size and preferred_chain in domain
+# entries): supported sizes per key type, the first being the default
+KEY_SIZES = {
+    'rsa': (2048, 3072, 4096),
+    'ecdsa': (256, 384)
+}
+
+# OCSP responses fetched for stapling at the edge (disable with the
+# ocsp_stapling setting, point ocsp_responder_url at another responder)
+OCSP_RESPONSE_FILE = "ocsp.der"
+OCSP_FETCH_WORKERS = 16
+OCSP_TIMEOUT_SECONDS = 10
+OCSP_CHECK_INTERVAL_MINUTES = 15
+OCSP_DEFAULT_VALIDITY_SECONDS = 3600  # for responses without nextUpdate
+
+# Private key pool (see refill_key_pool); override with the key_pool setting
+KEY_POOL_DIR = DATA_DIR / "keypool"
+KEY_TYPES = {
+    'rsa2048': ('rsa', 2048),
+    'rsa4096': ('rsa', 4096),
+    'ecdsa-p256': ('ecdsa', 'secp256r1'),
+    'ecdsa-p384': ('ecdsa', 'secp384r1')
+}
+DEFAULT_KEY_POOL_SETTINGS = {
+    'enabled': False,
+    'key_types': ['rsa2048'],
+    'default_key_type': 'rsa2048',
+    'low_watermark': 5,
+    'high_watermark': 20,
+    'workers': None  # defaults to the number of CPUs
+}
+
+# Certificate jobs: state and output of certbot runs, shared by all workers
+JOBS_DIR = DATA_DIR / "jobs"
+JOB_HISTORY_LIMIT = 500
+JOB_LOG_LINES = 2000
+JOB_RESULT_LINES = 100
+JOB_STREAM_POLL_SECONDS = 0.5
+# A log stream holds a (sync) worker, so it ends well within the gunicorn
+# timeout and the client reconnects from the last event it received
+JOB_STREAM_MAX_SECONDS = 55
+JOB_STREAM_RETRY_MS = 1000
+# Jobs whose worker died are resumed by the worker running background
+# services; a job interrupted while certbot ran is retried after a backoff
+# doubling from the base delay, at most JOB_MAX_RETRIES times. On shutdown a
+# worker waits up to CERTMATE_JOB_DRAIN_SECONDS for its running jobs.
+JOB_RESUME_INTERVAL_SECONDS = 60
+JOB_RETRY_BASE_SECONDS = 60
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_MAX_RETRIES = 5
+JOB_DRAIN_SECONDS = int(os.getenv('CERTMATE_JOB_DRAIN_SECONDS', '20'))
+
+# Certbot timeouts in seconds; override with the certbot_timeouts setting.
+# A run exceeding the overall limit, or staying in one phase for longer than
+# that phase's limit, has its whole process group killed.
+DEFAULT_CERTBOT_TIMEOUTS = {
+    'overall': 1800,
+    'phases': {
+        'starting': 120,
+        'order': 300,
+        'challenge': 300,
+        'propagation': 900,
+        'finalize': 300
+    }
+}
+CERTBOT_KILL_GRACE_SECONDS = 10
+
+# CA rate limits (Let's Encrypt's, by default); override with the rate_limits
+# setting. Each is a token bucket holding `limit` orders that refills over
+# `window_hours`. Orders that would exceed one are deferred, up to
+# RATE_LIMIT_MAX_DEFER_SECONDS, instead of being sent to the CA.
+RATE_LIMIT_LEDGER_FILE = DATA_DIR / "rate_limits.json"
+DEFAULT_RATE_LIMITS = {
+    'new_orders_per_account': {'limit': 300, 'window_hours': 3},
+    'certificates_per_registered_domain': {'limit': 50, 'window_hours': 168},
+    'duplicate_certificates': {'limit': 5, 'window_hours': 168},
+    'failed_validations': {'limit': 5, 'window_hours': 1}
+}
+RATE_LIMIT_MAX_DEFER_SECONDS = 6 * 3600
+RATE_LIMIT_POLL_SECONDS = 30
+# ACME accounts (acme_accounts setting) and their CA error state. An account
+# whose CA fails an order is left out for a cooldown that doubles with each
+# consecutive error, up to the maximum, unless the CA says when to retry.
+LETSENCRYPT_DEFAULT_SERVER = "https://acme-v02.api.letsencrypt.org/directory"
+ACME_HEALTH_FILE = DATA_DIR / "acme_accounts.json"
+ACME_COOLDOWN_BASE_SECONDS = 60
+ACME_COOLDOWN_MAX_SECONDS = 3600
+ACME_CA_ERROR_PATTERN = re.compile(
+    r'urn:ietf:params:acme:error:(?:rateLimited|serverInternal)|too many (?:certificates|new orders|requests)'
+    r'|HTTP(?:/[\d.]+)? (?:429|50[234])|Too Many Requests|Service Unavailable|Bad Gateway'
+    r'|Failed to establish a new connection|Connection refused|Max retries exceeded|Read timed out'
+    r'|Unable to reach the ACME server', re.I)
+ACME_RETRY_AFTER_PATTERN = re.compile(r'retry after (\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2})')
+# Public suffixes under which domains are registered at the third level; other
+# domains are treated as registered at the second level
+MULTI_LABEL_PUBLIC_SUFFIXES = {
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk', 'ltd.uk', 'plc.uk', 'net.uk',
+    'com.au', 'net.au', 'org.au', 'edu.au', 'gov.au', 'co.nz', 'org.nz', 'net.nz',
+    'co.jp', 'ne.jp', 'or.jp', 'co.kr', 'or.kr', 'com.br', 'net.br', 'org.br',
+    'com.cn', 'net.cn', 'org.cn', 'com.mx', 'com.ar', 'com.tr', 'co.za', 'co.in',
+    'com.sg', 'com.hk', 'com.tw', 'co.il', 'com.pl', 'co.id', 'com.my', 'com.ua'
+}
+
+# Webhooks (webhooks setting). Events are queued as files in the outbox by
+# whichever worker sees them and delivered by a pool of WEBHOOK_WORKERS in the
+# worker running background services. Failed deliveries are retried with a
+# backoff doubling from the base delay; after WEBHOOK_MAX_ATTEMPTS they are
+# moved to the dead letter directory.
+WEBHOOK_DIR = DATA_DIR / "webhooks"
+WEBHOOK_EVENTS = ('certificate.issued', 'certificate.renewed', 'certificate.failed', 'certificate.expiring')
+WEBHOOK_WORKERS = 4
+WEBHOOK_TIMEOUT_SECONDS = 10
+WEBHOOK_POLL_SECONDS = 5
+WEBHOOK_RETRY_BASE_SECONDS = 30
+WEBHOOK_RETRY_MAX_SECONDS = 3600
+WEBHOOK_MAX_ATTEMPTS = 10
+WEBHOOK_EXPIRY_WARNING_DAYS = 14
+WEBHOOK_LATENCY_SAMPLES = 1000
+
+# Deploy hooks (deploy_targets setting): commands or HTTP calls pushing a new
+# certificate to each target after issuance or renewal, canary targets first,
+# DEPLOY_PARALLELISM at a time (override with deploy_parallelism)
+DEPLOY_PARALLELISM = 8
+DEPLOY_TIMEOUT_SECONDS = 60
+DEPLOY_OUTPUT_CHARS = 2000
+
+# API tokens issued through /api/tokens, stored as SHA-256 hashes. Each is
+# limited to its domains (unless admin) and rate limited by a token bucket
+# refilling `rate` requests per second up to `burst`, per worker.
+API_TOKENS_FILE = DATA_DIR / "api_tokens.json"
+API_TOKEN_DEFAULT_RATE_LIMIT = {'rate': 5, 'burst': 60}
+
+# Domain entries edited one at a time through /api/domains: DNS providers an
+# entry may name, and the most adds and removes per bulk request
+SUPPORTED_DNS_PROVIDERS = (
+    'cloudflare', 'route53', 'azure', 'google', 'powerdns', 'digitalocean', 'linode', 'gandi', 'ovh',
+    'namecheap', 'vultr', 'dnsmadeeasy', 'nsone', 'rfc2136', 'hetzner', 'porkbun', 'godaddy', 'he-ddns', 'dynudns'
+)
+DOMAIN_FIELDS = ('dns_provider', 'key_type', 'key_size', 'preferred_chain')
+MAX_DOMAIN_BATCH = 1000
+
+# Certificate import (certmate_import.py, POST /api/certificates/import):
+# certificates are parsed and checked by a process pool, IMPORT_CHUNK_SIZE
+# directories per task, and the status of imports started through the API is
+# kept in IMPORTS_DIR
+IMPORTS_DIR = DATA_DIR / "imports"
+IMPORT_CHUNK_SIZE = 32
+
+# Order preflight: CAA and DNS delegation checks run before an order is
+# placed, PREFLIGHT_WORKERS domains at a time, through a resolver (the
+# system's, or the nameservers of the preflight setting) whose answers are
+# cached for their TTL
+DEFAULT_PREFLIGHT_SETTINGS = {
+    'enabled': True,
+    'nameservers': None,  # e.g. ["127.0.0.1:5353"]; defaults to /etc/resolv.conf
+    'timeout': 5,
+    'provider_nameservers': {}  # provider -> nameserver name suffixes, adding to the built-in ones
+}
+PREFLIGHT_WORKERS = 32
+PREFLIGHT_DNS_CACHE_SIZE = 10000
+# CAA issuer domain names of well-known ACME directories; other directories
+# need caa_identities in their acme_accounts entry to be checked
+ACME_CAA_IDENTITIES = {
+    'acme-v02.api.letsencrypt.org': ['letsencrypt.org'],
+    'acme-staging-v02.api.letsencrypt.org': ['letsencrypt.org'],
+    'acme.zerossl.com': ['sectigo.com'],
+    'dv.acme-v02.api.pki.goog': ['pki.goog'],
+    'acme.ssl.com': ['ssl.com'],
+    'api.buypass.com': ['buypass.com']
+}
+# Nameservers of the zones hosted by each DNS provider. Self-hosted providers
+# (powerdns, rfc2136) are only checked against the provider_nameservers setting.
+PROVIDER_NAMESERVER_PATTERNS = {
+    'cloudflare': r'\.ns\.cloudflare\.com$',
+    'route53': r'\.awsdns-\d+\.(com|net|org|co\.uk)$',
+    'azure': r'\.azure-dns\.(com|net|org|info)$',
+    'google': r'\.googledomains\.com$',
+    'digitalocean': r'\.digitalocean\.com$',
+    'linode': r'\.linode\.com$',
+    'gandi': r'\.gandi\.net$',
+    'ovh': r'\.(ovh\.net|ovh\.ca|anycast\.me)$',
+    'namecheap': r'\.registrar-servers\.com$',
+    'vultr': r'\.vultr\.com$',
+    'dnsmadeeasy': r'\.dnsmadeeasy\.com$',
+    'nsone': r'\.nsone\.net$',
+    'hetzner': r'\.(hetzner\.com|hetzner\.de|your-server\.de|second-ns\.(de|com))$',
+    'porkbun': r'\.porkbun\.com$',
+    'godaddy': r'\.domaincontrol\.com$',
+    'he-ddns': r'\.he\.net$',
+    'dynudns': r'\.dynu\.com$'
+}
+
+# Background scheduler, started by start_background_services in one worker only
+scheduler = None
+SCHEDULER_LOCK_FILE = DATA_DIR / "scheduler.lock"
+_scheduler_lock_handle = None
+_background_pid = None
+_background_retry_at = 0
+_background_lock = threading.Lock()
+
+def init_directories():
+    """Create the certificate and data directories, falling back to temporary ones"""
+    global CERT_DIR, DATA_DIR, SETTINGS_FILE, INVENTORY_DB_FILE, SCHEDULER_LOCK_FILE, JOBS_DIR, KEY_POOL_DIR, \
+        RATE_LIMIT_LEDGER_FILE, ACME_HEALTH_FILE, WEBHOOK_DIR, API_TOKENS_FILE, IMPORTS_DIR, \
+        SINGLEFLIGHT_DIR
+    try:
+        CERT_DIR.mkdir(exist_ok=True)
+        DATA_DIR.mkdir(exist_ok=True)
+        JOBS_DIR.mkdir(exist_ok=True)
+        
+        # Verify directory permissions
+        if not os.access(CERT_DIR, os.W_OK):
+            logger.error(f"No write permission for certificates directory: {CERT_DIR}")
+        if not os.access(DATA_DIR, os.W_OK):
+            logger.error(f"No write permission for data directory: {DATA_DIR}")
+            
+    except Exception as e:
+        logger.error(f"Failed to create required directories: {e}")
+        # Use temporary directories as fallback
+        CERT_DIR = Path(tempfile.mkdtemp(prefix="certmate_certs_"))
+        DATA_DIR = Path(tempfile.mkdtemp(prefix="certmate_data_"))
+        SETTINGS_FILE = DATA_DIR / "settings.json"
+        SCHEDULER_LOCK_FILE = DATA_DIR / "scheduler.lock"
+        JOBS_DIR = DATA_DIR / "jobs"
+        JOBS_DIR.mkdir(exist_ok=True)
+        KEY_POOL_DIR = DATA_DIR / "keypool"
+        RATE_LIMIT_LEDGER_FILE = DATA_DIR / "rate_limits.json"
+        ACME_HEALTH_FILE = DATA_DIR / "acme_accounts.json"
+        WEBHOOK_DIR = DATA_DIR / "webhooks"
+        API_TOKENS_FILE = DATA_DIR / "api_tokens.json"
+        IMPORTS_DIR = DATA_DIR / "imports"
+        SINGLEFLIGHT_DIR = DATA_DIR / "singleflight"
+        if 'CERTMATE_INVENTORY_DB' not in os.environ:
+            INVENTORY_DB_FILE = DATA_DIR / "inventory.db"
+        logger.warning(f"Using temporary directories - certificates may not persist")
+
+# Parsed settings shared by read-only callers, keyed by settings file mtime and size
+_settings_cache = {}
+_settings_cache_lock = threading.Lock()
+_settings_lock_local = threading.local()
 
 def load_settings():
     """Load settings from file with improved error handling"""
@@ -129,6 +436,24 @@ def load_settings():
         logger.error(f"Error loading settings: {e}")
         return default_settings
 
+def load_settings_cached():
+    """Return settings, re-reading settings.json only when the file changes
+
+    The returned dict is shared between requests and must not be modified;
+    use load_settings() for read-modify-write.
+    """
+    try:
+        stat = SETTINGS_FILE.stat()
+        file_key = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return load_settings()
+    
+    with _settings_cache_lock:
+        if _settings_cache.get('key') != file_key:
+            _settings_cache['settings'] = load_settings()
+            _settings_cache['key'] = file_key
+        return _settings_cache['settings']
+
 def save_settings(settings):
     """Save settings to file with improved error handling and validation"""
     try:
@@ -160,19 +485,228 @@ def save_settings(settings):
                     is_valid, domain_or_error = validate_domain(domain_entry['domain'])
                     if is_valid:
                         domain_entry['domain'] = domain_or_error
+                        is_valid, key_settings = validate_key_settings(domain_entry)
+                        if is_valid:
+                            domain_entry.update({key: value for key, value in key_settings.items() if value is not None})
+                        else:
+                            logger.warning(f"Invalid key settings for {domain_or_error} ignored: {key_settings}")
+                            for key in ('key_type', 'key_size', 'preferred_chain'):
+                                domain_entry.pop(key, None)
                         validated_domains.append(domain_entry)
                     else:
                         logger.warning(f"Invalid domain in object skipped: {domain_or_error}")
             settings['domains'] = validated_domains
         
-        return safe_file_write(SETTINGS_FILE, settings)
+        if 'webhooks' in settings:
+            validated_webhooks = []
+            names = set()
+            for webhook in settings['webhooks'] or []:
+                is_valid, webhook_error = validate_webhook(webhook)
+                if is_valid and webhook['name'] in names:
+                    is_valid, webhook_error = False, f"duplicate name {webhook['name']}"
+                if is_valid:
+                    names.add(webhook['name'])
+                    validated_webhooks.append(webhook)
+                else:
+                    logger.warning(f"Invalid webhook skipped: {webhook_error}")
+            settings['webhooks'] = validated_webhooks
+        
+        if 'deploy_targets' in settings:
+            validated_targets = []
+            names = set()
+            for target in settings['deploy_targets'] or []:
+                is_valid, target_error = validate_deploy_target(target)
+                if is_valid and target['name'] in names:
+                    is_valid, target_error = False, f"duplicate name {target['name']}"
+                if is_valid:
+                    names.add(target['name'])
+                    validated_targets.append(target)
+                else:
+                    logger.warning(f"Invalid deploy target skipped: {target_error}")
+            settings['deploy_targets'] = validated_targets
+        
+        if 'acme_accounts' in settings:
+            validated_accounts = []
+            names = set()
+            for account in settings['acme_accounts'] or []:
+                is_valid, account_error = validate_acme_account(account)
+                name = account.get('name') if isinstance(account, dict) else None
+                if is_valid and name and name in names:
+                    is_valid, account_error = False, f"duplicate name {name}"
+                if is_valid:
+                    names.add(name)
+                    validated_accounts.append(account)
+                else:
+                    logger.warning(f"Invalid ACME account skipped: {account_error}")
+            settings['acme_accounts'] = validated_accounts
+        
+        if settings.get('preflight') is not None:
+            is_valid, preflight_error = validate_preflight_settings(settings['preflight'])
+            if not is_valid:
+                logger.warning(f"Invalid preflight setting ignored: {preflight_error}")
+                del settings['preflight']
+        
+        with settings_lock():
+            if not write_settings_file(settings):
+                return False
+            inventory_sync_domains(settings)
+        return True
         
     except Exception as e:
         logger.error(f"Error saving settings: {e}")
         return False
 
+@contextmanager
+def settings_lock():
+    """Hold the settings lock across workers (re-entrant within a thread)
+    
+    Read-modify-write updates hold it from reading settings.json to writing
+    it back, so concurrent updates from any worker are applied one after
+    the other instead of overwriting each other.
+    """
+    if getattr(_settings_lock_local, 'held', False):
+        yield
+        return
+    SETTINGS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(SETTINGS_FILE.with_name('.settings.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        _settings_lock_local.held = True
+        try:
+            yield
+        finally:
+            _settings_lock_local.held = False
+
+def write_settings_file(settings):
+    """Replace settings.json atomically, so readers never see a partial file"""
+    tmp_file = SETTINGS_FILE.with_name('.settings.json.tmp')
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(settings, f, indent=2)
+        if SETTINGS_FILE.exists():
+            # Keep the permissions given to the file (it holds credentials)
+            shutil.copymode(SETTINGS_FILE, tmp_file)
+        os.replace(tmp_file, SETTINGS_FILE)
+        return True
+    except Exception as e:
+        logger.error(f"Error writing to {SETTINGS_FILE}: {e}")
+        return False
+
+@contextmanager
+def settings_update():
+    """Lock settings and yield them fresh from disk, writing them back if the block succeeds
+    
+    Unlike save_settings nothing is re-validated: the caller validates what
+    it changed.
+    """
+    with settings_lock():
+        settings = load_settings()
+        yield settings
+        if not write_settings_file(settings):
+            raise OSError("Failed to write settings")
+
+# API tokens
+# Besides the api_bearer_token setting (full access), tokens can be issued
+# through /api/tokens. Only their SHA-256 hashes are stored, in
+# API_TOKENS_FILE, and each worker keeps them in a dict keyed by hash that is
+# reloaded when the file or the settings change, so verifying a token is one
+# hash and one lookup. Tokens are random, so a fast hash is enough.
+_token_index = {'settings': None, 'tokens_key': None, 'by_hash': {}, 'server_token_error': None}
+_token_index_lock = threading.Lock()
+_token_buckets = {}  # token id -> [tokens, last refill], per worker
+_token_buckets_lock = threading.Lock()
+
+def hash_api_token(token):
+    """Return the stored form of an API token"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def load_api_tokens():
+    """Return the issued token records (with hashes, never the tokens themselves)"""
+    if not API_TOKENS_FILE.exists():
+        return []
+    return safe_file_read(API_TOKENS_FILE, is_json=True) or []
+
+@contextmanager
+def api_token_store():
+    """Lock the token store across workers and yield its records, saving them on exit"""
+    API_TOKENS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(API_TOKENS_FILE.with_suffix('.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        tokens = load_api_tokens()
+        yield tokens
+        tmp_file = API_TOKENS_FILE.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(tokens, f, indent=2)
+        os.chmod(tmp_file, 0o600)
+        os.replace(tmp_file, API_TOKENS_FILE)
+
+def get_token_index():
+    """Return the hash -> token record index, rebuilt when tokens or settings change"""
+    settings = load_settings_cached()
+    try:
+        stat = API_TOKENS_FILE.stat()
+        tokens_key = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        tokens_key = None
+    
+    with _token_index_lock:
+        # load_settings_cached returns the same dict until settings.json changes
+        if _token_index['settings'] is settings and _token_index['tokens_key'] == tokens_key:
+            return _token_index
+        by_hash = {}
+        for record in load_api_tokens():
+            if not record.get('revoked_at'):
+                by_hash[record['hash']] = record
+        # The settings token is checked for strength once per change, not per request
+        server_token = settings.get('api_bearer_token')
+        is_valid, validation_error = validate_api_token(server_token)
+        if is_valid:
+            by_hash[hash_api_token(server_token)] = {'id': 'settings', 'name': 'api_bearer_token',
+                                                     'admin': True, 'domains': None, 'rate_limit': None}
+        elif server_token:
+            logger.error(f"Server has weak API token: {validation_error}")
+        _token_index.update(settings=settings, tokens_key=tokens_key, by_hash=by_hash,
+                            server_token_error=None if is_valid else ('WEAK_SERVER_TOKEN' if server_token else 'SERVER_CONFIG_ERROR'))
+        return _token_index
+
+def token_allows_domain(record, domain):
+    """Whether a token's domain scope covers a domain ("*.example.com" covers its subdomains)"""
+    if record.get('admin') or record.get('domains') is None:
+        return True
+    for pattern in record['domains']:
+        if pattern == domain or (pattern.startswith('*.') and domain.endswith(pattern[1:])):
+            return True
+    return False
+
+def take_token_request(record):
+    """Take one request from a token's bucket, returning 0 or the seconds until one is available"""
+    limit = record.get('rate_limit')
+    if not limit:
+        return 0
+    now = time.monotonic()
+    with _token_buckets_lock:
+        bucket = _token_buckets.setdefault(record['id'], [float(limit['burst']), now])
+        bucket[0] = min(float(limit['burst']), bucket[0] + (now - bucket[1]) * limit['rate'])
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / limit['rate']
+
+def allow_scoped_tokens(f):
+    """Mark an endpoint without a domain as usable by domain-scoped tokens
+    
+    The endpoint must itself limit what it returns with token_allows_domain.
+    """
+    f.allow_scoped_tokens = True
+    return f
+
 def require_auth(f):
-    """Enhanced decorator to require bearer token authentication"""
+    """Enhanced decorator to require bearer token authentication
+    
+    Tokens that are not admin tokens may only read (GET) endpoints for a
+    domain in their scope, or endpoints marked with allow_scoped_tokens.
+    The verified token record is available as g.api_token.
+    """
     @wraps(f)
     def decorated_function(*args, **kwargs):
         auth_header = request.headers.get('Authorization')
@@ -186,25 +720,99 @@ def require_auth(f):
         except ValueError:
             return {'error': 'Invalid authorization header format. Use: Bearer <token>', 'code': 'INVALID_AUTH_FORMAT'}, 401
         
-        settings = load_settings()
-        expected_token = settings.get('api_bearer_token')
-        
-        if not expected_token:
-            return {'error': 'Server configuration error: no API token configured', 'code': 'SERVER_CONFIG_ERROR'}, 500
-            
-        # Validate token strength
-        is_valid, validation_error = validate_api_token(expected_token)
-        if not is_valid:
-            logger.error(f"Server has weak API token: {validation_error}")
-            return {'error': 'Server security configuration error', 'code': 'WEAK_SERVER_TOKEN'}, 500
-        
-        if not secrets.compare_digest(token, expected_token):
+        index = get_token_index()
+        record = index['by_hash'].get(hash_api_token(token))
+        if record is None:
+            if not index['by_hash'] and index['server_token_error'] == 'SERVER_CONFIG_ERROR':
+                return {'error': 'Server configuration error: no API token configured', 'code': 'SERVER_CONFIG_ERROR'}, 500
+            if not index['by_hash'] and index['server_token_error'] == 'WEAK_SERVER_TOKEN':
+                return {'error': 'Server security configuration error', 'code': 'WEAK_SERVER_TOKEN'}, 500
             logger.warning(f"Invalid token attempt from {request.remote_addr}")
             return {'error': 'Invalid or expired token', 'code': 'INVALID_TOKEN'}, 401
         
+        if record.get('expires_at') and record['expires_at'] < time.time():
+            return {'error': 'Invalid or expired token', 'code': 'INVALID_TOKEN'}, 401
+        
+        if not record.get('admin'):
+            domain = kwargs.get('domain')
+            if request.method != 'GET' or (domain is None and not getattr(f, 'allow_scoped_tokens', False)):
+                return {'error': 'Token does not allow this operation', 'code': 'TOKEN_SCOPE'}, 403
+            if domain is not None and not token_allows_domain(record, domain):
+                return {'error': f'Token is not valid for {domain}', 'code': 'TOKEN_SCOPE'}, 403
+        
+        wait = take_token_request(record)
+        if wait:
+            return {'error': 'Token rate limit exceeded', 'code': 'RATE_LIMITED'}, 429, {'Retry-After': str(math.ceil(wait))}
+        
+        g.api_token = record
         return f(*args, **kwargs)
     return decorated_function
 
+def validate_token_request(data):
+    """Validate a token issuance request, returning (True, record fields) or (False, error)"""
+    if not isinstance(data, dict):
+        return False, "Request body must be an object"
+    name = data.get('name')
+    if not isinstance(name, str) or not name.strip():
+        return False, "name is required"
+    domains = data.get('domains')
+    if domains is not None:
+        if not isinstance(domains, list) or not all(isinstance(domain, str) for domain in domains):
+            return False, "domains must be a list of domain names"
+        validated = []
+        for domain in domains:
+            is_valid, domain_or_error = validate_domain(domain[2:] if domain.startswith('*.') else domain)
+            if not is_valid:
+                return False, f"Invalid domain {domain!r}: {domain_or_error}"
+            validated.append(f"*.{domain_or_error}" if domain.startswith('*.') else domain_or_error)
+        domains = validated
+    admin = bool(data.get('admin', False))
+    if not admin and domains is None:
+        return False, "domains is required for tokens that are not admin tokens"
+    rate_limit = data.get('rate_limit', API_TOKEN_DEFAULT_RATE_LIMIT)
+    if rate_limit is not None and (not isinstance(rate_limit, dict)
+                                   or not isinstance(rate_limit.get('rate'), (int, float)) or rate_limit['rate'] <= 0
+                                   or not isinstance(rate_limit.get('burst'), int) or rate_limit['burst'] < 1):
+        return False, "rate_limit must have a positive rate (requests per second) and burst"
+    expires_in_days = data.get('expires_in_days')
+    if expires_in_days is not None and (not isinstance(expires_in_days, int) or expires_in_days < 1):
+        return False, "expires_in_days must be a positive integer"
+    return True, {
+        'name': name.strip(),
+        'domains': domains,
+        'admin': admin,
+        'rate_limit': rate_limit,
+        'expires_at': time.time() + expires_in_days * 86400 if expires_in_days else None
+    }
+
+def issue_api_token(fields):
+    """Create a token, returning (token, record); the token itself is not stored"""
+    token = f"cm_{secrets.token_urlsafe(32)}"
+    record = {
+        'id': secrets.token_hex(8),
+        **fields,
+        'hash': hash_api_token(token),
+        'prefix': token[:8],
+        'created_at': time.time(),
+        'revoked_at': None
+    }
+    with api_token_store() as tokens:
+        tokens.append(record)
+    return token, record
+
+def revoke_api_token(token_id):
+    """Revoke a token, returning its record or None if there is no such token"""
+    with api_token_store() as tokens:
+        for record in tokens:
+            if record['id'] == token_id:
+                record['revoked_at'] = record['revoked_at'] or time.time()
+                return record
+    return None
+
+def public_token_record(record):
+    """A token record as shown by the API, without its hash"""
+    return {key: value for key, value in record.items() if key != 'hash'}
+
 def create_cloudflare_config(token):
     """Create Cloudflare credentials file"""
     config_dir = Path("letsencrypt/config")
@@ -474,128 +1082,2869 @@ def create_multi_provider_config(provider, config_data):
     # Set proper permissions
     config_file.chmod(0o600)
     return config_file
-def get_certificate_info(domain):
-    """Get certificate information for a domain"""
-    cert_path = CERT_DIR / domain
-    if not cert_path.exists():
-        return {
-            'domain': domain,
-            'exists': False,
-            'expiry_date': None,
-            'days_left': None,
-            'days_until_expiry': None,
-            'needs_renewal': False,
-            'dns_provider': None
-        }
+
+# JSON responses
+# List and bulk endpoints serialize with orjson when it is installed, bypassing
+# flask-restx marshalling, and can stream NDJSON (one JSON document per line)
+# from a generator, so a full export never holds the whole result in memory.
+# Both are gzip-compressed when the client sends Accept-Encoding: gzip.
+
+def dump_json(obj):
+    """Serialize obj to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def wants_ndjson():
+    """Whether the request asked for NDJSON (format=ndjson or the Accept header)"""
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def accepts_gzip():
+    """Whether the client accepts a gzip-encoded response"""
+    return request.accept_encodings['gzip'] > 0
+
+def gzip_chunks(chunks):
+    """Gzip a stream of byte chunks, flushing after each so clients can decode as it arrives"""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+def json_response(data, status=200, headers=None):
+    """Build a JSON response, gzip-compressed when the client accepts it"""
+    body = dump_json(data)
+    response = Response(body, status=status, mimetype='application/json', headers=headers)
+    response.vary.add('Accept-Encoding')
+    if len(body) >= GZIP_MIN_BYTES and accepts_gzip():
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def ndjson_response(items, headers=None):
+    """Stream an iterable as NDJSON, one item per line, gzip-compressed when the client accepts it
+
+    Items are serialized as they are produced and written in chunks of about
+    NDJSON_CHUNK_BYTES, so memory use does not grow with the number of items.
+    """
+    def chunks():
+        buffer = bytearray()
+        for item in items:
+            buffer += dump_json(item)
+            buffer += b'\n'
+            if len(buffer) >= NDJSON_CHUNK_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+    compress = accepts_gzip()
+    response = Response(gzip_chunks(chunks()) if compress else chunks(), mimetype=NDJSON_MIMETYPE, headers=headers)
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# Singleflight
+# Concurrent identical calls (the same bundle downloaded by many edge agents
+# right after a renewal, the same deployment probe from several dashboard
+# tabs) share one in-flight computation instead of each doing the work. Only
+# calls that overlap are merged; nothing is cached once the call returns.
+# singleflight merges the calls of one worker's threads; shared_singleflight
+# also merges them across worker processes through a lock and result file
+# under SINGLEFLIGHT_DIR.
+_singleflight_calls = {}  # (group, key) -> in-flight call
+_singleflight_stats = {}  # group -> {'calls', 'executions', 'coalesced', 'shared'}
+_singleflight_lock = threading.Lock()
+
+def singleflight(group, key, fn):
+    """Return fn(), sharing the result with concurrent callers using the same group and key
     
-    cert_file = cert_path / "cert.pem"
-    if not cert_file.exists():
-        return {
-            'domain': domain,
-            'exists': False,
-            'expiry_date': None,
-            'days_left': None,
-            'days_until_expiry': None,
-            'needs_renewal': False,
-            'dns_provider': None
-        }
+    Exceptions raised by fn are raised in every caller. Results are shared
+    objects, so callers must not modify them.
+    """
+    with _singleflight_lock:
+        stats = _singleflight_stats.setdefault(group, {'calls': 0, 'executions': 0, 'coalesced': 0, 'shared': 0})
+        stats['calls'] += 1
+        call = _singleflight_calls.get((group, key))
+        if call is None:
+            call = {'done': threading.Event(), 'result': None, 'error': None}
+            _singleflight_calls[(group, key)] = call
+            stats['executions'] += 1
+            leader = True
+        else:
+            stats['coalesced'] += 1
+            leader = False
     
-    # Get DNS provider info from settings
-    settings = load_settings()
-    dns_provider = get_domain_dns_provider(domain, settings)
+    if leader:
+        try:
+            call['result'] = fn()
+        except BaseException as e:
+            call['error'] = e
+        finally:
+            with _singleflight_lock:
+                del _singleflight_calls[(group, key)]
+            call['done'].set()
+    else:
+        call['done'].wait()
     
-    try:
-        # Get certificate expiry using openssl
-        result = subprocess.run([
-            'openssl', 'x509', '-in', str(cert_file), '-noout', '-dates'
-        ], capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            lines = result.stdout.strip().split('\n')
-            not_after = None
-            for line in lines:
-                if line.startswith('notAfter='):
-                    not_after = line.split('=', 1)[1]
-                    break
+    if call['error'] is not None:
+        raise call['error']
+    return call['result']
+
+def shared_singleflight(group, key, fn):
+    """Like singleflight, but also sharing the result with overlapping calls in other worker processes
+    
+    The first caller runs fn holding a file lock for the key; callers that
+    were waiting for the lock read the result it wrote instead of running fn
+    again. fn must return a JSON-serializable value.
+    """
+    def across_processes():
+        result_file = SINGLEFLIGHT_DIR / group / f"{hashlib.sha256(key.encode()).hexdigest()[:32]}.json"
+        requested_at = time.time_ns()
+        result_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(result_file.with_suffix('.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                with open(result_file) as f:
+                    shared = json.load(f)
+                if shared['finished_at'] >= requested_at:
+                    with _singleflight_lock:
+                        _singleflight_stats[group]['shared'] += 1
+                    return shared['result']
+            except (OSError, ValueError, KeyError):
+                pass
             
-            if not_after:
-                # Parse the date
-                from datetime import datetime
+            result = fn()
+            tmp_file = result_file.with_name(f".{result_file.name}.{os.getpid()}")
+            with open(tmp_file, 'w') as f:
+                json.dump({'finished_at': time.time_ns(), 'result': result}, f)
+            os.replace(tmp_file, result_file)
+            return result
+    return singleflight(group, key, across_processes)
+
+def singleflight_stats():
+    """Return this worker's singleflight counters per group"""
+    with _singleflight_lock:
+        return {group: dict(stats, in_flight=sum(1 for call_group, _ in _singleflight_calls if call_group == group))
+                for group, stats in _singleflight_stats.items()}
+
+# Certificate storage
+# Each issuance lives in an immutable CERT_DIR/<domain>/v<serial>/ directory and
+# CERT_DIR/<domain>/current is a symlink to the live version, swapped atomically.
+# The top-level CERT_DIR/<domain>/<file>.pem names point through current/ so
+# existing consumers of those paths keep working.
+_bundle_cache = OrderedDict()  # domain -> (version directory, ZIP bytes)
+_bundle_cache_lock = threading.Lock()
+
+def get_certificate_dir(domain):
+    """Return the directory holding a domain's current certificate files
+    
+    The current symlink is resolved once so that callers reading several
+    files always see the same version, even if a renewal swaps it meanwhile.
+    """
+    domain_dir = CERT_DIR / domain
+    current = domain_dir / "current"
+    if current.is_symlink():
+        try:
+            return current.resolve(strict=True)
+        except OSError:
+            logger.error(f"Dangling current certificate link for {domain}")
+    # Certificates written before versioned directories were introduced
+    return domain_dir
+
+def _replace_symlink(link_path, target):
+    """Atomically point link_path at target, replacing any existing file or link"""
+    tmp_link = link_path.with_name(f".{link_path.name}.{secrets.token_hex(4)}")
+    os.symlink(target, tmp_link)
+    try:
+        os.replace(tmp_link, link_path)
+    except OSError:
+        tmp_link.unlink(missing_ok=True)
+        raise
+
+def install_certificate_version(domain, src_dir):
+    """Publish the certificate files in src_dir as the domain's current version
+    
+    Files are hardlinked from certbot's archive (live/ only holds symlinks into
+    it) and copied only when linking is not possible, e.g. across filesystems.
+    Returns the version directory.
+    """
+    src_cert = src_dir / "cert.pem"
+    metadata = parse_certificate_metadata(src_cert)
+    if metadata is None:
+        raise ValueError(f"No readable certificate in {src_dir}")
+    
+    domain_dir = CERT_DIR / domain
+    domain_dir.mkdir(exist_ok=True)
+    version_dir = domain_dir / f"v{metadata['serial']}"
+    
+    if not version_dir.exists():
+        staging_dir = Path(tempfile.mkdtemp(prefix=f".{version_dir.name}.", dir=domain_dir))
+        try:
+            for file_name in CERTIFICATE_FILES:
+                src_file = src_dir / file_name
+                if not src_file.exists():
+                    continue
+                src_file = src_file.resolve()
                 try:
-                    expiry_date = datetime.strptime(not_after, '%b %d %H:%M:%S %Y %Z')
-                    days_left = (expiry_date - datetime.now()).days
-                    
-                    return {
-                        'domain': domain,
-                        'exists': True,
-                        'expiry_date': expiry_date.strftime('%Y-%m-%d %H:%M:%S'),
-                        'days_left': days_left,
-                        'days_until_expiry': days_left,
-                        'needs_renewal': days_left < 30,
-                        'dns_provider': dns_provider
-                    }
-                except Exception as e:
-                    logger.error(f"Error parsing certificate date: {e}")
-    except Exception as e:
-        logger.error(f"Error getting certificate info: {e}")
+                    os.link(src_file, staging_dir / file_name)
+                except OSError:
+                    shutil.copy2(src_file, staging_dir / file_name)
+            staging_dir.chmod(0o755)
+            os.rename(staging_dir, version_dir)
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            # Another worker may have published the same version first
+            if not version_dir.exists():
+                raise
     
-    return {
-        'domain': domain,
-        'exists': False,
-        'expiry_date': None,
-        'days_left': None,
-        'days_until_expiry': None,
-        'needs_renewal': False,
-        'dns_provider': dns_provider
-    }
+    _replace_symlink(domain_dir / "current", version_dir.name)
+    
+    for file_name in CERTIFICATE_FILES:
+        top_level = domain_dir / file_name
+        if not top_level.is_symlink():
+            _replace_symlink(top_level, f"current/{file_name}")
+    
+    prune_certificate_versions(domain)
+    return version_dir
 
-def create_certificate(domain, email, dns_provider=None, dns_config=None):
-    """Create SSL certificate using Let's Encrypt with configurable DNS challenge"""
+def prune_certificate_versions(domain, keep=None):
+    """Delete the oldest certificate versions beyond the retention setting"""
+    if keep is None:
+        keep = load_settings_cached().get('certificate_versions_to_keep', DEFAULT_CERTIFICATE_VERSIONS_KEPT)
+    keep = max(int(keep), 1)
+    
+    domain_dir = CERT_DIR / domain
+    current = get_certificate_dir(domain)
+    versions = sorted((path for path in domain_dir.glob('v*') if path.is_dir() and not path.is_symlink()),
+                      key=lambda path: path.stat().st_mtime, reverse=True)
+    for version_dir in versions[keep:]:
+        if version_dir.resolve() == current:
+            continue
+        try:
+            shutil.rmtree(version_dir)
+            logger.info(f"Removed old certificate version {version_dir}")
+        except OSError as e:
+            logger.error(f"Error removing certificate version {version_dir}: {e}")
+
+def list_certificate_versions(domain):
+    """Return the version directory names for a domain, newest first"""
+    domain_dir = CERT_DIR / domain
+    versions = [path for path in domain_dir.glob('v*') if path.is_dir()]
+    versions.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+    return [path.name for path in versions]
+
+def get_certificate_bundle(domain):
+    """Return the ZIP bundle of a domain's certificate files, or None if there is none
+    
+    Bundles are cached per version directory; the change watcher drops them
+    when files change in place. The bundle of a version directory is also
+    kept beside its files, built once by whichever worker gets there first.
+    """
+    cert_dir = get_certificate_dir(domain)
+    if not cert_dir.exists():
+        return None
+    
+    with _bundle_cache_lock:
+        cached = _bundle_cache.get(domain)
+        if cached and cached[0] == cert_dir:
+            _bundle_cache.move_to_end(domain)
+            return cached[1]
+    
+    def build():
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip_file:
+            for file_name in CERTIFICATE_FILES:
+                file_path = cert_dir / file_name
+                if file_path.exists():
+                    zip_file.write(file_path, file_name)
+        return buffer.getvalue()
+    
+    def build_shared():
+        # Version directories never change, so their bundle is built once
+        # for all workers; pre-versioning directories change in place
+        if cert_dir == CERT_DIR / domain:
+            return build()
+        bundle_file = cert_dir / ".bundle.zip"
+        try:
+            return bundle_file.read_bytes()
+        except FileNotFoundError:
+            pass
+        with open(cert_dir / ".bundle.lock", 'w') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                bundle = bundle_file.read_bytes()
+                with _singleflight_lock:
+                    _singleflight_stats['bundle']['shared'] += 1
+                return bundle
+            except FileNotFoundError:
+                pass
+            bundle = build()
+            # The bundle holds the private key
+            tmp_file = cert_dir / f".bundle.zip.{os.getpid()}"
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(bundle)
+            os.replace(tmp_file, bundle_file)
+            return bundle
+    
+    # Downloads right after a renewal all miss the cache at once
+    bundle = singleflight('bundle', str(cert_dir), build_shared)
+    
+    with _bundle_cache_lock:
+        _bundle_cache[domain] = (cert_dir, bundle)
+        _bundle_cache.move_to_end(domain)
+        while len(_bundle_cache) > BUNDLE_CACHE_SIZE:
+            _bundle_cache.popitem(last=False)
+    return bundle
+
+def bundle_etag(bundle):
+    """ETag of a certificate bundle, for conditional downloads by sync agents"""
+    return hashlib.sha256(bundle).hexdigest()
+
+def invalidate_certificate_bundle(domain):
+    """Drop the cached bundle of a domain"""
+    with _bundle_cache_lock:
+        _bundle_cache.pop(domain, None)
+
+# Certificate import
+# Existing certificates (a certbot configuration directory, or any tree of
+# directories holding cert.pem and privkey.pem) are published as they are,
+# without re-issuing them. Parsing and checking run in a process pool; the
+# newest valid certificate of each domain is then hardlinked into CERT_DIR
+# and new domains are registered in one settings update. They are renewed
+# like any other certificate when they come due.
+
+def find_import_sources(source):
+    """Return (certificate directory, renewal configuration or None) pairs found under source"""
+    live_dir = source / "live"
+    if live_dir.is_dir():
+        # A certbot configuration directory: one lineage per live/ directory
+        sources = []
+        for entry in sorted(os.scandir(live_dir), key=lambda entry: entry.name):
+            if entry.is_dir():
+                renewal_file = source / "renewal" / f"{entry.name}.conf"
+                sources.append((entry.path, str(renewal_file) if renewal_file.exists() else None))
+        return sources
+    
+    sources = []
+    for dir_path, dir_names, file_names in os.walk(source):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+        if 'cert.pem' in file_names and 'privkey.pem' in file_names:
+            sources.append((dir_path, None))
+    return sources
+
+def inspect_import_source(cert_dir, renewal_file=None):
+    """Parse and check a certificate directory for import_certificates (runs in a pool process)
+    
+    Returns the certificate's metadata with the domain and DNS provider to
+    register, {'source': ..., 'error': ...}, or {..., 'skip_reason': ...} for
+    certificates a renewal would not reproduce.
+    """
+    cert_path = Path(cert_dir)
     try:
-        # Enhanced input validation
-        if not domain or not isinstance(domain, str):
-            return False, "Invalid domain provided"
-            
-        # Validate domain format and security
-        is_valid_domain, domain_error = validate_domain(domain)
-        if not is_valid_domain:
-            return False, f"Domain validation failed: {domain_error}"
-        domain = domain_error  # validated domain
-        
-        # Validate email
-        is_valid_email, email_error = validate_email(email)
-        if not is_valid_email:
-            return False, f"Email validation failed: {email_error}"
-        email = email_error  # validated email
-        
-        # Load settings to get DNS provider configuration
-        settings = load_settings()
-        
-        # Use provided DNS provider or fall back to settings
-        if not dns_provider:
-            dns_provider = settings.get('dns_provider', 'cloudflare')
-        
-        if not dns_config:
-            dns_config = settings.get('dns_providers', {}).get(dns_provider, {})
-        
-        # Create config file based on DNS provider
-        config_file = None
-        dns_plugin = None
-        dns_args = []
+        cert = x509.load_pem_x509_certificate((cert_path / "cert.pem").read_bytes())
+        private_key = serialization.load_pem_private_key((cert_path / "privkey.pem").read_bytes(), password=None)
+    except (OSError, ValueError, TypeError) as e:
+        return {'source': cert_dir, 'error': f"Unreadable certificate or private key: {e}"}
+    
+    public_der = cert.public_key().public_bytes(serialization.Encoding.DER,
+                                                serialization.PublicFormat.SubjectPublicKeyInfo)
+    key_der = private_key.public_key().public_bytes(serialization.Encoding.DER,
+                                                    serialization.PublicFormat.SubjectPublicKeyInfo)
+    if public_der != key_der:
+        return {'source': cert_dir, 'error': "Private key does not match the certificate"}
+    fullchain_file = cert_path / "fullchain.pem"
+    if fullchain_file.exists():
+        try:
+            if x509.load_pem_x509_certificate(fullchain_file.read_bytes()) != cert:
+                return {'source': cert_dir, 'error': "fullchain.pem does not start with the certificate"}
+        except (OSError, ValueError) as e:
+            return {'source': cert_dir, 'error': f"Unreadable fullchain.pem: {e}"}
+    
+    metadata = parse_certificate_metadata(cert_path / "cert.pem")
+    if metadata is None:
+        return {'source': cert_dir, 'error': "Unreadable certificate"}
+    
+    # The lineage directory name when it is one of the names, else the first name
+    names = [name.lower() for name in metadata['sans']]
+    if not names:
+        names = [attribute.value.lower() for attribute in cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)]
+    domain = cert_path.name.lower() if cert_path.name.lower() in names else next(
+        (name for name in names if not name.startswith('*.')), names[0][2:] if names else None)
+
+    # Renewals order exactly the domain and its wildcard, so any other name
+    # would be lost and a wildcard-only certificate does not cover its domain
+    if domain is None or domain not in names or not set(names) <= {domain, f'*.{domain}'}:
+        return {'source': cert_dir, 'domain': domain,
+                'skip_reason': f"names {', '.join(names) or '(none)'} are not exactly a domain and its wildcard"}
+
+    dns_provider = None
+    if renewal_file:
+        import configparser
+        parser = configparser.ConfigParser(interpolation=None)
+        try:
+            # Lineage settings come before the first section
+            parser.read_string("[lineage]\n" + Path(renewal_file).read_text())
+            authenticator = parser.get('renewalparams', 'authenticator', fallback='')
+        except (OSError, configparser.Error):
+            authenticator = ''
+        if authenticator.startswith('dns-') and authenticator[4:] in SUPPORTED_DNS_PROVIDERS:
+            dns_provider = authenticator[4:]
+    
+    return {'source': cert_dir, 'domain': domain, 'dns_provider': dns_provider,
+            'chain_size': certificate_chain_size(cert_path), **metadata}
+
+def import_certificates(source, dns_provider=None, overwrite=False, dry_run=False, workers=None):
+    """Import the certificates found under source without re-issuing them
+    
+    Certificates that are expired, fail their checks, or expire no later than
+    the certificate already installed for their domain (unless overwrite)
+    are skipped. Domains not configured yet are registered with the DNS
+    provider from their certbot renewal configuration, else dns_provider,
+    else the default. Returns a summary of what was (or, with dry_run, would
+    be) imported.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    started = time.monotonic()
+    source = Path(source)
+    if not source.is_dir():
+        raise ValueError(f"{source} is not a directory")
+    
+    sources = find_import_sources(source)
+    summary = {'source': str(source), 'found': len(sources), 'imported': [], 'registered': 0,
+               'skipped': [], 'errors': [], 'dry_run': dry_run}
+    candidates = {}
+    if sources:
+        # Spawned rather than forked: the workers running this are multi-threaded
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = executor.map(inspect_import_source, *zip(*sources), chunksize=IMPORT_CHUNK_SIZE)
+            for result in results:
+                if 'error' in result:
+                    summary['errors'].append(result)
+                    continue
+                if 'skip_reason' in result:
+                    summary['skipped'].append({'source': result['source'], 'domain': result['domain'],
+                                               'reason': result['skip_reason']})
+                    continue
+                is_valid, domain_or_error = validate_domain(result['domain'])
+                if not is_valid:
+                    summary['errors'].append({'source': result['source'], 'error': f"No usable domain name: {domain_or_error}"})
+                    continue
+                result['domain'] = domain_or_error
+                if result['expires_at'] <= time.time():
+                    summary['skipped'].append({'source': result['source'], 'domain': result['domain'], 'reason': 'expired'})
+                    continue
+                best = candidates.get(result['domain'])
+                if best is not None and best['expires_at'] >= result['expires_at']:
+                    best, result = result, best
+                if best is not None:
+                    summary['skipped'].append({'source': best['source'], 'domain': best['domain'],
+                                               'reason': 'a later certificate for the domain was found'})
+                candidates[result['domain']] = result
+    
+    settings = load_settings_cached()
+    new_entries = []
+    for domain, candidate in sorted(candidates.items()):
+        current_cert = get_certificate_dir(domain) / "cert.pem"
+        if not overwrite and current_cert.exists():
+            current = parse_certificate_metadata(current_cert)
+            if current and current['expires_at'] >= candidate['expires_at']:
+                summary['skipped'].append({'source': candidate['source'], 'domain': domain,
+                                           'reason': 'the installed certificate expires as late or later'})
+                continue
         
-        if dns_provider == 'cloudflare':
-            token = dns_config.get('api_token') or settings.get('cloudflare_token', '')  # Backward compatibility
-            if not token:
-                return False, "Cloudflare API token not configured"
-            config_file = create_cloudflare_config(token)
-            dns_plugin = 'cloudflare'
-            dns_args = ['--dns-cloudflare-credentials', str(config_file), '--dns-cloudflare-propagation-seconds', '60']
-            
-        elif dns_provider == 'route53':
-            access_key = dns_config.get('access_key_id', '')
-            secret_key = dns_config.get('secret_access_key', '')
-            if not access_key or not secret_key:
-                return False, "AWS Route53 credentials not configured"
+        configured = find_domain_entry(settings, domain) is not None
+        if not dry_run:
+            try:
+                install_certificate_version(domain, Path(candidate['source']))
+            except (OSError, ValueError) as e:
+                summary['errors'].append({'source': candidate['source'], 'error': f"Install failed: {e}"})
+                continue
+            invalidate_certificate_bundle(domain)
+            if configured:
+                inventory_update_certificate(domain)
+            inventory_record_event(domain, 'import', True, f"Imported from {candidate['source']}")
+        if not configured:
+            provider = candidate['dns_provider'] or dns_provider
+            new_entries.append({'domain': domain, **({'dns_provider': provider} if provider else {})})
+        summary['imported'].append(domain)
+    
+    if dry_run:
+        summary['registered'] = len(new_entries)
+    elif new_entries:
+        # Registering also loads the installed certificates into the inventory
+        summary['registered'] = len(change_domains(add=new_entries)['added'])
+    
+    summary['seconds'] = round(time.monotonic() - started, 2)
+    logger.info(f"{'Would import' if dry_run else 'Imported'} {len(summary['imported'])} of {summary['found']} certificates from {source} "
+                f"({summary['registered']} new domains, {len(summary['errors'])} errors) in {summary['seconds']}s")
+    return summary
+
+def save_import_status(status):
+    """Persist the status of an API import so that every worker can report on it"""
+    status_file = IMPORTS_DIR / f"{status['id']}.json"
+    tmp_file = status_file.with_suffix('.tmp')
+    try:
+        IMPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        with open(tmp_file, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmp_file, status_file)
+    except Exception as e:
+        logger.error(f"Error saving import {status['id']}: {e}")
+
+def load_import_status(import_id):
+    """Load the status of an API import by ID, or None if it does not exist"""
+    if not JOB_ID_PATTERN.match(import_id or ''):
+        return None
+    status_file = IMPORTS_DIR / f"{import_id}.json"
+    if not status_file.exists():
+        return None
+    return safe_file_read(status_file, is_json=True)
+
+def start_import(source, dns_provider=None, overwrite=False, dry_run=False):
+    """Run import_certificates in a background thread, returning its status record
+    
+    Large imports take longer than a request may, so the caller polls the
+    status with load_import_status.
+    """
+    status = {'id': secrets.token_hex(8), 'source': str(source), 'status': 'running',
+              'created_at': datetime.now().isoformat(), 'finished_at': None, 'result': None, 'message': None}
+    save_import_status(status)
+    
+    def run():
+        try:
+            status['result'] = import_certificates(source, dns_provider, overwrite, dry_run)
+            status['status'] = 'succeeded'
+        except Exception as e:
+            logger.error(f"Certificate import {status['id']} from {source} failed: {e}")
+            status.update(status='failed', message=str(e))
+        status['finished_at'] = datetime.now().isoformat()
+        save_import_status(status)
+    
+    threading.Thread(target=run, name=f"import-{status['id']}", daemon=True).start()
+    return status
+
+# Order preflight
+# Orders that cannot succeed (a CAA record forbidding every configured CA, a
+# zone not delegated to the domain's DNS provider) would only fail after
+# certbot spent minutes on DNS propagation and used up CA rate limit. They are
+# rejected before the order instead. Checks that cannot be completed (DNS
+# timeouts, no dnspython) never block an order.
+_preflight_resolver = None  # (nameservers, timeout, resolver)
+_preflight_resolver_lock = threading.Lock()
+
+def get_preflight_settings():
+    """Return the preflight setting merged over the defaults"""
+    configured = load_settings_cached().get('preflight') or {}
+    return {**DEFAULT_PREFLIGHT_SETTINGS, **configured}
+
+def validate_preflight_settings(preflight):
+    """Validate the preflight setting"""
+    if not isinstance(preflight, dict):
+        return False, "preflight must be an object"
+    nameservers = preflight.get('nameservers')
+    if nameservers is not None:
+        if not isinstance(nameservers, list) or not all(isinstance(server, str) for server in nameservers):
+            return False, "nameservers must be a list of addresses"
+        for server in nameservers:
+            if parse_nameserver(server) is None:
+                return False, f"Invalid nameserver {server!r}: use an IP address, optionally with :port"
+    timeout = preflight.get('timeout', DEFAULT_PREFLIGHT_SETTINGS['timeout'])
+    if not isinstance(timeout, (int, float)) or not 0 < timeout <= 60:
+        return False, "timeout must be between 0 and 60 seconds"
+    provider_nameservers = preflight.get('provider_nameservers') or {}
+    if not isinstance(provider_nameservers, dict) or not all(
+            provider in SUPPORTED_DNS_PROVIDERS and isinstance(suffixes, list) and all(isinstance(suffix, str) for suffix in suffixes)
+            for provider, suffixes in provider_nameservers.items()):
+        return False, "provider_nameservers must map DNS providers to lists of nameserver name suffixes"
+    return True, None
+
+def parse_nameserver(server):
+    """Split "ip", "ip:port" or "[ipv6]:port" into (ip, port), or None if invalid"""
+    match = re.match(r'^\[([0-9a-fA-F:.]+)\](?::(\d+))?$', server) or re.match(r'^([^:]+)(?::(\d+))?$', server)
+    host, port = (match.group(1), match.group(2)) if match else (server, None)
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    port = int(port) if port else 53
+    return (host, port) if 0 < port < 65536 else None
+
+def get_preflight_resolver():
+    """Return the shared resolver for preflight checks, or None without dnspython
+    
+    The resolver and its cache are rebuilt when the nameservers or timeout
+    setting changes.
+    """
+    global _preflight_resolver
+    if dns is None:
+        return None
+    preflight = get_preflight_settings()
+    config = (tuple(preflight.get('nameservers') or ()), preflight.get('timeout'))
+    with _preflight_resolver_lock:
+        if _preflight_resolver is None or _preflight_resolver[:2] != config:
+            resolver = dns.resolver.Resolver(configure=not config[0])
+            if config[0]:
+                resolver.nameservers = [dns.nameserver.Do53Nameserver(*parse_nameserver(server)) for server in config[0]]
+            resolver.lifetime = config[1]
+            resolver.timeout = min(config[1], 2)
+            # Caches negative answers (no such name, no records) too
+            resolver.cache = dns.resolver.LRUCache(PREFLIGHT_DNS_CACHE_SIZE)
+            _preflight_resolver = (*config, resolver)
+        return _preflight_resolver[2]
+
+def dns_query(resolver, name, rdtype):
+    """Return the records of one type at a name, [] if there are none
+    
+    Concurrent identical queries share one lookup. Raises
+    dns.exception.DNSException when the lookup itself fails.
+    """
+    def lookup():
+        try:
+            return list(resolver.resolve(name, rdtype, search=False))
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return []
+    return singleflight('dns', (name, rdtype), lookup)
+
+def get_caa_identities(account):
+    """Return the CAA issuer domain names of an ACME account's CA, or None if unknown"""
+    if account.get('caa_identities'):
+        return [identity.lower() for identity in account['caa_identities']]
+    
+    return ACME_CAA_IDENTITIES.get(urlparse(account.get('server') or LETSENCRYPT_DEFAULT_SERVER).hostname)
+
+def relevant_caa_records(resolver, domain):
+    """Return the CAA records that apply to a domain: those of the closest name up the tree that has any"""
+    labels = domain.rstrip('.').split('.')
+    for index in range(len(labels)):
+        records = dns_query(resolver, '.'.join(labels[index:]) + '.', 'CAA')
+        if records:
+            return records
+    return []
+
+def caa_allowed_issuers(records, wildcard=False):
+    """Return the issuer domain names a CAA record set allows (empty: none), or None if it allows any CA"""
+    if any(record.flags & 128 and record.tag.lower() not in (b'issue', b'issuewild', b'iodef') for record in records):
+        # An unknown critical property forbids issuance altogether
+        return set()
+    tag = b'issuewild' if wildcard and any(record.tag.lower() == b'issuewild' for record in records) else b'issue'
+    issue_records = [record for record in records if record.tag.lower() == tag]
+    if not issue_records:
+        return None
+    return {record.value.decode(errors='replace').split(';', 1)[0].strip().lower() for record in issue_records} - {''}
+
+def preflight_caa(resolver, domain):
+    """Check that CAA records allow at least one configured ACME account's CA to issue for domain and *.domain"""
+    records = relevant_caa_records(resolver, domain)
+    allowed = [caa_allowed_issuers(records), caa_allowed_issuers(records, wildcard=True)]
+    if all(issuers is None for issuers in allowed):
+        return {'status': 'pass', 'message': 'No CAA restrictions'}
+    
+    permitted, unknown = [], []
+    for account in get_acme_accounts():
+        identities = get_caa_identities(account)
+        if identities is None:
+            unknown.append(account['name'])
+        elif all(issuers is None or issuers.intersection(identities) for issuers in allowed):
+            permitted.append(account['name'])
+    if permitted:
+        return {'status': 'pass', 'message': f"CAA allows ACME account(s) {', '.join(permitted)}", 'accounts': permitted}
+    if unknown:
+        return {'status': 'skipped', 'message': f"CAA identity unknown for ACME account(s) {', '.join(unknown)}; "
+                                                f"set caa_identities to check them"}
+    # Name the first of domain and *.domain that no configured CA may issue for
+    identities = set().union(*(get_caa_identities(account) for account in get_acme_accounts()))
+    name, issuers = next((name, issuers) for name, issuers in zip((domain, f"*.{domain}"), allowed)
+                         if issuers is not None and not issuers.intersection(identities))
+    if not issuers:
+        return {'status': 'fail', 'message': f"CAA records forbid every CA to issue for {name}"}
+    return {'status': 'fail', 'message': f"CAA records only allow {', '.join(sorted(issuers))} to issue for {name}"}
+
+def provider_nameserver_pattern(dns_provider, preflight):
+    """Return the compiled pattern of a DNS provider's nameserver names, or None if unknown"""
+    patterns = [PROVIDER_NAMESERVER_PATTERNS[dns_provider]] if dns_provider in PROVIDER_NAMESERVER_PATTERNS else []
+    patterns += [rf"(^|\.){re.escape(suffix.strip('.').lower())}$"
+                 for suffix in (preflight.get('provider_nameservers') or {}).get(dns_provider, [])]
+    return re.compile('|'.join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+
+def preflight_delegation(resolver, domain, dns_provider, preflight):
+    """Check that the zone holding the domain's _acme-challenge record is served by its DNS provider"""
+    pattern = provider_nameserver_pattern(dns_provider, preflight)
+    if pattern is None:
+        return {'status': 'skipped', 'message': f"No known nameservers for {dns_provider}; add them to provider_nameservers"}
+    
+    # The challenge record may be delegated to another zone with a CNAME
+    challenge_name = f"_acme-challenge.{domain}."
+    aliases = dns_query(resolver, challenge_name, 'CNAME')
+    if aliases:
+        challenge_name = aliases[0].target.to_text()
+    
+    zone = dns.resolver.zone_for_name(challenge_name, resolver=resolver).to_text()
+    nameservers = sorted(record.target.to_text().rstrip('.').lower() for record in dns_query(resolver, zone, 'NS'))
+    matching = [server for server in nameservers if pattern.search(server)]
+    if not matching:
+        return {'status': 'fail', 'message': f"Zone {zone.rstrip('.')} is served by {', '.join(nameservers) or 'no nameservers'}, "
+                                             f"not by {dns_provider}", 'zone': zone.rstrip('.'), 'nameservers': nameservers}
+    if len(matching) < len(nameservers):
+        return {'status': 'pass', 'message': f"Zone {zone.rstrip('.')} is only partly served by {dns_provider}",
+                'zone': zone.rstrip('.'), 'nameservers': nameservers}
+    return {'status': 'pass', 'message': f"Zone {zone.rstrip('.')} is served by {dns_provider}",
+            'zone': zone.rstrip('.'), 'nameservers': nameservers}
+
+def preflight_domain(domain, dns_provider=None, settings=None):
+    """Run the preflight checks for an order of domain and *.domain
+    
+    Returns {'domain', 'ok', 'checks': {name: {'status', 'message'}}}; ok is
+    False only when a check failed outright.
+    """
+    settings = settings or load_settings_cached()
+    result = {'domain': domain, 'ok': True, 'checks': {}}
+    is_valid, domain_or_error = validate_domain(domain)
+    if not is_valid:
+        result['checks']['domain'] = {'status': 'fail', 'message': domain_or_error}
+        result['ok'] = False
+        return result
+    domain = result['domain'] = domain_or_error
+    result['checks']['domain'] = {'status': 'pass', 'message': 'Valid domain name'}
+    
+    resolver = get_preflight_resolver()
+    dns_provider = dns_provider or get_domain_dns_provider(domain, settings)
+    checks = {'caa': lambda: preflight_caa(resolver, domain),
+              'delegation': lambda: preflight_delegation(resolver, domain, dns_provider, get_preflight_settings())}
+    for name, check in checks.items():
+        if resolver is None:
+            result['checks'][name] = {'status': 'skipped', 'message': 'dnspython is not installed'}
+            continue
+        try:
+            result['checks'][name] = check()
+        except dns.exception.DNSException as e:
+            result['checks'][name] = {'status': 'skipped', 'message': f"DNS lookup failed: {e}"}
+    
+    result['ok'] = all(check['status'] != 'fail' for check in result['checks'].values())
+    return result
+
+def preflight_domains(domains, dns_provider=None):
+    """Run preflight_domain concurrently for several domains, returning their results in order"""
+    settings = load_settings_cached()
+    if not domains:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(domains), PREFLIGHT_WORKERS)) as executor:
+        return list(executor.map(lambda domain: preflight_domain(domain, dns_provider, settings), domains))
+
+def preflight_failure_message(result):
+    """Summarize the failed checks of a preflight result"""
+    return '; '.join(check['message'] for check in result['checks'].values() if check['status'] == 'fail')
+
+# Certificate change watcher
+# Watches CERT_DIR, certbot's live directory and settings.json for changes made
+# outside the API (external certbot runs, operators, restores) and publishes
+# them to the caches and to registered listeners. Uses inotify where
+# available and falls back to a periodic stat scan.
+_change_listeners = []
+_watcher_thread = None
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+INOTIFY_DIR_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                    IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+def register_certificate_listener(callback):
+    """Register callback(source, domain) for certificate and settings changes
+    
+    source is 'certificate' (domain set) or 'settings' (domain is None).
+    Callbacks run on the watcher thread and must not block for long.
+    """
+    _change_listeners.append(callback)
+
+def publish_certificate_changes(changes):
+    """Apply a batch of (source, domain) changes to the caches and notify listeners
+    
+    Only the worker running background services writes the inventory or
+    publishes certificates picked up from certbot; every worker drops its
+    own cached bundles.
+    """
+    is_leader = _scheduler_lock_handle is not None
+    for source, domain in sorted(changes, key=lambda change: (change[0], change[1] or '')):
+        try:
+            if source == 'live':
+                # A certbot run outside CertMate; publishing it fires a certificate change
+                if is_leader:
+                    sync_certbot_live_certificate(domain)
+                continue
+            if source == 'settings':
+                if is_leader and INVENTORY_ENABLED:
+                    inventory_sync_domains(load_settings())
+            else:
+                invalidate_certificate_bundle(domain)
+                if is_leader:
+                    inventory_update_certificate(domain)
+            
+            for callback in list(_change_listeners):
+                callback(source, domain)
+        except Exception as e:
+            logger.error(f"Error publishing {source} change for {domain}: {e}")
+
+def sync_certbot_live_certificate(domain):
+    """Publish a certificate renewed by certbot outside CertMate, if it differs from ours"""
+    live_dir = LETSENCRYPT_DIR / "config" / "live" / domain
+    if not (live_dir / "cert.pem").exists() or not (CERT_DIR / domain).exists():
+        return
+    
+    live = parse_certificate_metadata(live_dir / "cert.pem")
+    current_file = get_certificate_dir(domain) / "cert.pem"
+    current = parse_certificate_metadata(current_file) if current_file.exists() else None
+    if live is None or (current and current['fingerprint'] == live['fingerprint']):
+        return
+    
+    install_certificate_version(domain, live_dir)
+    inventory_record_event(domain, 'external', True, 'Picked up certificate from certbot live directory')
+    logger.info(f"Published certificate for {domain} renewed outside CertMate")
+
+def _watch_roots():
+    """Return the directories to watch as (kind, path) pairs"""
+    return [
+        ('certificates', CERT_DIR),
+        ('live', LETSENCRYPT_DIR / "config" / "live"),
+        ('data', DATA_DIR)
+    ]
+
+def scan_certificate_state():
+    """Take a stat snapshot of every watched certificate and settings.json"""
+    snapshot = {}
+    for kind, root in _watch_roots():
+        if kind == 'data':
+            try:
+                stat = SETTINGS_FILE.stat()
+                snapshot[('settings', None)] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                pass
+            continue
+        try:
+            domain_dirs = [entry for entry in os.scandir(root) if entry.is_dir()]
+        except OSError:
+            continue
+        for entry in domain_dirs:
+            signature = []
+            for name in ('current', 'cert.pem'):
+                path = os.path.join(entry.path, name)
+                try:
+                    stat = os.stat(path)
+                    link = os.readlink(path) if os.path.islink(path) else None
+                    signature.append((link, stat.st_ino, stat.st_mtime_ns))
+                except OSError:
+                    signature.append(None)
+            source = 'certificate' if kind == 'certificates' else 'live'
+            snapshot[(source, entry.name)] = tuple(signature)
+    return snapshot
+
+def diff_certificate_state(before, after):
+    """Return the (source, domain) keys that changed between two snapshots"""
+    return {key for key in before.keys() | after.keys() if before.get(key) != after.get(key)}
+
+def _inotify_init():
+    """Return a (libc, fd) inotify handle, or None if inotify is unavailable"""
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    return libc, fd
+
+def _inotify_add_watches(handle, watches):
+    """Watch every root and domain directory not watched yet; watches maps wd -> (kind, domain)"""
+    libc, fd = handle
+    watched = set(watches.values())
+    for kind, root in _watch_roots():
+        targets = [(kind, None, root)]
+        if kind != 'data':
+            try:
+                targets += [(kind, entry.name, Path(entry.path)) for entry in os.scandir(root) if entry.is_dir()]
+            except OSError:
+                continue
+        for target_kind, domain, path in targets:
+            if (target_kind, domain) in watched:
+                continue
+            wd = libc.inotify_add_watch(fd, os.fsencode(str(path)), INOTIFY_DIR_MASK)
+            if wd >= 0:
+                watches[wd] = (target_kind, domain)
+
+def _inotify_read_changes(handle, watches, timeout):
+    """Wait up to timeout seconds for events and return (changes, rescan_needed)"""
+    _, fd = handle
+    changes = set()
+    rescan = False
+    ready, _, _ = select.select([fd], [], [], timeout)
+    while ready:
+        data = os.read(fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+            
+            if mask & IN_Q_OVERFLOW:
+                rescan = True
+                continue
+            kind, domain = watches.get(wd, (None, None))
+            if mask & IN_IGNORED:
+                watches.pop(wd, None)
+                continue
+            if kind is None or name.startswith('.'):
+                continue
+            
+            if kind == 'data':
+                if name == SETTINGS_FILE.name:
+                    changes.add(('settings', None))
+            elif domain is None:
+                # New or removed domain directory
+                if mask & IN_ISDIR:
+                    changes.add(('certificate' if kind == 'certificates' else 'live', name))
+                    rescan = rescan or bool(mask & (IN_CREATE | IN_MOVED_TO))
+            elif name == 'current' or name.endswith('.pem'):
+                changes.add(('certificate' if kind == 'certificates' else 'live', domain))
+        
+        # Debounce: certbot and install_certificate_version touch several files per change
+        ready, _, _ = select.select([fd], [], [], WATCHER_DEBOUNCE_SECONDS)
+    return changes, rescan
+
+def run_certificate_watcher():
+    """Watcher thread main loop"""
+    mode = WATCHER_MODE
+    handle = _inotify_init() if mode == 'auto' else None
+    if handle is None:
+        logger.info(f"Certificate watcher scanning every {WATCHER_SCAN_INTERVAL}s")
+        snapshot = scan_certificate_state()
+        while True:
+            time.sleep(WATCHER_SCAN_INTERVAL)
+            current = scan_certificate_state()
+            changes = diff_certificate_state(snapshot, current)
+            snapshot = current
+            if changes:
+                publish_certificate_changes(changes)
+    
+    logger.info("Certificate watcher using inotify")
+    watches = {}
+    _inotify_add_watches(handle, watches)
+    snapshot = scan_certificate_state()
+    while True:
+        try:
+            changes, rescan = _inotify_read_changes(handle, watches, WATCHER_SCAN_INTERVAL)
+        except OSError as e:
+            logger.error(f"Certificate watcher error: {e}")
+            time.sleep(WATCHER_SCAN_INTERVAL)
+            continue
+        
+        # Roots created after startup and new domain directories need watches;
+        # a queue overflow means events were lost, so diff against a full scan
+        _inotify_add_watches(handle, watches)
+        if rescan:
+            current = scan_certificate_state()
+            changes |= diff_certificate_state(snapshot, current)
+            snapshot = current
+        if changes:
+            publish_certificate_changes(changes)
+
+def start_certificate_watcher():
+    """Start the change watcher thread for this process"""
+    global _watcher_thread
+    if WATCHER_MODE == 'off' or (_watcher_thread is not None and _watcher_thread.is_alive()):
+        return
+    _watcher_thread = threading.Thread(target=run_certificate_watcher, name='certificate-watcher', daemon=True)
+    _watcher_thread.start()
+
+# Private key pool
+# Optional: keys are generated ahead of time by a background process pool and
+# stored encrypted under DATA_DIR/keypool/<key type>/. Issuance claims a key by
+# renaming it, so several workers never hand out the same key, and has certbot
+# sign a CSR for it instead of generating a key on the critical path.
+_key_pool_refill_lock = threading.Lock()
+_key_pool_key_cache = None
+
+def get_key_pool_settings():
+    """Return the key_pool setting merged over the defaults"""
+    configured = load_settings_cached().get('key_pool') or {}
+    return {**DEFAULT_KEY_POOL_SETTINGS, **configured}
+
+def _key_pool_key():
+    """Return the AES key that encrypts pooled keys at rest, or None without a passphrase
+    
+    Derived from CERTMATE_KEY_POOL_PASSPHRASE, or from the file named by
+    CERTMATE_KEY_POOL_PASSPHRASE_FILE (e.g. a Docker secret). The file must
+    not be in the data or certificates directory: a passphrase stored next to
+    the encrypted keys would not protect them.
+    """
+    global _key_pool_key_cache
+    if _key_pool_key_cache is not None:
+        return _key_pool_key_cache
+    
+    passphrase = os.getenv('CERTMATE_KEY_POOL_PASSPHRASE')
+    passphrase_file = os.getenv('CERTMATE_KEY_POOL_PASSPHRASE_FILE')
+    if not passphrase and passphrase_file:
+        path = Path(passphrase_file).resolve()
+        if any(path.is_relative_to(directory.resolve()) for directory in (DATA_DIR, CERT_DIR)):
+            logger.error(f"Key pool disabled: {passphrase_file} must be outside the data and certificates directories")
+            return None
+        try:
+            passphrase = path.read_text().strip()
+        except OSError as e:
+            logger.error(f"Key pool disabled: cannot read {passphrase_file}: {e}")
+            return None
+    if not passphrase:
+        logger.error("Key pool disabled: set CERTMATE_KEY_POOL_PASSPHRASE or CERTMATE_KEY_POOL_PASSPHRASE_FILE")
+        return None
+    
+    _key_pool_key_cache = hashlib.scrypt(passphrase.encode(), salt=b'certmate-key-pool', n=2 ** 14, r=8, p=1, dklen=32)
+    return _key_pool_key_cache
+
+def generate_private_key(key_type):
+    """Generate a private key of one of the KEY_TYPES"""
+    algorithm, parameter = KEY_TYPES[key_type]
+    if algorithm == 'rsa':
+        return rsa.generate_private_key(public_exponent=65537, key_size=parameter)
+    curve = {'secp256r1': ec.SECP256R1, 'secp384r1': ec.SECP384R1}[parameter]
+    return ec.generate_private_key(curve())
+
+def generate_pool_key(key_type, aes_key):
+    """Generate a key and return it AES-GCM encrypted (runs in the key pool processes)"""
+    key_der = generate_private_key(key_type).private_bytes(
+        serialization.Encoding.DER,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    nonce = os.urandom(12)
+    return nonce + AESGCM(aes_key).encrypt(nonce, key_der, key_type.encode())
+
+def key_pool_counts():
+    """Return the number of available pooled keys per key type"""
+    counts = {}
+    for key_type in KEY_TYPES:
+        try:
+            counts[key_type] = sum(1 for entry in os.scandir(KEY_POOL_DIR / key_type) if entry.name.endswith('.key'))
+        except FileNotFoundError:
+            counts[key_type] = 0
+    return counts
+
+def refill_key_pool():
+    """Top up every configured key type that is below the low watermark to the high watermark
+    
+    Only one process refills at a time; the others skip while it holds the lock.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    pool_settings = get_key_pool_settings()
+    if not pool_settings['enabled']:
+        return
+    aes_key = _key_pool_key()
+    if aes_key is None:
+        return
+    
+    KEY_POOL_DIR.mkdir(parents=True, exist_ok=True)
+    with open(KEY_POOL_DIR / ".lock", 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+        
+        # Before a passphrase was required, one was generated into the pool
+        # directory. Keys encrypted with it were not protected at rest, so
+        # they are discarded together with it.
+        legacy_passphrase = KEY_POOL_DIR / ".passphrase"
+        if legacy_passphrase.exists():
+            for key_file in KEY_POOL_DIR.glob('*/*.key'):
+                key_file.unlink(missing_ok=True)
+            legacy_passphrase.unlink(missing_ok=True)
+            logger.warning("Discarded pooled keys encrypted with the passphrase stored in the pool directory")
+        
+        counts = key_pool_counts()
+        wanted = []
+        for key_type in pool_settings['key_types']:
+            if key_type in KEY_TYPES and counts[key_type] < pool_settings['low_watermark']:
+                wanted += [key_type] * (pool_settings['high_watermark'] - counts[key_type])
+        if not wanted:
+            return
+        
+        started = time.monotonic()
+        # Spawned rather than forked: the workers running this are multi-threaded
+        with ProcessPoolExecutor(max_workers=pool_settings['workers'] or os.cpu_count(),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            for key_type, encrypted_key in zip(wanted, executor.map(generate_pool_key, wanted, [aes_key] * len(wanted))):
+                type_dir = KEY_POOL_DIR / key_type
+                type_dir.mkdir(exist_ok=True)
+                key_file = type_dir / f"{secrets.token_hex(8)}.key"
+                tmp_file = type_dir / f".{key_file.name}.tmp"
+                fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(encrypted_key)
+                os.replace(tmp_file, key_file)
+        logger.info(f"Key pool refilled with {len(wanted)} keys in {time.monotonic() - started:.1f}s")
+
+def request_key_pool_refill():
+    """Refill the key pool in a background thread unless a refill is already running here"""
+    if not _key_pool_refill_lock.acquire(blocking=False):
+        return
+    
+    def refill():
+        try:
+            refill_key_pool()
+        except Exception as e:
+            logger.error(f"Error refilling key pool: {e}")
+        finally:
+            _key_pool_refill_lock.release()
+    
+    threading.Thread(target=refill, name='key-pool-refill', daemon=True).start()
+
+def claim_pool_key(key_type):
+    """Take a key of the given type out of the pool, or None if the pool is disabled or empty"""
+    pool_settings = get_key_pool_settings()
+    if not pool_settings['enabled'] or key_type not in KEY_TYPES:
+        return None
+    aes_key = _key_pool_key()
+    if aes_key is None:
+        return None
+    
+    type_dir = KEY_POOL_DIR / key_type
+    try:
+        candidates = [entry.name for entry in os.scandir(type_dir) if entry.name.endswith('.key')]
+    except FileNotFoundError:
+        candidates = []
+    
+    private_key = None
+    for name in candidates:
+        claimed_file = type_dir / f".claimed-{os.getpid()}-{name}"
+        try:
+            os.rename(type_dir / name, claimed_file)
+        except FileNotFoundError:
+            continue  # claimed by another worker
+        try:
+            data = claimed_file.read_bytes()
+            key_der = AESGCM(aes_key).decrypt(data[:12], data[12:], key_type.encode())
+            # Authenticated by AES-GCM and generated by us: skip the costly RSA consistency check
+            private_key = serialization.load_der_private_key(key_der, None, unsafe_skip_rsa_key_validation=True)
+        except Exception as e:
+            logger.error(f"Discarding unreadable pooled key {name}: {e}")
+            continue
+        finally:
+            claimed_file.unlink(missing_ok=True)
+        break
+    
+    if len(candidates) <= pool_settings['low_watermark']:
+        request_key_pool_refill()
+    if private_key is None:
+        logger.warning(f"Key pool has no {key_type} keys; certbot will generate the key")
+    return private_key
+
+def write_private_key(private_key, key_file):
+    """Write an unencrypted PEM private key readable only by its owner"""
+    fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                          serialization.NoEncryption()))
+
+def build_csr(private_key, domains):
+    """Build a PEM certificate signing request for the domains"""
+    csr = (x509.CertificateSigningRequestBuilder()
+           .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domains[0])]))
+           .add_extension(x509.SubjectAlternativeName([x509.DNSName(name) for name in domains]), critical=False)
+           .sign(private_key, hashes.SHA256()))
+    return csr.public_bytes(serialization.Encoding.PEM)
+
+# OCSP stapling support
+# The worker running background services fetches an OCSP response for every
+# certificate and refreshes it once half of its validity has passed. Responses
+# are stored as CERT_DIR/<domain>/ocsp.der and served at /<domain>/tls/ocsp so
+# that edge servers can staple them without each querying the CA.
+def load_ocsp_response(domain):
+    """Return (der, response) for the stored OCSP response of a domain, or (None, None)"""
+    from cryptography.x509 import ocsp
+    
+    try:
+        der = (CERT_DIR / domain / OCSP_RESPONSE_FILE).read_bytes()
+        return der, ocsp.load_der_ocsp_response(der)
+    except (OSError, ValueError):
+        return None, None
+
+def ocsp_validity(response):
+    """Return the (this_update, next_update) of an OCSP response as aware UTC datetimes"""
+    if hasattr(response, 'this_update_utc'):
+        return response.this_update_utc, response.next_update_utc
+    # cryptography < 43 only has naive UTC datetimes
+    next_update = response.next_update.replace(tzinfo=timezone.utc) if response.next_update else None
+    return response.this_update.replace(tzinfo=timezone.utc), next_update
+
+def ocsp_refresh_due(response, serial, now=None):
+    """Whether a stored response is missing, for another certificate, or past half its validity"""
+    if response is None or format(response.serial_number, 'x') != serial:
+        return True
+    now = now or datetime.now(timezone.utc)
+    this_update, next_update = ocsp_validity(response)
+    next_update = next_update or this_update + timedelta(seconds=OCSP_DEFAULT_VALIDITY_SECONDS)
+    return now >= this_update + (next_update - this_update) / 2
+
+def verify_ocsp_signature(response, issuer):
+    """Check that an OCSP response is signed by the issuer or a responder it delegated to
+    
+    Returns None when the signature is valid, else the reason it is not.
+    """
+    def is_responder(certificate):
+        if response.responder_key_hash is not None:
+            return x509.SubjectKeyIdentifier.from_public_key(certificate.public_key()).digest == response.responder_key_hash
+        return certificate.subject == response.responder_name
+    
+    if is_responder(issuer):
+        signer = issuer
+    else:
+        # A delegated responder must be issued by the issuer for OCSP signing
+        signer = next((certificate for certificate in response.certificates if is_responder(certificate)), None)
+        if signer is None:
+            return "it is not signed by the issuer and includes no responder certificate"
+        try:
+            signer.verify_directly_issued_by(issuer)
+            usages = signer.extensions.get_extension_for_class(x509.ExtendedKeyUsage).value
+        except (ValueError, TypeError, InvalidSignature, x509.ExtensionNotFound):
+            return "its responder certificate is not issued by the issuer for OCSP signing"
+        if x509.oid.ExtendedKeyUsageOID.OCSP_SIGNING not in usages:
+            return "its responder certificate is not issued by the issuer for OCSP signing"
+        now = datetime.now(timezone.utc)
+        if not signer.not_valid_before_utc <= now <= signer.not_valid_after_utc:
+            return "its responder certificate is not currently valid"
+    
+    public_key = signer.public_key()
+    try:
+        if isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(response.signature, response.tbs_response_bytes,
+                              padding.PKCS1v15(), response.signature_hash_algorithm)
+        elif isinstance(public_key, ec.EllipticCurvePublicKey):
+            public_key.verify(response.signature, response.tbs_response_bytes,
+                              ec.ECDSA(response.signature_hash_algorithm))
+        else:
+            public_key.verify(response.signature, response.tbs_response_bytes)
+    except (InvalidSignature, TypeError, ValueError):
+        return "its signature does not verify"
+    return None
+
+def fetch_ocsp_response(domain, session=None):
+    """Fetch and store the OCSP response for a domain's current certificate
+    
+    The responder is taken from the certificate's AIA extension unless the
+    ocsp_responder_url setting overrides it (e.g. a local responder in tests).
+    Only responses for the certificate, signed by its issuer (or a responder
+    the issuer delegated to) and currently valid are stored. Returns
+    (success, message); success is None for certificates without a responder,
+    which have nothing to staple.
+    """
+    import requests
+    from cryptography.x509 import ocsp
+    
+    cert_dir = get_certificate_dir(domain)
+    try:
+        cert = x509.load_pem_x509_certificate((cert_dir / "cert.pem").read_bytes())
+        chain = x509.load_pem_x509_certificates((cert_dir / "chain.pem").read_bytes())
+    except (OSError, ValueError) as e:
+        return False, f"No certificate and issuer chain for {domain}: {e}"
+    issuer = chain[0]
+    
+    responder_url = load_settings_cached().get('ocsp_responder_url')
+    if not responder_url:
+        try:
+            aia = cert.extensions.get_extension_for_class(x509.AuthorityInformationAccess).value
+            responder_url = next(description.access_location.value for description in aia
+                                 if description.access_method == x509.oid.AuthorityInformationAccessOID.OCSP)
+        except (x509.ExtensionNotFound, StopIteration):
+            return None, f"Certificate for {domain} has no OCSP responder"
+    
+    request_der = (ocsp.OCSPRequestBuilder()
+                   .add_certificate(cert, issuer, hashes.SHA1())
+                   .build()
+                   .public_bytes(serialization.Encoding.DER))
+    try:
+        http = session or requests
+        reply = http.post(responder_url, data=request_der, timeout=OCSP_TIMEOUT_SECONDS,
+                          headers={'Content-Type': 'application/ocsp-request'})
+        reply.raise_for_status()
+        response = ocsp.load_der_ocsp_response(reply.content)
+    except (requests.RequestException, ValueError) as e:
+        return False, f"OCSP request for {domain} to {responder_url} failed: {e}"
+    
+    if response.response_status != ocsp.OCSPResponseStatus.SUCCESSFUL:
+        return False, f"OCSP responder returned {response.response_status.name} for {domain}"
+    # Responders may hash the issuer with another algorithm than requested
+    expected = ocsp.OCSPRequestBuilder().add_certificate(cert, issuer, response.hash_algorithm).build()
+    if (response.serial_number != cert.serial_number or response.issuer_key_hash != expected.issuer_key_hash
+            or response.issuer_name_hash != expected.issuer_name_hash):
+        return False, f"OCSP response for {domain} is for another certificate"
+    signature_error = verify_ocsp_signature(response, issuer)
+    if signature_error:
+        return False, f"OCSP response for {domain} rejected: {signature_error}"
+    now = datetime.now(timezone.utc)
+    this_update, next_update = ocsp_validity(response)
+    if this_update > now + timedelta(minutes=5) or (next_update and next_update <= now):
+        return False, f"OCSP response for {domain} is not currently valid"
+    
+    response_file = CERT_DIR / domain / OCSP_RESPONSE_FILE
+    tmp_file = response_file.with_name(f".{OCSP_RESPONSE_FILE}.{secrets.token_hex(4)}")
+    tmp_file.write_bytes(reply.content)
+    os.replace(tmp_file, response_file)
+    return True, f"OCSP status {response.certificate_status.name} for {domain}"
+
+def refresh_ocsp_responses(domains=None):
+    """Fetch OCSP responses that are missing or due, concurrently"""
+    if not load_settings_cached().get('ocsp_stapling', True):
+        return
+    if domains is None:
+        settings = load_settings_cached()
+        domains = [entry.get('domain') if isinstance(entry, dict) else entry for entry in settings.get('domains', [])]
+    
+    due = []
+    for domain in filter(None, domains):
+        cert_file = get_certificate_dir(domain) / "cert.pem"
+        metadata = parse_certificate_metadata(cert_file) if cert_file.exists() else None
+        if metadata and ocsp_refresh_due(load_ocsp_response(domain)[1], metadata['serial']):
+            due.append(domain)
+    if not due:
+        return
+    
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=OCSP_FETCH_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    with ThreadPoolExecutor(max_workers=OCSP_FETCH_WORKERS) as executor:
+        results = list(executor.map(lambda domain: fetch_ocsp_response(domain, session), due))
+    
+    failures = [message for success, message in results if success is False]
+    for message in failures:
+        logger.warning(message)
+    refreshed = sum(1 for success, _ in results if success)
+    logger.info(f"Refreshed {refreshed} of {len(due)} due OCSP responses")
+
+def _refresh_ocsp_on_change(source, domain):
+    """Fetch a new OCSP response as soon as a domain's certificate changes"""
+    if source == 'certificate' and _scheduler_lock_handle is not None:
+        threading.Thread(target=refresh_ocsp_responses, args=([domain],), daemon=True).start()
+
+register_certificate_listener(_refresh_ocsp_on_change)
+
+# Certbot execution and job tracking
+_job_runtime = {}  # job_id -> in-process state of jobs running in this worker, until they finish
+_jobs_lock = threading.Lock()
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+JOB_FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled', 'timed_out')
+# Statuses of a job whose certbot run was stopped before it could finish
+JOB_ABORTED_STATUSES = ('cancelled', 'timed_out', 'interrupted')
+_job_owner = {}  # this process's owner token and the lock file proving it is alive
+
+# Certbot output lines that mark the start of a phase, in order of appearance
+CERTBOT_PHASE_PATTERNS = [
+    (re.compile(r'Requesting a certificate|Renewing an existing certificate|Processing '), 'order'),
+    (re.compile(r'Performing the following challenges|dns-01 challenge'), 'challenge'),
+    (re.compile(r'Waiting \d+ seconds for DNS changes to propagate'), 'propagation'),
+    (re.compile(r'Waiting for verification|Cleaning up challenges'), 'finalize'),
+    (re.compile(r'Successfully received certificate|Congratulations|renewals? succeeded'), 'done')
+]
+
+def get_certbot_timeouts():
+    """Return the overall and per-phase certbot timeouts in seconds"""
+    configured = load_settings_cached().get('certbot_timeouts') or {}
+    phases = dict(DEFAULT_CERTBOT_TIMEOUTS['phases'])
+    phases.update(configured.get('phases') or {})
+    return {
+        'overall': configured.get('overall', DEFAULT_CERTBOT_TIMEOUTS['overall']),
+        'phases': phases
+    }
+
+def certbot_dir_args():
+    """Create the local certbot directories and return the matching CLI arguments"""
+    config_dir = LETSENCRYPT_DIR / "config"
+    work_dir = LETSENCRYPT_DIR / "work"
+    logs_dir = LETSENCRYPT_DIR / "logs"
+    
+    # Create directories if they don't exist
+    config_dir.mkdir(parents=True, exist_ok=True)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    
+    return config_dir, [
+        '--config-dir', str(config_dir),
+        '--work-dir', str(work_dir),
+        '--logs-dir', str(logs_dir)
+    ]
+
+def certbot_key_args(key_settings):
+    """Return the certbot arguments selecting a domain's key type and preferred chain"""
+    args = []
+    if key_settings['key_type'] == 'rsa':
+        args += ['--key-type', 'rsa', '--rsa-key-size', str(key_settings['key_size'])]
+    elif key_settings['key_type'] == 'ecdsa':
+        args += ['--key-type', 'ecdsa', '--elliptic-curve', f"secp{key_settings['key_size']}r1"]
+    if key_settings['preferred_chain']:
+        args += ['--preferred-chain', key_settings['preferred_chain']]
+    return args
+
+def save_job(job):
+    """Persist job state so that every worker can report on it"""
+    job_file = JOBS_DIR / f"{job['id']}.json"
+    tmp_file = job_file.with_suffix('.tmp')
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_file, job_file)
+    except Exception as e:
+        logger.error(f"Error saving job {job['id']}: {e}")
+
+def load_job(job_id):
+    """Load a job by ID, or None if it does not exist"""
+    if not JOB_ID_PATTERN.match(job_id or ''):
+        return None
+    job_file = JOBS_DIR / f"{job_id}.json"
+    if not job_file.exists():
+        return None
+    return safe_file_read(job_file, is_json=True)
+
+def update_job(job, **changes):
+    """Apply changes to a job and persist it"""
+    job.update(changes)
+    save_job(job)
+
+def prune_jobs():
+    """Delete the files of the oldest finished jobs beyond JOB_HISTORY_LIMIT"""
+    try:
+        job_files = sorted(JOBS_DIR.glob('*.json'), key=lambda p: p.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for job_file in job_files[JOB_HISTORY_LIMIT:]:
+        job = safe_file_read(job_file, is_json=True)
+        if job and job.get('status') not in JOB_FINISHED_STATUSES:
+            continue
+        for suffix in ('.json', '.log', '.cancel'):
+            job_file.with_suffix(suffix).unlink(missing_ok=True)
+
+def job_owner_token():
+    """Return this process's job owner token
+    
+    The process holds an exclusive lock on JOBS_DIR/.owner-<token>.lock for
+    its lifetime, so other workers can tell whether a job's owner is alive
+    even after a restart has reused its PID.
+    """
+    owner = _job_owner.get('entry')
+    if owner and owner[0] == os.getpid():
+        return owner[1]
+    token = f"{os.getpid()}-{secrets.token_hex(4)}"
+    JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    lock_file = open(JOBS_DIR / f".owner-{token}.lock", 'w')
+    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    _job_owner['entry'] = (os.getpid(), token, lock_file)
+    return token
+
+def job_owner_alive(token):
+    """Whether the process owning a job is still running"""
+    if not token:
+        return False
+    if token == job_owner_token():
+        return True
+    lock_path = JOBS_DIR / f".owner-{token}.lock"
+    try:
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return True
+    lock_path.unlink(missing_ok=True)
+    return False
+
+def _register_job_runtime(job_id):
+    """Set up the in-process state of a job about to run in this worker"""
+    # A resumed job appends to the log of its earlier attempts
+    log = deque(read_job_log(job_id), maxlen=JOB_LOG_LINES)
+    with _jobs_lock:
+        _job_runtime[job_id] = {
+            'log': log,
+            'seq': log[-1][0] if log else 0,
+            'phase_started': time.monotonic(),
+            'cancel': threading.Event(),
+            'interrupted': False,
+            'condition': threading.Condition(),
+            'finished': False
+        }
+
+def create_job(domain, action, dns_provider=None):
+    """Register a new certificate job (create or renew) for a domain"""
+    job = {
+        'id': secrets.token_hex(8),
+        'domain': domain,
+        'action': action,
+        'dns_provider': dns_provider,
+        'status': 'queued',
+        'phase': None,
+        'created_at': datetime.now().isoformat(),
+        'started_at': None,
+        'finished_at': None,
+        'returncode': None,
+        'message': None,
+        'pid': os.getpid(),
+        'owner': job_owner_token(),
+        'retries': 0,
+        'next_attempt_at': None
+    }
+    _register_job_runtime(job['id'])
+    save_job(job)
+    prune_jobs()
+    return job
+
+def run_job(job):
+    """Run a create or renew job to completion in this worker"""
+    try:
+        if job['action'] == 'renew':
+            success = renew_certificate(job['domain'], job=job)
+        else:
+            settings = load_settings()
+            success, _ = create_certificate(job['domain'], settings.get('email'), job.get('dns_provider'), None, job=job)
+        logger.info(f"Certificate {job['action']} job {job['id']} for {job['domain']}: {'Success' if success else 'Failed'}")
+    except Exception as e:
+        logger.error(f"Error running job {job['id']} for {job['domain']}: {e}")
+
+def start_job(job):
+    """Run a job in a background thread (drained on shutdown by drain_jobs)"""
+    threading.Thread(target=run_job, args=(job,), name=f"job-{job['id']}", daemon=True).start()
+
+def resume_jobs():
+    """Take over unfinished jobs of workers that died, and start retries that are due
+    
+    A job that never got to run certbot is resumed right away. One whose
+    certbot run was interrupted is retried with backoff, up to
+    JOB_MAX_RETRIES times, as the outcome of its order is unknown. A job
+    interrupted while deploying its certificate only deploys again.
+    """
+    now = time.time()
+    for job_file in JOBS_DIR.glob('*.json'):
+        job = safe_file_read(job_file, is_json=True)
+        if not job:
+            continue
+        redeploy = job.get('status') == 'succeeded' and job.get('deploy_status') == 'running'
+        if (job.get('status') in JOB_FINISHED_STATUSES and not redeploy) or job_owner_alive(job.get('owner')):
+            continue
+        if redeploy:
+            logger.warning(f"Deployment of job {job['id']} for {job['domain']} was interrupted, deploying again")
+            update_job(job, owner=job_owner_token(), pid=os.getpid())
+            threading.Thread(target=deploy_issued_certificate, args=(job['domain'], job),
+                             name=f"deploy-{job['id']}", daemon=True).start()
+            continue
+        
+        if (JOBS_DIR / f"{job['id']}.cancel").exists():
+            update_job(job, status='cancelled', message='Cancelled by request', finished_at=datetime.now().isoformat())
+            (JOBS_DIR / f"{job['id']}.cancel").unlink(missing_ok=True)
+            continue
+        
+        # Only a certbot run may have left an order behind; jobs interrupted
+        # while queued or waiting for quota simply start over
+        if job['status'] == 'running' or (job['status'] == 'interrupted' and job.get('certbot_started')):
+            retries = job.get('retries', 0) + 1
+            if retries > JOB_MAX_RETRIES:
+                update_job(job, status='failed', owner=None, finished_at=datetime.now().isoformat(),
+                           message=f"Abandoned after {JOB_MAX_RETRIES} interrupted attempts")
+                continue
+            delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (retries - 1), JOB_RETRY_MAX_SECONDS)
+            logger.warning(f"Job {job['id']} for {job['domain']} was interrupted, retrying in {delay}s")
+            update_job(job, status='retrying', owner=None, retries=retries, next_attempt_at=now + delay,
+                       message=f"Interrupted, retry {retries} of {JOB_MAX_RETRIES} scheduled")
+        elif job['status'] != 'retrying':
+            update_job(job, status='retrying', owner=None, next_attempt_at=now)
+        
+        if job['next_attempt_at'] <= now:
+            logger.info(f"Resuming {job['action']} job {job['id']} for {job['domain']}")
+            _register_job_runtime(job['id'])
+            update_job(job, status='queued', owner=job_owner_token(), pid=os.getpid(), phase=None, next_attempt_at=None,
+                       certbot_started=False)
+            start_job(job)
+    
+    # Clear the lock files of dead workers
+    for lock_path in JOBS_DIR.glob('.owner-*.lock'):
+        job_owner_alive(lock_path.name[len('.owner-'):-len('.lock')])
+
+def drain_jobs(timeout=None):
+    """Let the jobs running in this worker finish before it exits
+    
+    Jobs still waiting for quota are interrupted at once, running ones after
+    timeout seconds (JOB_DRAIN_SECONDS). Interrupted jobs are left for
+    resume_jobs in the worker that runs background services next.
+    """
+    deadline = time.monotonic() + (JOB_DRAIN_SECONDS if timeout is None else timeout)
+    with _jobs_lock:
+        runtimes = [runtime for runtime in _job_runtime.values() if not runtime['finished']]
+    if not runtimes:
+        return
+    logger.info(f"Draining {len(runtimes)} certificate jobs")
+    
+    def interrupt(runtime):
+        runtime['interrupted'] = True
+        runtime['cancel'].set()
+    
+    for job_id, runtime in list(_job_runtime.items()):
+        job = load_job(job_id)
+        if not runtime['finished'] and job and job['status'] != 'running':
+            interrupt(runtime)
+    for runtime in runtimes:
+        with runtime['condition']:
+            runtime['condition'].wait_for(lambda: runtime['finished'], timeout=max(deadline - time.monotonic(), 0))
+        if not runtime['finished']:
+            interrupt(runtime)
+    # Give interrupted certbot runs time to be killed and recorded
+    for runtime in runtimes:
+        with runtime['condition']:
+            runtime['condition'].wait_for(lambda: runtime['finished'], timeout=CERTBOT_KILL_GRACE_SECONDS)
+
+def finish_job(job, success, message):
+    """Record the outcome of a job, keeping cancelled/timed out/interrupted statuses"""
+    status = job.get('status')
+    if status == 'interrupted':
+        # Not finished: resume_jobs retries it
+        update_job(job, message=message)
+    else:
+        if status not in JOB_ABORTED_STATUSES:
+            status = 'succeeded' if success else 'failed'
+        update_job(job, status=status, message=message, finished_at=datetime.now().isoformat())
+        queue_job_webhook(job, status, message)
+    
+    runtime = _job_runtime.get(job['id'])
+    if runtime:
+        with runtime['condition']:
+            runtime['finished'] = True
+            runtime['condition'].notify_all()
+        # Log streams still following the job read the rest from its log file
+        with _jobs_lock:
+            _job_runtime.pop(job['id'], None)
+    (JOBS_DIR / f"{job['id']}.cancel").unlink(missing_ok=True)
+
+def cancel_job(job_id):
+    """Request cancellation of a job, wherever it is running"""
+    job = load_job(job_id)
+    if job is None:
+        return None
+    if job['status'] in JOB_FINISHED_STATUSES:
+        return job
+    
+    runtime = _job_runtime.get(job_id)
+    if runtime:
+        runtime['cancel'].set()
+    else:
+        # Running in another worker: it polls for this marker
+        (JOBS_DIR / f"{job_id}.cancel").touch()
+    return job
+
+def kill_process_group(process):
+    """Terminate a process and all of its children, escalating to SIGKILL"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=CERTBOT_KILL_GRACE_SECONDS)
+    except ProcessLookupError:
+        return
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+def _read_certbot_output(process, job, log_file):
+    """Stream certbot output line by line into the job's ring buffer and log file"""
+    runtime = _job_runtime[job['id']]
+    for line in process.stdout:
+        line = line.rstrip('\n')
+        log_file.write(line + '\n')
+        log_file.flush()
+        with runtime['condition']:
+            runtime['seq'] += 1
+            runtime['log'].append((runtime['seq'], line))
+            runtime['condition'].notify_all()
+        
+        for pattern, phase in CERTBOT_PHASE_PATTERNS:
+            if phase != job['phase'] and pattern.search(line):
+                runtime['phase_started'] = time.monotonic()
+                update_job(job, phase=phase)
+                break
+
+def run_certbot(cmd, job, env=None):
+    """Run a certbot command for a job, enforcing timeouts and honouring cancellation
+    
+    The command runs in its own process group so DNS plugin helpers are
+    killed along with certbot. Returns (returncode, output); returncode is
+    None when the run was cancelled or timed out, with the reason in output.
+    """
+    timeouts = get_certbot_timeouts()
+    runtime = _job_runtime[job['id']]
+    cancel_marker = JOBS_DIR / f"{job['id']}.cancel"
+    if runtime['interrupted']:
+        update_job(job, status='interrupted')
+        return None, 'Interrupted by shutdown'
+    
+    with open(JOBS_DIR / f"{job['id']}.log", 'a') as log_file:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                   bufsize=1, start_new_session=True, env=env)
+        runtime['phase_started'] = time.monotonic()
+        update_job(job, status='running', phase='starting', started_at=datetime.now().isoformat(), certbot_started=True)
+        reader = threading.Thread(target=_read_certbot_output, args=(process, job, log_file), daemon=True)
+        reader.start()
+        
+        started = time.monotonic()
+        abort_status = abort_message = None
+        while process.poll() is None:
+            reader.join(timeout=0.5)
+            now = time.monotonic()
+            phase = job['phase']
+            phase_timeout = timeouts['phases'].get(phase)
+            if runtime['interrupted']:
+                abort_status, abort_message = 'interrupted', 'Interrupted by shutdown'
+            elif runtime['cancel'].is_set() or cancel_marker.exists():
+                abort_status, abort_message = 'cancelled', 'Cancelled by request'
+            elif now - started > timeouts['overall']:
+                abort_status, abort_message = 'timed_out', f"Timed out after {timeouts['overall']}s (phase {phase})"
+            elif phase_timeout and now - runtime['phase_started'] > phase_timeout:
+                abort_status, abort_message = 'timed_out', f"Phase {phase} timed out after {phase_timeout}s"
+            
+            if abort_status:
+                logger.warning(f"Certbot job {job['id']} for {job['domain']}: {abort_message}")
+                update_job(job, status=abort_status)
+                kill_process_group(process)
+                break
+        
+        process.wait()
+        reader.join(timeout=CERTBOT_KILL_GRACE_SECONDS)
+    
+    update_job(job, returncode=process.returncode)
+    if abort_status:
+        return None, abort_message
+    return process.returncode, '\n'.join(line for _, line in list(runtime['log'])[-JOB_RESULT_LINES:])
+
+def read_job_log(job_id, after_seq=0):
+    """Return (seq, line) pairs of a job's output after the given sequence number"""
+    runtime = _job_runtime.get(job_id)
+    if runtime:
+        with runtime['condition']:
+            return [entry for entry in runtime['log'] if entry[0] > after_seq]
+    
+    # Job owned by another worker (or finished before a restart): read its log file
+    lines = []
+    try:
+        with open(JOBS_DIR / f"{job_id}.log") as f:
+            for seq, line in enumerate(f, start=1):
+                if seq > after_seq:
+                    lines.append((seq, line.rstrip('\n')))
+    except FileNotFoundError:
+        pass
+    return lines[-JOB_LOG_LINES:]
+
+def stream_job_log(job_id, after_seq=0):
+    """Yield a job's output as server-sent events until the job finishes
+    
+    The stream also ends after JOB_STREAM_MAX_SECONDS with no end event;
+    EventSource clients then reconnect on their own with Last-Event-ID.
+    """
+    started = last_heartbeat = time.monotonic()
+    yield f"retry: {JOB_STREAM_RETRY_MS}\n\n"
+    while True:
+        runtime = _job_runtime.get(job_id)
+        if runtime:
+            with runtime['condition']:
+                if runtime['seq'] <= after_seq and not runtime['finished']:
+                    runtime['condition'].wait(timeout=JOB_STREAM_POLL_SECONDS * 10)
+        else:
+            time.sleep(JOB_STREAM_POLL_SECONDS)
+        
+        for seq, line in read_job_log(job_id, after_seq):
+            after_seq = seq
+            yield f"id: {seq}\ndata: {line}\n\n"
+        
+        job = load_job(job_id)
+        if job is None or job['status'] in JOB_FINISHED_STATUSES:
+            for seq, line in read_job_log(job_id, after_seq):
+                yield f"id: {seq}\ndata: {line}\n\n"
+            status = job['status'] if job else 'unknown'
+            yield f"event: end\ndata: {json.dumps({'status': status})}\n\n"
+            return
+        
+        if time.monotonic() - started > JOB_STREAM_MAX_SECONDS:
+            return
+        if time.monotonic() - last_heartbeat > 15:
+            last_heartbeat = time.monotonic()
+            yield ": keep-alive\n\n"
+
+# Webhooks
+# Deliveries are written to WEBHOOK_DIR/outbox (one JSON file each, named so
+# they sort oldest first) before anything is sent, so they survive restarts
+# and a slow receiver only ever holds up a delivery thread. Delivery is at
+# least once; receivers can deduplicate on the X-CertMate-Delivery header.
+_webhook_dispatcher = {
+    'thread': None,
+    'stop': threading.Event(),
+    'wake': threading.Event(),
+    'in_flight': set(),
+    'next_attempt': {},
+    'lock': threading.Lock(),
+    'latencies': deque(maxlen=WEBHOOK_LATENCY_SAMPLES),
+    'stats': {'delivered': 0, 'failed_attempts': 0, 'dead_lettered': 0, 'last_delivery_at': None, 'last_error': None}
+}
+
+def validate_webhook(webhook):
+    """Validate an entry of the webhooks setting"""
+    if not isinstance(webhook, dict):
+        return False, "Webhook must be an object"
+    if not isinstance(webhook.get('name'), str) or not webhook['name'].strip():
+        return False, "name is required"
+    url = webhook.get('url')
+    if not isinstance(url, str) or not re.match(r'^https?://\S+$', url):
+        return False, "url must be an http(s) URL"
+    secret = webhook.get('secret')
+    if not isinstance(secret, str) or len(secret) < 16:
+        return False, "secret must be at least 16 characters"
+    events = webhook.get('events')
+    if events is not None and (not isinstance(events, list) or not set(events) <= set(WEBHOOK_EVENTS)):
+        return False, f"events must be a list of {', '.join(WEBHOOK_EVENTS)}"
+    domains = webhook.get('domains')
+    if domains is not None and (not isinstance(domains, list) or not all(isinstance(domain, str) for domain in domains)):
+        return False, "domains must be a list of domain names"
+    return True, None
+
+def get_webhooks(event=None, domain=None):
+    """Return the enabled webhooks, optionally only those subscribed to an event for a domain
+    
+    A webhook without domains receives events for every domain.
+    """
+    webhooks = []
+    for webhook in load_settings_cached().get('webhooks') or []:
+        if not isinstance(webhook, dict) or not webhook.get('enabled', True):
+            continue
+        if event and event not in (webhook.get('events') or WEBHOOK_EVENTS):
+            continue
+        if domain and webhook.get('domains') and domain not in webhook['domains']:
+            continue
+        webhooks.append(webhook)
+    return webhooks
+
+def queue_webhook_event(event, domain, data=None):
+    """Queue an event for delivery to each subscribed webhook
+    
+    Never raises, so that a notification problem cannot fail the issuance
+    or renewal that triggered it.
+    """
+    try:
+        webhooks = get_webhooks(event, domain)
+        if not webhooks:
+            return
+        outbox = WEBHOOK_DIR / "outbox"
+        outbox.mkdir(parents=True, exist_ok=True)
+        created_at = time.time()
+        body = json.dumps({
+            'event': event,
+            'domain': domain,
+            'created_at': datetime.fromtimestamp(created_at, timezone.utc).isoformat(),
+            'data': data or {}
+        })
+        for webhook in webhooks:
+            delivery_id = secrets.token_hex(8)
+            delivery = {
+                'id': delivery_id,
+                'webhook': webhook['name'],
+                'event': event,
+                'body': body,
+                'created_at': created_at,
+                'attempts': 0,
+                'next_attempt_at': 0,
+                'last_error': None
+            }
+            path = outbox / f"{int(created_at * 1000):013d}-{delivery_id}.json"
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            tmp_path.write_text(json.dumps(delivery))
+            os.replace(tmp_path, path)
+        _webhook_dispatcher['wake'].set()
+    except Exception as e:
+        logger.error(f"Failed to queue {event} webhook for {domain}: {e}")
+
+def sign_webhook(secret, timestamp, body):
+    """HMAC-SHA256 signature of a webhook body, computed over timestamp.body"""
+    return hmac.new(secret.encode(), f"{timestamp}.{body}".encode(), hashlib.sha256).hexdigest()
+
+def deliver_webhook(path):
+    """Send one queued delivery, then remove it, reschedule it or dead-letter it"""
+    import requests
+    
+    try:
+        delivery = json.loads(path.read_text())
+    except FileNotFoundError:
+        return
+    except ValueError as e:
+        logger.error(f"Dropping unreadable webhook delivery {path.name}: {e}")
+        path.unlink(missing_ok=True)
+        return
+    
+    webhook = next((webhook for webhook in get_webhooks() if webhook['name'] == delivery['webhook']), None)
+    if webhook is None:
+        logger.warning(f"Dropping {delivery['event']} delivery for removed webhook {delivery['webhook']}")
+        path.unlink(missing_ok=True)
+        return
+    
+    timestamp = str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'CertMate-Webhook',
+        'X-CertMate-Event': delivery['event'],
+        'X-CertMate-Delivery': delivery['id'],
+        'X-CertMate-Timestamp': timestamp,
+        'X-CertMate-Signature': f"sha256={sign_webhook(webhook['secret'], timestamp, delivery['body'])}"
+    }
+    try:
+        response = requests.post(webhook['url'], data=delivery['body'].encode(), headers=headers,
+                                 timeout=WEBHOOK_TIMEOUT_SECONDS)
+        error = None if 200 <= response.status_code < 300 else f"HTTP {response.status_code}"
+    except requests.RequestException as e:
+        error = str(e)
+    
+    stats = _webhook_dispatcher['stats']
+    with _webhook_dispatcher['lock']:
+        if error is None:
+            stats['delivered'] += 1
+            stats['last_delivery_at'] = time.time()
+            _webhook_dispatcher['latencies'].append(time.time() - delivery['created_at'])
+        else:
+            stats['failed_attempts'] += 1
+            stats['last_error'] = f"{webhook['name']}: {error}"
+    
+    if error is None:
+        path.unlink(missing_ok=True)
+        return
+    
+    delivery['attempts'] += 1
+    delivery['last_error'] = error
+    if delivery['attempts'] >= WEBHOOK_MAX_ATTEMPTS:
+        logger.error(f"Giving up {delivery['event']} delivery to webhook {webhook['name']} after "
+                     f"{delivery['attempts']} attempts: {error}")
+        dead_dir = WEBHOOK_DIR / "dead"
+        dead_dir.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(delivery))
+        os.replace(path, dead_dir / path.name)
+        with _webhook_dispatcher['lock']:
+            stats['dead_lettered'] += 1
+        return
+    
+    delay = min(WEBHOOK_RETRY_BASE_SECONDS * 2 ** (delivery['attempts'] - 1), WEBHOOK_RETRY_MAX_SECONDS)
+    delivery['next_attempt_at'] = time.time() + delay * random.uniform(0.8, 1.2)
+    logger.warning(f"Webhook {webhook['name']} {delivery['event']} delivery failed ({error}), "
+                   f"attempt {delivery['attempts']}, retrying in {int(delay)}s")
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(delivery))
+    os.replace(tmp_path, path)
+    _webhook_dispatcher['next_attempt'][path.name] = delivery['next_attempt_at']
+
+def run_webhook_dispatcher():
+    """Hand due outbox deliveries to the delivery pool until stopped"""
+    state = _webhook_dispatcher
+    outbox = WEBHOOK_DIR / "outbox"
+    stats_file = WEBHOOK_DIR / "stats.json"
+    
+    def done(name):
+        with state['lock']:
+            state['in_flight'].discard(name)
+        state['wake'].set()
+    
+    def deliver(path):
+        try:
+            deliver_webhook(path)
+        except Exception as e:
+            logger.error(f"Error delivering webhook {path.name}: {e}")
+        finally:
+            done(path.name)
+    
+    executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix='webhook')
+    saved_stats = None
+    try:
+        while not state['stop'].is_set():
+            state['wake'].clear()
+            now = time.time()
+            try:
+                names = sorted(path.name for path in outbox.glob('*.json'))
+            except OSError:
+                names = []
+            # Forget deliveries that were sent or dead-lettered
+            present = set(names)
+            for name in [name for name in state['next_attempt'] if name not in present]:
+                del state['next_attempt'][name]
+            
+            for name in names:
+                with state['lock']:
+                    # Keep the queue in the outbox rather than in the pool
+                    if len(state['in_flight']) >= WEBHOOK_WORKERS or name in state['in_flight']:
+                        if len(state['in_flight']) >= WEBHOOK_WORKERS:
+                            break
+                        continue
+                if name not in state['next_attempt']:
+                    try:
+                        state['next_attempt'][name] = json.loads((outbox / name).read_text()).get('next_attempt_at', 0)
+                    except (OSError, ValueError):
+                        state['next_attempt'][name] = 0
+                if state['next_attempt'][name] > now:
+                    continue
+                with state['lock']:
+                    state['in_flight'].add(name)
+                executor.submit(deliver, outbox / name)
+            
+            with state['lock']:
+                current_stats = dict(state['stats'], latencies=list(state['latencies']))
+            if current_stats != saved_stats:
+                safe_file_write(stats_file, current_stats)
+                saved_stats = current_stats
+            state['wake'].wait(WEBHOOK_POLL_SECONDS)
+    finally:
+        # Unsent deliveries stay in the outbox for the next dispatcher
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def start_webhook_dispatcher():
+    """Start delivering queued webhooks from this worker"""
+    state = _webhook_dispatcher
+    if state['thread'] is not None and state['thread'].is_alive():
+        return
+    (WEBHOOK_DIR / "outbox").mkdir(parents=True, exist_ok=True)
+    saved = safe_file_read(WEBHOOK_DIR / "stats.json", is_json=True) if (WEBHOOK_DIR / "stats.json").exists() else None
+    if saved:
+        state['latencies'].extend(saved.pop('latencies', []))
+        state['stats'].update(saved)
+    state['stop'].clear()
+    state['thread'] = threading.Thread(target=run_webhook_dispatcher, name='webhook-dispatcher', daemon=True)
+    state['thread'].start()
+
+def stop_webhook_dispatcher():
+    """Stop handing out deliveries; those in flight finish or are retried later"""
+    _webhook_dispatcher['stop'].set()
+    _webhook_dispatcher['wake'].set()
+
+def webhook_metrics():
+    """Return webhook backlog, delivery counters and end-to-end delivery latency"""
+    now = time.time()
+    outbox = sorted((WEBHOOK_DIR / "outbox").glob('*.json'))
+    stats_file = WEBHOOK_DIR / "stats.json"
+    stats = safe_file_read(stats_file, is_json=True) if stats_file.exists() else None
+    stats = stats or {'delivered': 0, 'failed_attempts': 0, 'dead_lettered': 0,
+                      'last_delivery_at': None, 'last_error': None, 'latencies': []}
+    latencies = sorted(stats.pop('latencies', []))
+    
+    def percentile(fraction):
+        return round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)], 3) if latencies else None
+    
+    oldest = int(outbox[0].name.split('-', 1)[0]) / 1000 if outbox else None
+    return {
+        'backlog': len(outbox),
+        'oldest_queued_seconds': round(now - oldest, 1) if oldest else None,
+        'dead_letters': len(list((WEBHOOK_DIR / "dead").glob('*.json'))),
+        'latency_seconds': {'p50': percentile(0.5), 'p95': percentile(0.95),
+                            'max': round(latencies[-1], 3) if latencies else None, 'samples': len(latencies)},
+        **stats
+    }
+
+def queue_job_webhook(job, status, message):
+    """Queue the webhook event for a finished job"""
+    if status == 'succeeded' and job.get('certificate_changed') is False:
+        return  # a renewal that was not due published nothing
+    if status == 'succeeded':
+        event = 'certificate.issued' if job['action'] == 'create' else 'certificate.renewed'
+    elif status in ('failed', 'timed_out'):
+        event = 'certificate.failed'
+    else:
+        return
+    data = {'job_id': job['id'], 'action': job['action'], 'status': status, 'message': message}
+    if status == 'succeeded':
+        metadata = parse_certificate_metadata(get_certificate_dir(job['domain']) / "cert.pem")
+        if metadata:
+            data.update({
+                'serial': metadata['serial'],
+                'fingerprint': metadata['fingerprint'],
+                'expires_at': datetime.fromtimestamp(metadata['expires_at'], timezone.utc).isoformat()
+            })
+    queue_webhook_event(event, job['domain'], data)
+
+def queue_expiry_webhooks(settings):
+    """Queue certificate.expiring events for certificates close to expiry
+    
+    Run from the daily renewal check, so each such certificate is reported
+    once a day until it is renewed.
+    """
+    if not get_webhooks('certificate.expiring'):
+        return
+    cutoff = time.time() + WEBHOOK_EXPIRY_WARNING_DAYS * 86400
+    if INVENTORY_ENABLED:
+        expiring = [(cert_info.domain, cert_info.expires_at)
+                    for cert_info in inventory_list_certificates(expiring_before=cutoff) if cert_info.exists]
+    else:
+        expiring = []
+        for domain_entry in settings.get('domains', []):
+            domain = domain_entry.get('domain') if isinstance(domain_entry, dict) else domain_entry
+            if not isinstance(domain, str):
+                continue
+            metadata = parse_certificate_metadata(get_certificate_dir(domain) / "cert.pem")
+            if metadata and metadata['expires_at'] < cutoff:
+                expiring.append((domain, metadata['expires_at']))
+    for domain, expires_at in expiring:
+        queue_webhook_event('certificate.expiring', domain, {
+            'expires_at': datetime.fromtimestamp(expires_at, timezone.utc).isoformat(),
+            'days_left': int((expires_at - time.time()) // 86400)
+        })
+
+# Deploy hooks
+# Each target is either a command (run without a shell, with the certificate
+# paths in CERTMATE_* environment variables) or an HTTP POST. Canary targets
+# are deployed first; if any of them fails the others are skipped, so a bad
+# certificate or hook stops at the canaries. Results and timings are kept in
+# the job record under deployments.
+def validate_deploy_target(target):
+    """Validate an entry of the deploy_targets setting"""
+    if not isinstance(target, dict):
+        return False, "Deploy target must be an object"
+    if not isinstance(target.get('name'), str) or not target['name'].strip():
+        return False, "name is required"
+    if bool(target.get('command')) == bool(target.get('url')):
+        return False, "exactly one of command and url is required"
+    command = target.get('command')
+    if command is not None and not (isinstance(command, str) or
+                                    (isinstance(command, list) and all(isinstance(arg, str) for arg in command))):
+        return False, "command must be a string or a list of arguments"
+    url = target.get('url')
+    if url is not None and (not isinstance(url, str) or not re.match(r'^https?://\S+$', url)):
+        return False, "url must be an http(s) URL"
+    if target.get('send_certificate') and not (url or '').startswith('https://'):
+        return False, "send_certificate requires an https:// url, since the private key is sent"
+    headers = target.get('headers')
+    if headers is not None and (not isinstance(headers, dict) or not all(isinstance(value, str) for value in headers.values())):
+        return False, "headers must map names to strings"
+    timeout = target.get('timeout')
+    if timeout is not None and (not isinstance(timeout, (int, float)) or not 0 < timeout <= 3600):
+        return False, "timeout must be between 1 and 3600 seconds"
+    domains = target.get('domains')
+    if domains is not None and (not isinstance(domains, list) or not all(isinstance(domain, str) for domain in domains)):
+        return False, "domains must be a list of domain names"
+    return True, None
+
+def get_deploy_targets(domain):
+    """Return the enabled deploy targets for a domain (targets without domains apply to all)"""
+    return [target for target in load_settings_cached().get('deploy_targets') or []
+            if isinstance(target, dict) and target.get('enabled', True)
+            and (not target.get('domains') or domain in target['domains'])]
+
+def run_deploy_command(target, domain, cert_dir, timeout):
+    """Run a command deploy target, returning (status, detail, output)"""
+    command = target['command']
+    args = shlex.split(command) if isinstance(command, str) else list(command)
+    env = dict(os.environ,
+               CERTMATE_DOMAIN=domain,
+               CERTMATE_TARGET=target['name'],
+               CERTMATE_CERT_DIR=str(cert_dir.resolve()),
+               CERTMATE_CERT=str((cert_dir / "cert.pem").resolve()),
+               CERTMATE_CHAIN=str((cert_dir / "chain.pem").resolve()),
+               CERTMATE_FULLCHAIN=str((cert_dir / "fullchain.pem").resolve()),
+               CERTMATE_PRIVKEY=str((cert_dir / "privkey.pem").resolve()))
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                   env=env, start_new_session=True)
+    except OSError as e:
+        return 'failed', str(e), ''
+    try:
+        output, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        # Kill the whole group, so hooks that ssh or scp don't linger
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        output, _ = process.communicate()
+        return 'timed_out', f"Timed out after {timeout}s", output
+    if process.returncode != 0:
+        return 'failed', f"Exit code {process.returncode}", output
+    return 'succeeded', "Exit code 0", output
+
+def run_deploy_request(target, domain, cert_dir, timeout):
+    """Call an HTTP deploy target, returning (status, detail, output)"""
+    import requests
+    
+    metadata = parse_certificate_metadata(cert_dir / "cert.pem") or {}
+    payload = {'domain': domain, 'serial': metadata.get('serial'), 'fingerprint': metadata.get('fingerprint'),
+               'expires_at': metadata.get('expires_at')}
+    send_certificate = bool(target.get('send_certificate'))
+    if send_certificate:
+        # Targets saved before https was required are refused here too
+        if not target['url'].startswith('https://'):
+            return 'failed', "send_certificate requires an https:// url", ''
+        payload['fullchain'] = (cert_dir / "fullchain.pem").read_text()
+        payload['privkey'] = (cert_dir / "privkey.pem").read_text()
+    try:
+        # A redirect could carry the private key to another (plain http) URL
+        response = requests.post(target['url'], json=payload, headers=target.get('headers') or {}, timeout=timeout,
+                                 allow_redirects=not send_certificate)
+    except requests.Timeout:
+        return 'timed_out', f"Timed out after {timeout}s", ''
+    except requests.RequestException as e:
+        return 'failed', str(e), ''
+    status = 'succeeded' if 200 <= response.status_code < 300 else 'failed'
+    return status, f"HTTP {response.status_code}", response.text
+
+def deploy_to_target(target, domain, cert_dir):
+    """Deploy to one target, returning its result record"""
+    timeout = target.get('timeout') or DEPLOY_TIMEOUT_SECONDS
+    started_at = datetime.now().isoformat()
+    started = time.monotonic()
+    try:
+        if target.get('command'):
+            status, detail, output = run_deploy_command(target, domain, cert_dir, timeout)
+        else:
+            status, detail, output = run_deploy_request(target, domain, cert_dir, timeout)
+    except Exception as e:
+        status, detail, output = 'failed', f"Exception: {e}", ''
+    result = {
+        'target': target['name'],
+        'canary': bool(target.get('canary')),
+        'status': status,
+        'detail': detail,
+        'started_at': started_at,
+        'duration_ms': round((time.monotonic() - started) * 1000),
+        'output': (output or '')[-DEPLOY_OUTPUT_CHARS:]
+    }
+    log = logger.info if status == 'succeeded' else logger.warning
+    log(f"Deploy of {domain} to {target['name']}: {status} ({detail}, {result['duration_ms']} ms)")
+    return result
+
+def deploy_certificate(domain, job, message):
+    """Push a newly issued certificate to its deploy targets, recording results in the job
+    
+    Returns the job message, noting the deployment outcome unless there are
+    no targets. Deployment problems never fail the issuance itself.
+    """
+    targets = get_deploy_targets(domain)
+    if not targets:
+        return message
+    
+    cert_dir = get_certificate_dir(domain)
+    parallelism = load_settings_cached().get('deploy_parallelism') or DEPLOY_PARALLELISM
+    canaries = [target for target in targets if target.get('canary')]
+    others = [target for target in targets if not target.get('canary')]
+    update_job(job, phase='deploy', deployments=[], deploy_status='running')
+    started = time.monotonic()
+    
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, min(int(parallelism), len(targets)))) as executor:
+        for wave in (canaries, others):
+            if not wave:
+                continue
+            if results and any(result['status'] != 'succeeded' for result in results):
+                results += [{'target': target['name'], 'canary': False, 'status': 'skipped',
+                             'detail': 'Canary deployment failed', 'duration_ms': 0} for target in wave]
+                logger.error(f"Canary deployment of {domain} failed, skipped {len(wave)} targets")
+                break
+            for result in executor.map(lambda target: deploy_to_target(target, domain, cert_dir), wave):
+                results.append(result)
+                update_job(job, deployments=results)
+    
+    succeeded = sum(result['status'] == 'succeeded' for result in results)
+    deploy_status = 'succeeded' if succeeded == len(results) else 'partial' if succeeded else 'failed'
+    duration_ms = round((time.monotonic() - started) * 1000)
+    update_job(job, deployments=results, deploy_status=deploy_status, deploy_duration_ms=duration_ms)
+    inventory_record_event(domain, 'deploy', deploy_status == 'succeeded',
+                           f"Deployed to {succeeded} of {len(results)} targets in {duration_ms} ms")
+    return f"{message}; deployed to {succeeded} of {len(results)} targets"
+
+def deploy_issued_certificate(domain, job):
+    """Deploy a certificate once its job has been recorded as succeeded
+    
+    The deployment is a step of its own after the issuance: a worker restart
+    during it makes resume_jobs deploy again, never order again, and an error
+    in it is recorded on the job instead of leaving the job unfinished.
+    """
+    # The outcome of the issuance, kept apart from that of (re)deployments
+    issue_message = job.setdefault('issue_message', job.get('message'))
+    try:
+        message = deploy_certificate(domain, job, issue_message)
+    except Exception as e:
+        logger.error(f"Error deploying certificate for {domain} (job {job['id']}): {e}")
+        update_job(job, deploy_status='failed', message=f"{issue_message}; deployment failed: {e}")
+        inventory_record_event(domain, 'deploy', False, str(e))
+        return
+    update_job(job, message=message)
+
+# ACME accounts
+# Orders are spread across the accounts in the acme_accounts setting, each on
+# its own CA directory (Let's Encrypt, ZeroSSL, an internal step-ca...). An
+# account that returns CA errors (rate limited, unreachable, server errors)
+# is left out for a cooldown and its orders fail over to the other accounts.
+# Without the setting every order goes through certbot's default account.
+def get_acme_accounts():
+    """Return the enabled ACME accounts, or the implicit default account"""
+    accounts = []
+    for index, account in enumerate(load_settings_cached().get('acme_accounts') or []):
+        if isinstance(account, dict) and account.get('enabled', True):
+            accounts.append({**account, 'name': account.get('name') or f"account{index + 1}"})
+    return accounts or [{'name': 'default'}]
+
+def validate_acme_account(account):
+    """Validate an entry of the acme_accounts setting"""
+    if not isinstance(account, dict):
+        return False, "ACME account must be an object"
+    server = account.get('server')
+    if server is not None and (not isinstance(server, str) or not re.match(r'^https?://[^\s;&|`]+$', server)):
+        return False, "server must be an ACME directory URL"
+    if account.get('email'):
+        is_valid, email_error = validate_email(account['email'])
+        if not is_valid:
+            return False, email_error
+    if bool(account.get('eab_kid')) != bool(account.get('eab_hmac_key')):
+        return False, "eab_kid and eab_hmac_key must be set together"
+    caa_identities = account.get('caa_identities')
+    if caa_identities is not None and (not isinstance(caa_identities, list) or not all(
+            isinstance(identity, str) and validate_domain(identity)[0] for identity in caa_identities)):
+        return False, "caa_identities must be a list of domain names"
+    for key in ('name', 'account_id', 'eab_kid', 'eab_hmac_key', 'ca_bundle'):
+        value = account.get(key)
+        if value is not None and (not isinstance(value, str) or any(char in value for char in ' \n\r\t;&|`')):
+            return False, f"{key} contains invalid characters"
+    return True, None
+
+def acme_account_args(account):
+    """Return the certbot arguments placing an order through an ACME account"""
+    args = []
+    if account.get('server'):
+        args += ['--server', account['server']]
+    if account.get('email'):
+        args += ['--email', account['email']]  # overrides the settings email given earlier
+    if account.get('account_id'):
+        args += ['--account', account['account_id']]
+    if account.get('eab_kid'):
+        args += ['--config', str(create_eab_config(account))]
+    if account.get('no_verify_ssl'):
+        args.append('--no-verify-ssl')
+    return args
+
+def create_eab_config(account):
+    """Create the certbot configuration file holding an account's EAB credentials
+    
+    Given with --config rather than as arguments, which any local user could
+    read from the process list.
+    """
+    config_dir = LETSENCRYPT_DIR / "config"
+    config_dir.mkdir(parents=True, exist_ok=True)
+    config_file = config_dir / f"eab-{hashlib.sha256(account['name'].encode()).hexdigest()[:16]}.ini"
+    tmp_file = config_file.with_name(f".{config_file.name}.{secrets.token_hex(4)}")
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(f"eab-kid = {account['eab_kid']}\n")
+        f.write(f"eab-hmac-key = {account['eab_hmac_key']}\n")
+    os.replace(tmp_file, config_file)
+    return config_file
+
+def acme_account_env(account):
+    """Return the environment for certbot runs of an account (None to inherit ours)"""
+    if not account.get('ca_bundle'):
+        return None
+    return {**os.environ, 'REQUESTS_CA_BUNDLE': account['ca_bundle']}
+
+def lineage_account(domain):
+    """Return the account matching the CA a certbot lineage was issued by"""
+    accounts = get_acme_accounts()
+    server = LETSENCRYPT_DEFAULT_SERVER
+    try:
+        renewal_conf = (LETSENCRYPT_DIR / "config" / "renewal" / f"{domain}.conf").read_text()
+        match = re.search(r'^server\s*=\s*(\S+)', renewal_conf, re.M)
+        if match:
+            server = match.group(1)
+    except OSError:
+        pass
+    for account in accounts:
+        if (account.get('server') or LETSENCRYPT_DEFAULT_SERVER).rstrip('/') == server.rstrip('/'):
+            return account
+    return {'name': 'default'}
+
+def load_acme_health():
+    """Return the CA error state of every account: consecutive_errors, cooldown_until, last_error"""
+    if not ACME_HEALTH_FILE.exists():
+        return {}
+    return safe_file_read(ACME_HEALTH_FILE, is_json=True) or {}
+
+def record_acme_result(account, returncode, output):
+    """Track CA errors of an account after a certbot run; returns whether it was one
+    
+    Each consecutive CA error doubles the account's cooldown, unless the CA
+    said when to retry. A success clears it. Other failures, like a DNS
+    challenge that did not validate, are not held against the account.
+    """
+    ca_error = returncode not in (0, None) and bool(ACME_CA_ERROR_PATTERN.search(output or ''))
+    if returncode != 0 and not ca_error:
+        return False
+    
+    ACME_HEALTH_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(ACME_HEALTH_FILE.with_suffix('.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        health = load_acme_health()
+        state = health.setdefault(account['name'], {'consecutive_errors': 0, 'cooldown_until': 0, 'last_error': None})
+        if ca_error:
+            state['consecutive_errors'] += 1
+            cooldown_until = time.time() + min(ACME_COOLDOWN_BASE_SECONDS * 2 ** (state['consecutive_errors'] - 1),
+                                               ACME_COOLDOWN_MAX_SECONDS)
+            retry_after = ACME_RETRY_AFTER_PATTERN.search(output)
+            if retry_after:
+                retry_at = datetime.strptime(retry_after.group(1).replace('T', ' '), '%Y-%m-%d %H:%M:%S')
+                cooldown_until = max(cooldown_until, retry_at.replace(tzinfo=timezone.utc).timestamp())
+            state['cooldown_until'] = cooldown_until
+            state['last_error'] = ACME_CA_ERROR_PATTERN.search(output).group(0)
+            logger.warning(f"CA error for ACME account {account['name']}, cooling down until "
+                           f"{datetime.fromtimestamp(cooldown_until).isoformat()}")
+        else:
+            state.update(consecutive_errors=0, cooldown_until=0)
+        safe_file_write(ACME_HEALTH_FILE, health)
+    return ca_error
+
+def rank_acme_accounts(accounts):
+    """Return (account, cooldown seconds) pairs, the account to try first first
+    
+    Accounts that are not cooling down come first, those with the largest
+    share of their order quota left ahead, so that orders spread across
+    accounts. Ties keep the configured order.
+    """
+    health = load_acme_health()
+    now = time.time()
+    ranked = []
+    with rate_limit_ledger(save=False) as entries:
+        for index, account in enumerate(accounts):
+            cooldown = max(math.ceil(health.get(account['name'], {}).get('cooldown_until', 0) - now), 0)
+            orders = rate_limit_buckets(entries, [('new_orders_per_account', account['name'])],
+                                        account['name'])['new_orders_per_account']
+            ranked.append((cooldown > 0, -orders['remaining'] / orders['limit'], index, account, cooldown))
+    ranked.sort(key=lambda item: item[:3])
+    return [(account, cooldown) for _, _, _, account, cooldown in ranked]
+
+def run_certbot_order(cmd, job, domain, renewal=False):
+    """Run a certbot command placing an order, choosing the ACME account for it
+    
+    On a CA error the account is cooled down and the order fails over to
+    the next account not tried yet. Returns (returncode, output) like
+    run_certbot; returncode is also None when no account can take the order.
+    """
+    accounts = get_acme_accounts()
+    while True:
+        entry_id, account, error = wait_for_order_quota(domain, job, renewal, accounts)
+        if entry_id is None:
+            return None, error
+        returncode, output = None, None
+        try:
+            returncode, output = run_certbot([*cmd, *acme_account_args(account)], job, env=acme_account_env(account))
+        finally:
+            record_order_result(entry_id, returncode == 0)
+        
+        accounts = [other for other in accounts if other['name'] != account['name']]
+        if not record_acme_result(account, returncode, output) or not accounts:
+            return returncode, output
+        logger.warning(f"Order for {domain} failed over from ACME account {account['name']} to another account")
+
+# CA rate limits
+# Every order sent to a CA is recorded in a ledger under DATA_DIR shared by
+# all workers. Each limit is a token bucket, replayed from the ledger entries
+# drawing from it, so no bucket state is stored on its own. New orders and
+# failed validations are counted per ACME account; certificates per
+# registered domain and duplicate certificates are counted per CA directory,
+# across all accounts on it, as the CA does. As at Let's Encrypt, renewals
+# are exempt from the new order and per-registered-domain limits but count as
+# duplicate certificates.
+def get_rate_limits(account_name=None):
+    """Return the rate limits of an account: its own, then the rate_limits setting, then the defaults"""
+    settings = load_settings_cached()
+    account_limits = next((account.get('rate_limits') or {} for account in get_acme_accounts()
+                           if account['name'] == account_name), {})
+    limits = {}
+    for name, default in DEFAULT_RATE_LIMITS.items():
+        limits[name] = dict(default)
+        limits[name].update((settings.get('rate_limits') or {}).get(name) or {})
+        limits[name].update(account_limits.get(name) or {})
+    return limits
+
+def registered_domain(domain):
+    """Return the registered domain of a name, e.g. example.co.uk for *.www.example.co.uk"""
+    domain = domain.lower().rstrip('.')
+    if domain.startswith('*.'):
+        domain = domain[2:]
+    labels = domain.split('.')
+    suffix_length = 2 if '.'.join(labels[-2:]) in MULTI_LABEL_PUBLIC_SUFFIXES else 1
+    return '.'.join(labels[-(suffix_length + 1):])
+
+@contextmanager
+def rate_limit_ledger(save=True):
+    """Lock the ledger across workers and yield its entries, saving changes on exit
+    
+    Entries are kept for twice the longest window, after which they no longer
+    make a difference to a bucket replayed from a full state.
+    """
+    RATE_LIMIT_LEDGER_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(RATE_LIMIT_LEDGER_FILE.with_suffix('.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if save else fcntl.LOCK_SH)
+        entries = []
+        if RATE_LIMIT_LEDGER_FILE.exists():
+            entries = safe_file_read(RATE_LIMIT_LEDGER_FILE, is_json=True) or []
+        horizon = time.time() - 2 * 3600 * max(limit['window_hours'] for limit in get_rate_limits().values())
+        entries = [entry for entry in entries if (entry['finished_at'] or entry['at']) >= horizon]
+        yield entries
+        if save:
+            tmp_file = RATE_LIMIT_LEDGER_FILE.with_suffix('.tmp')
+            with open(tmp_file, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_file, RATE_LIMIT_LEDGER_FILE)
+
+def acme_account_server(account_name):
+    """Return the CA directory URL of an ACME account"""
+    account = next((account for account in get_acme_accounts() if account['name'] == account_name), {})
+    return (account.get('server') or LETSENCRYPT_DEFAULT_SERVER).rstrip('/')
+
+def new_order_entry(domain, renewal=False, account_name='default'):
+    """Build the ledger entry for an order of domain and its wildcard"""
+    return {
+        'id': secrets.token_hex(8),
+        'at': time.time(),
+        'finished_at': None,
+        'account': account_name,
+        'server': acme_account_server(account_name),
+        'registered_domain': registered_domain(domain),
+        'names': sorted([domain, f'*.{domain}']),
+        'renewal': renewal,
+        'status': 'pending'
+    }
+
+def rate_limit_draws(entry):
+    """Return (limit name, bucket key, timestamp) for every bucket a ledger entry draws from"""
+    account = entry['account']
+    # Entries recorded before the CA was stored count towards the account's current CA
+    server = entry.get('server') or acme_account_server(account)
+    names = ','.join(entry['names'])
+    draws = []
+    if entry['status'] == 'not_ordered':
+        return draws
+    if not entry['renewal']:
+        draws.append(('new_orders_per_account', account, entry['at']))
+    if entry['status'] == 'failed':
+        draws.append(('failed_validations', f"{account}|{names}", entry['finished_at']))
+    else:
+        # Pending orders hold their token until they are known to have failed
+        if not entry['renewal']:
+            draws.append(('certificates_per_registered_domain', f"{server}|{entry['registered_domain']}", entry['at']))
+        draws.append(('duplicate_certificates', f"{server}|{names}", entry['at']))
+    return draws
+
+def rate_limit_buckets(entries, buckets, account_name=None, now=None):
+    """Replay the ledger through the given (limit name, key) buckets, with one account's limits
+    
+    Returns {limit name: {'key', 'limit', 'window_hours', 'remaining',
+    'retry_after_seconds'}}; retry_after_seconds is 0 when a token is available.
+    """
+    now = now or time.time()
+    limits = get_rate_limits(account_name)
+    wanted = dict(buckets)
+    timestamps = {name: [] for name in wanted}
+    for entry in entries:
+        for name, key, at in rate_limit_draws(entry):
+            if wanted.get(name) == key:
+                timestamps[name].append(at)
+    
+    state = {}
+    for name, key in wanted.items():
+        capacity = limits[name]['limit']
+        rate = capacity / (limits[name]['window_hours'] * 3600)
+        tokens, last = float(capacity), None
+        for at in sorted(timestamps[name]):
+            if last is not None:
+                tokens = min(capacity, tokens + (at - last) * rate)
+            tokens -= 1
+            last = at
+        if last is not None:
+            tokens = min(capacity, tokens + (now - last) * rate)
+        state[name] = {
+            'key': key,
+            'limit': capacity,
+            'window_hours': limits[name]['window_hours'],
+            'remaining': max(math.floor(tokens), 0),
+            'retry_after_seconds': 0 if tokens >= 1 else math.ceil((1 - tokens) / rate)
+        }
+    return state
+
+def order_buckets(domain, renewal=False, account_name='default'):
+    """Return the (limit name, key) buckets an order for domain is admitted against"""
+    entry = new_order_entry(domain, renewal, account_name)
+    buckets = [(name, key) for name, key, _ in rate_limit_draws(entry)]
+    # An order does not draw on failed validations, but is held back once they are exhausted
+    buckets.append(('failed_validations', f"{account_name}|{','.join(entry['names'])}"))
+    return buckets
+
+def reserve_order(domain, renewal=False, account_name='default'):
+    """Record an order for domain if every bucket it draws from has a token
+    
+    Returns (entry_id, 0, None) when admitted, otherwise (None, seconds to
+    wait, name of the exhausted limit).
+    """
+    with rate_limit_ledger() as entries:
+        state = rate_limit_buckets(entries, order_buckets(domain, renewal, account_name), account_name)
+        blocking = max(state, key=lambda name: state[name]['retry_after_seconds'])
+        if state[blocking]['retry_after_seconds'] > 0:
+            return None, state[blocking]['retry_after_seconds'], blocking
+        entry = new_order_entry(domain, renewal, account_name)
+        entries.append(entry)
+        return entry['id'], 0, None
+
+def record_order_result(entry_id, success, ordered=True):
+    """Mark a reserved order as issued or failed, or release it if no order was placed"""
+    status = 'not_ordered' if not ordered else 'issued' if success else 'failed'
+    try:
+        with rate_limit_ledger() as entries:
+            for entry in entries:
+                if entry['id'] == entry_id:
+                    entry.update(status=status, finished_at=time.time())
+                    break
+    except Exception as e:
+        logger.error(f"Error recording order result in rate limit ledger: {e}")
+
+def order_wait_seconds(domain, renewal=False):
+    """Seconds until some ACME account would take an order for domain (0 if one would now)"""
+    waits = []
+    with rate_limit_ledger(save=False) as entries:
+        for account, cooldown in rank_acme_accounts(get_acme_accounts()):
+            state = rate_limit_buckets(entries, order_buckets(domain, renewal, account['name']), account['name'])
+            waits.append(max(cooldown, *(bucket['retry_after_seconds'] for bucket in state.values())))
+    return min(waits)
+
+def wait_for_order_quota(domain, job, renewal=False, accounts=None):
+    """Reserve an order for a job with the best ACME account that has quota
+    
+    The job is deferred while every account is rate limited or cooling down.
+    Returns (entry_id, account, None), or (None, None, reason) when the job
+    should not go ahead: it was cancelled, or the wait exceeds
+    RATE_LIMIT_MAX_DEFER_SECONDS.
+    """
+    runtime = _job_runtime[job['id']]
+    cancel_marker = JOBS_DIR / f"{job['id']}.cancel"
+    accounts = accounts or get_acme_accounts()
+    while True:
+        waits = []
+        for account, cooldown in rank_acme_accounts(accounts):
+            if cooldown:
+                waits.append((cooldown, f"ACME account {account['name']} to recover from CA errors"))
+                continue
+            entry_id, wait, limit_name = reserve_order(domain, renewal, account['name'])
+            if entry_id:
+                return entry_id, account, None
+            waits.append((wait, f"rate limit {limit_name} of ACME account {account['name']}"))
+        
+        wait, reason = min(waits)
+        if wait > RATE_LIMIT_MAX_DEFER_SECONDS:
+            return None, None, f"No ACME account available for another {math.ceil(wait / 60)} minutes (waiting for {reason})"
+        
+        message = f"Waiting for {reason}"
+        if job['status'] != 'deferred' or job['message'] != message:
+            logger.info(f"Job {job['id']} for {domain} deferred {wait}s: {message}")
+            update_job(job, status='deferred', message=message,
+                       not_before=(datetime.now() + timedelta(seconds=wait)).isoformat())
+        if runtime['cancel'].wait(min(wait, RATE_LIMIT_POLL_SECONDS)) or cancel_marker.exists():
+            if runtime['interrupted']:
+                update_job(job, status='interrupted')
+                return None, None, 'Interrupted by shutdown'
+            update_job(job, status='cancelled')
+            return None, None, 'Cancelled by request'
+
+def rate_limit_overview():
+    """Remaining quota of every ACME account, overall and per configured registered domain"""
+    settings = load_settings_cached()
+    domains = [entry.get('domain') if isinstance(entry, dict) else entry for entry in settings.get('domains', [])]
+    registered = sorted({registered_domain(domain) for domain in domains if domain})
+    health = load_acme_health()
+    overview = {}
+    with rate_limit_ledger(save=False) as entries:
+        for account in get_acme_accounts():
+            name = account['name']
+            overview[name] = {
+                'server': account.get('server') or LETSENCRYPT_DEFAULT_SERVER,
+                'cooldown_until': health.get(name, {}).get('cooldown_until') or None,
+                'last_error': health.get(name, {}).get('last_error'),
+                'new_orders_per_account': rate_limit_buckets(
+                    entries, [('new_orders_per_account', name)], name)['new_orders_per_account'],
+                'certificates_per_registered_domain': {
+                    domain: rate_limit_buckets(entries, [('certificates_per_registered_domain',
+                                                          f"{acme_account_server(name)}|{domain}")],
+                                               name)['certificates_per_registered_domain']
+                    for domain in registered
+                }
+            }
+    return {'accounts': overview}
+
+# Certificate info
+# Certificate metadata is held in compact, immutable CertificateInfo records:
+# lists of tens of thousands of them are built from the inventory, and records
+# can be shared between callers without copying. Values derived from the
+# current time are computed when read, and records become dicts only when a
+# response is serialized (to_dict).
+
+@dataclass(frozen=True)
+class CertificateInfo:
+    """Certificate metadata of a domain; expires_at is None when it has no certificate"""
+    __slots__ = ('domain', 'expires_at', 'dns_provider', 'key_type', 'key_size', 'preferred_chain', 'chain_size_bytes')
+
+    domain: str
+    expires_at: Optional[float]
+    dns_provider: Optional[str]
+    key_type: Optional[str]
+    key_size: Optional[int]
+    preferred_chain: Optional[str]
+    chain_size_bytes: Optional[int]
+
+    @classmethod
+    def missing(cls, domain, dns_provider=None, preferred_chain=None):
+        """Record for a domain without a (readable) certificate"""
+        return cls(domain, None, dns_provider, None, None, preferred_chain, None)
+
+    @property
+    def exists(self):
+        return self.expires_at is not None
+
+    @property
+    def expiry_date(self):
+        if self.expires_at is None:
+            return None
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(self.expires_at))
+
+    @property
+    def days_left(self):
+        if self.expires_at is None:
+            return None
+        return math.floor((self.expires_at - time.time()) / 86400)
+
+    @property
+    def needs_renewal(self):
+        return self.expires_at is not None and self.days_left < RENEWAL_THRESHOLD_DAYS
+
+    def to_dict(self):
+        """The certificate as returned by the API (certificate_model)"""
+        days_left = self.days_left
+        return {
+            'domain': self.domain,
+            'exists': self.expires_at is not None,
+            'expiry_date': self.expiry_date,
+            'days_left': days_left,
+            'days_until_expiry': days_left,
+            'needs_renewal': days_left is not None and days_left < RENEWAL_THRESHOLD_DAYS,
+            'dns_provider': self.dns_provider,
+            'key_type': self.key_type,
+            'key_size': self.key_size,
+            'preferred_chain': self.preferred_chain,
+            'chain_size_bytes': self.chain_size_bytes
+        }
+
+def get_certificate_info(domain):
+    """Get certificate information for a domain (concurrent calls for a domain share one computation)"""
+    return singleflight('cert_info', domain, lambda: _get_certificate_info(domain))
+
+def _get_certificate_info(domain):
+    """Read and parse a domain's certificate for get_certificate_info"""
+    cert_path = get_certificate_dir(domain)
+    if not cert_path.exists():
+        return CertificateInfo.missing(domain)
+    
+    cert_file = cert_path / "cert.pem"
+    if not cert_file.exists():
+        return CertificateInfo.missing(domain)
+    
+    # Get DNS provider and key settings from settings
+    settings = load_settings_cached()
+    dns_provider = get_domain_dns_provider(domain, settings)
+    preferred_chain = get_domain_key_settings(domain, settings)['preferred_chain']
+    
+    metadata = parse_certificate_metadata(cert_file)
+    if metadata is None:
+        return CertificateInfo.missing(domain, dns_provider, preferred_chain)
+    return CertificateInfo(
+        domain=domain,
+        expires_at=metadata['expires_at'],
+        dns_provider=dns_provider,
+        key_type=metadata['key_type'],
+        key_size=metadata['key_size'],
+        preferred_chain=preferred_chain,
+        chain_size_bytes=certificate_chain_size(cert_path)
+    )
+
+def create_certificate(domain, email, dns_provider=None, dns_config=None, job=None):
+    """Create SSL certificate using Let's Encrypt with configurable DNS challenge"""
+    if job is None:
+        job = create_job(domain, 'create')
+    success, message = _create_certificate(domain, email, dns_provider, dns_config, job)
+    finish_job(job, success, message)
+    if success:
+        deploy_issued_certificate(job['domain'], job)
+    return success, job.get('message', message)
+
+def _create_certificate(domain, email, dns_provider, dns_config, job, action='create'):
+    """Validate input, build the certbot command for the DNS provider and run it as job"""
+    try:
+        # Enhanced input validation
+        if not domain or not isinstance(domain, str):
+            return False, "Invalid domain provided"
+            
+        # Validate domain format and security
+        is_valid_domain, domain_error = validate_domain(domain)
+        if not is_valid_domain:
+            return False, f"Domain validation failed: {domain_error}"
+        domain = domain_error  # validated domain
+        
+        # Validate email
+        is_valid_email, email_error = validate_email(email)
+        if not is_valid_email:
+            return False, f"Email validation failed: {email_error}"
+        email = email_error  # validated email
+        
+        # Load settings to get DNS provider configuration
+        settings = load_settings()
+        
+        # Use provided DNS provider or fall back to settings
+        if not dns_provider:
+            dns_provider = settings.get('dns_provider', 'cloudflare')
+        
+        if not dns_config:
+            dns_config = settings.get('dns_providers', {}).get(dns_provider, {})
+        
+        # Create config file based on DNS provider
+        config_file = None
+        dns_plugin = None
+        dns_args = []
+        
+        if dns_provider == 'cloudflare':
+            token = dns_config.get('api_token') or settings.get('cloudflare_token', '')  # Backward compatibility
+            if not token:
+                return False, "Cloudflare API token not configured"
+            config_file = create_cloudflare_config(token)
+            dns_plugin = 'cloudflare'
+            dns_args = ['--dns-cloudflare-credentials', str(config_file), '--dns-cloudflare-propagation-seconds', '60']
+            
+        elif dns_provider == 'route53':
+            access_key = dns_config.get('access_key_id', '')
+            secret_key = dns_config.get('secret_access_key', '')
+            if not access_key or not secret_key:
+                return False, "AWS Route53 credentials not configured"
             config_file = create_route53_config(access_key, secret_key)
             dns_plugin = 'route53'
             dns_args = ['--dns-route53-credentials', str(config_file)]
@@ -706,57 +4055,68 @@ def create_certificate(domain, email, dns_provider=None, dns_config=None):
                 logger.error(f"Failed to configure DNS provider {dns_provider}: {e}")
                 return False, f"Failed to configure DNS provider '{dns_provider}': {str(e)}"
         
-        # Create local directories for certbot
-        letsencrypt_dir = Path("letsencrypt")
-        config_dir = letsencrypt_dir / "config"
-        work_dir = letsencrypt_dir / "work"
-        logs_dir = letsencrypt_dir / "logs"
-        
-        # Create directories if they don't exist
-        config_dir.mkdir(parents=True, exist_ok=True)
-        work_dir.mkdir(parents=True, exist_ok=True)
-        logs_dir.mkdir(parents=True, exist_ok=True)
-        
         # Prepare certbot command with local directories
+        config_dir, dir_args = certbot_dir_args()
         cmd = [
             'certbot', 'certonly',
-            '--config-dir', str(config_dir),
-            '--work-dir', str(work_dir),
-            '--logs-dir', str(logs_dir),
+            *dir_args,
             f'--dns-{dns_plugin}',
             *dns_args,
             '--email', email,
             '--agree-tos',
-            '--non-interactive',
-            '--cert-name', domain,
-            '-d', domain,
-            '-d', f'*.{domain}'  # Include wildcard
+            '--non-interactive'
         ]
+        domains = [domain, f'*.{domain}']  # Include wildcard
         
-        logger.info(f"Creating certificate for {domain} using {dns_provider} DNS provider")
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        key_settings = get_domain_key_settings(domain, settings)
         
-        if result.returncode == 0:
-            # Copy certificates to our directory
-            src_dir = config_dir / "live" / domain
-            dest_dir = CERT_DIR / domain
-            dest_dir.mkdir(exist_ok=True)
-            
-            # Copy certificate files
-            files_to_copy = ['cert.pem', 'chain.pem', 'fullchain.pem', 'privkey.pem']
-            for file_name in files_to_copy:
-                src_file = src_dir / file_name
-                dest_file = dest_dir / file_name
-                if src_file.exists():
-                    with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
-                        dest.write(src.read())
+        # With a pooled key certbot only signs our CSR, writing the certificate
+        # to a staging directory rather than its own live/ directory
+        if key_settings['key_type'] == 'rsa':
+            pool_key_type = f"rsa{key_settings['key_size']}"
+        elif key_settings['key_type'] == 'ecdsa':
+            pool_key_type = f"ecdsa-p{key_settings['key_size']}"
+        else:
+            pool_key_type = get_key_pool_settings()['default_key_type']
+        private_key = claim_pool_key(pool_key_type)
+        staging_dir = None
+        if private_key is not None:
+            if key_settings['preferred_chain']:
+                cmd += ['--preferred-chain', key_settings['preferred_chain']]
+            staging_dir = Path(tempfile.mkdtemp(prefix=f"{domain}.", dir=LETSENCRYPT_DIR / "work"))
+            write_private_key(private_key, staging_dir / "privkey.pem")
+            (staging_dir / "csr.pem").write_bytes(build_csr(private_key, domains))
+            cmd += [
+                '--csr', str(staging_dir / "csr.pem"),
+                '--cert-path', str(staging_dir / "cert.pem"),
+                '--chain-path', str(staging_dir / "chain.pem"),
+                '--fullchain-path', str(staging_dir / "fullchain.pem")
+            ]
+        else:
+            cmd += [*certbot_key_args(key_settings), '--cert-name', domain, *[arg for name in domains for arg in ('-d', name)]]
+        
+        logger.info(f"Creating certificate for {domain} using {dns_provider} DNS provider (job {job['id']})")
+        try:
+            # Placed through an ACME account with rate limit quota, failing over on CA errors
+            returncode, output = run_certbot_order(cmd, job, domain, renewal=(action == 'renew'))
             
-            logger.info(f"Certificate created successfully for {domain}")
-            return True, "Certificate created successfully"
+            if returncode == 0:
+                # Publish the new version (hardlinked from certbot's archive or the staging directory)
+                install_certificate_version(domain, staging_dir or config_dir / "live" / domain)
+        finally:
+            if staging_dir is not None:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+        
+        if returncode == 0:
+            inventory_update_certificate(domain)
+            inventory_record_event(domain, action, True)
+            logger.info(f"Certificate {action} succeeded for {domain}")
+            return True, f"Certificate {'created' if action == 'create' else 'renewed'} successfully"
         else:
-            error_msg = result.stderr or result.stdout
-            logger.error(f"Certificate creation failed: {error_msg}")
-            return False, f"Certificate creation failed: {error_msg}"
+            error_msg = output
+            inventory_record_event(domain, action, False, error_msg)
+            logger.error(f"Certificate {action} failed for {domain}: {error_msg}")
+            return False, f"Certificate {'creation' if action == 'create' else 'renewal'} failed: {error_msg}"
     
     except Exception as e:
         error_msg = str(e)
@@ -769,37 +4129,84 @@ def create_certificate_legacy(domain, email, cloudflare_token):
     dns_config = {'api_token': cloudflare_token}
     return create_certificate(domain, email, 'cloudflare', dns_config)
 
-def renew_certificate(domain):
+def renew_certificate(domain, job=None):
     """Renew a certificate"""
+    if job is None:
+        job = create_job(domain, 'renew')
     try:
-        cmd = ['certbot', 'renew', '--cert-name', domain, '--quiet']
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        config_dir, dir_args = certbot_dir_args()
+        account = lineage_account(domain)
+        returncode, output = None, None
+        live_cert = config_dir / "live" / domain / "cert.pem"
+        
+        def live_serial():
+            metadata = parse_certificate_metadata(live_cert) if live_cert.exists() else None
+            return metadata['serial'] if metadata else None
+        
+        if (config_dir / "renewal" / f"{domain}.conf").exists():
+            # certbot renews through the account and CA that issued the certificate
+            entry_id, _, output = wait_for_order_quota(domain, job, renewal=True, accounts=[account])
+            if entry_id:
+                key_settings = get_domain_key_settings(domain, load_settings_cached())
+                cmd = ['certbot', 'renew', *dir_args, *certbot_key_args(key_settings), '--cert-name', domain,
+                       '--non-interactive', *acme_account_args(account)]
+                previous_serial = live_serial()
+                ordered = True
+                try:
+                    returncode, output = run_certbot(cmd, job, env=acme_account_env(account))
+                    # certbot exits 0 without ordering when the certificate is not due
+                    ordered = returncode != 0 or live_serial() != previous_serial
+                finally:
+                    record_order_result(entry_id, returncode == 0, ordered=ordered)
+                if record_acme_result(account, returncode, output) and len(get_acme_accounts()) > 1:
+                    returncode = None  # fail over below
+        
+        if returncode is None and job['status'] not in JOB_ABORTED_STATUSES:
+            # Issued from a pooled key's CSR, so certbot has no renewal
+            # configuration, or its CA is unavailable: renew by issuing again
+            # (with a fresh key) through whichever account can take the order
+            settings = load_settings()
+            success, message = _create_certificate(domain, settings.get('email'), get_domain_dns_provider(domain, settings),
+                                                   None, job, action='renew')
+            finish_job(job, success, message)
+            if success:
+                deploy_issued_certificate(domain, job)
+            return success
         
-        if result.returncode == 0:
-            # Copy renewed certificates
-            src_dir = Path(f"/etc/letsencrypt/live/{domain}")
-            dest_dir = CERT_DIR / domain
+        if returncode == 0:
+            installed = parse_certificate_metadata(get_certificate_dir(domain) / "cert.pem")
+            if installed and installed['serial'] == live_serial():
+                # certbot found the certificate not due: nothing new to publish
+                inventory_record_event(domain, 'renew', True, "Not due for renewal")
+                update_job(job, certificate_changed=False)
+                finish_job(job, True, "Certificate is not due for renewal yet; nothing was ordered")
+                logger.info(f"Certificate for {domain} is not due for renewal yet")
+                # Deploy targets already have this certificate
+                return True
             
-            files_to_copy = ['cert.pem', 'chain.pem', 'fullchain.pem', 'privkey.pem']
-            for file_name in files_to_copy:
-                src_file = src_dir / file_name
-                dest_file = dest_dir / file_name
-                if src_file.exists():
-                    with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
-                        dest.write(src.read())
+            # Publish the renewed version (hardlinked from certbot's archive)
+            install_certificate_version(domain, config_dir / "live" / domain)
             
+            inventory_update_certificate(domain)
+            inventory_record_event(domain, 'renew', True)
+            finish_job(job, True, "Certificate renewed successfully")
             logger.info(f"Certificate renewed successfully for {domain}")
+            deploy_issued_certificate(domain, job)
             return True
         else:
-            logger.error(f"Certificate renewal failed for {domain}: {result.stderr}")
+            inventory_record_event(domain, 'renew', False, output)
+            finish_job(job, False, f"Certificate renewal failed: {output}")
+            logger.error(f"Certificate renewal failed for {domain}: {output}")
             return False
     except Exception as e:
+        finish_job(job, False, f"Exception: {e}")
         logger.error(f"Exception during certificate renewal for {domain}: {e}")
         return False
 
 def check_renewals():
     """Check and renew certificates that are about to expire"""
     settings = load_settings()
+    queue_expiry_webhooks(settings)
     if not settings.get('auto_renew', True):
         return
     
@@ -808,36 +4215,49 @@ def check_renewals():
     
     logger.info("Checking for certificates that need renewal")
     
-    for domain_entry in settings.get('domains', []):
-        # Handle both old format (string) and new format (object)
-        if isinstance(domain_entry, str):
-            domain = domain_entry
-        elif isinstance(domain_entry, dict):
-            domain = domain_entry.get('domain')
-        else:
-            continue  # Skip invalid entries
-            
-        if domain:
-            cert_info = get_certificate_info(domain)
-            if cert_info and cert_info['needs_renewal']:
-                logger.info(f"Renewing certificate for {domain}")
-                renew_certificate(domain)
-
-# Schedule renewal check every day at 2 AM (only if scheduler is available)
-if scheduler:
-    try:
-        scheduler.add_job(
-            func=check_renewals,
-            trigger="cron",
-            hour=2,
-            minute=0,
-            id='renewal_check'
-        )
-        logger.info("Automatic renewal check scheduled for 2 AM daily")
-    except Exception as e:
-        logger.error(f"Failed to schedule renewal check: {e}")
-else:
-    logger.warning("Background scheduler not available - automatic renewals disabled")
+    def renew_or_defer(domain):
+        # Renewals held back by a rate limit are left for the next check so
+        # that they don't hold up renewals which can go ahead now
+        wait = order_wait_seconds(domain, renewal=True)
+        if wait:
+            logger.info(f"Renewal of {domain} deferred to the next check by rate limits ({wait}s)")
+            return
+        logger.info(f"Renewing certificate for {domain}")
+        renew_certificate(domain)
+    
+    if INVENTORY_ENABLED:
+        # Only certificates inside the renewal window are read from the index,
+        # soonest expiry first
+        renewal_cutoff = time.time() + RENEWAL_THRESHOLD_DAYS * 86400
+        due = [cert_info.domain for cert_info in inventory_list_certificates(expiring_before=renewal_cutoff)]
+    else:
+        due = []
+        for domain_entry in settings.get('domains', []):
+            # Handle both old format (string) and new format (object)
+            if isinstance(domain_entry, str):
+                domain = domain_entry
+            elif isinstance(domain_entry, dict):
+                domain = domain_entry.get('domain')
+            else:
+                continue  # Skip invalid entries
+                
+            if domain:
+                cert_info = get_certificate_info(domain)
+                if cert_info and cert_info.needs_renewal:
+                    due.append(domain)
+    
+    if due and get_preflight_settings()['enabled']:
+        # Checked together up front; renewals that cannot succeed are retried
+        # at the next check, once the DNS has been fixed
+        doomed = {result['domain']: preflight_failure_message(result)
+                  for result in preflight_domains(due) if not result['ok']}
+        for domain, message in doomed.items():
+            logger.warning(f"Renewal of {domain} skipped, preflight failed: {message}")
+            inventory_record_event(domain, 'preflight', False, message)
+        due = [domain for domain in due if domain not in doomed]
+    
+    for domain in due:
+        renew_or_defer(domain)
 
 # Define API models
 # DNS Provider models
@@ -955,7 +4375,11 @@ certificate_model = api.model('Certificate', {
     'days_left': fields.Integer(description='Days until expiry'),
     'days_until_expiry': fields.Integer(description='Days until expiry (alias for days_left)'),
     'needs_renewal': fields.Boolean(description='Whether certificate needs renewal'),
-    'dns_provider': fields.String(description='DNS provider used for the certificate')
+    'dns_provider': fields.String(description='DNS provider used for the certificate'),
+    'key_type': fields.String(description='Key type of the issued certificate (rsa or ecdsa)'),
+    'key_size': fields.Integer(description='Key size in bits (RSA modulus or ECDSA curve size)'),
+    'preferred_chain': fields.String(description='Preferred issuer chain configured for the domain'),
+    'chain_size_bytes': fields.Integer(description='DER size of the certificate chain sent in TLS handshakes')
 })
 
 settings_model = api.model('Settings', {
@@ -970,17 +4394,88 @@ settings_model = api.model('Settings', {
 
 create_cert_model = api.model('CreateCertificate', {
     'domain': fields.String(required=True, description='Domain name to create certificate for'),
+    'key_type': fields.String(description='Key type (stored with the domain)', enum=list(KEY_SIZES)),
+    'key_size': fields.Integer(description='Key size: 2048, 3072 or 4096 for rsa; 256 or 384 for ecdsa'),
+    'preferred_chain': fields.String(description='Issuer name of the preferred chain, e.g. "ISRG Root X1"'),
+    'force': fields.Boolean(description='Issue even if an existing certificate already covers the domain', default=False),
     'dns_provider': fields.String(description='DNS provider to use (optional, uses default from settings)', enum=['cloudflare', 'route53', 'azure', 'google', 'powerdns', 'digitalocean', 'linode', 'gandi', 'ovh', 'namecheap', 'vultr', 'dnsmadeeasy', 'nsone', 'rfc2136', 'hetzner', 'porkbun', 'godaddy', 'he-ddns', 'dynudns'])
 })
 
+preflight_model = api.model('Preflight', {
+    'domains': fields.List(fields.String, required=True, description=f'Domains to check (at most {MAX_DOMAIN_BATCH})'),
+    'dns_provider': fields.String(description="DNS provider to check delegation to (default: each domain's own)", enum=list(SUPPORTED_DNS_PROVIDERS))
+})
+
+import_model = api.model('ImportCertificates', {
+    'source': fields.String(required=True, description='Absolute path on the server of a certbot configuration directory (with live/ and renewal/) or of a tree of directories holding cert.pem and privkey.pem'),
+    'dns_provider': fields.String(description='DNS provider for new domains whose certbot renewal configuration names none (default from settings)', enum=list(SUPPORTED_DNS_PROVIDERS)),
+    'overwrite': fields.Boolean(description='Replace installed certificates even if they expire later', default=False),
+    'dry_run': fields.Boolean(description='Report what would be imported without changing anything', default=False)
+})
+
+certificate_list_parser = api.parser()
+certificate_list_parser.add_argument('limit', type=int, location='args', help=f'Page size (1-{MAX_PAGE_SIZE}); omit to return every certificate')
+certificate_list_parser.add_argument('cursor', type=str, location='args', help='Cursor from the X-Next-Cursor header of the previous page')
+certificate_list_parser.add_argument('sort', type=str, location='args', default='expiry', choices=list(CERTIFICATE_SORT_ORDERS), help='Sort order')
+certificate_list_parser.add_argument('expiring_within_days', type=int, location='args', help='Only certificates expiring within this many days')
+certificate_list_parser.add_argument('dns_provider', type=str, location='args', help='Only domains using this DNS provider')
+certificate_list_parser.add_argument('exists', type=inputs.boolean, location='args', help='Filter on whether a certificate exists')
+certificate_list_parser.add_argument('needs_renewal', type=inputs.boolean, location='args', help='Filter on whether the certificate needs renewal')
+certificate_list_parser.add_argument('format', type=str, location='args', choices=['json', 'ndjson'], help='ndjson streams one certificate per line (same as Accept: application/x-ndjson)')
+
+deployment_batch_model = api.model('DeploymentStatusBatch', {
+    'domains': fields.List(fields.String, required=True, description='Domains to check')
+})
+
+job_model = api.model('Job', {
+    'id': fields.String(description='Job ID'),
+    'domain': fields.String(description='Domain name'),
+    'action': fields.String(description='create or renew'),
+    'status': fields.String(description='queued, deferred, running, retrying, interrupted, succeeded, failed, cancelled or timed_out'),
+    'phase': fields.String(description='Last certbot phase seen in the output'),
+    'not_before': fields.String(description='While deferred by a rate limit, when quota is expected back'),
+    'created_at': fields.String(description='Creation time'),
+    'started_at': fields.String(description='Time certbot was started'),
+    'finished_at': fields.String(description='Completion time'),
+    'returncode': fields.Integer(description='Certbot exit code'),
+    'message': fields.String(description='Result message'),
+    'retries': fields.Integer(description='Attempts interrupted by a worker restart so far'),
+    'next_attempt_at': fields.Float(description='While retrying, Unix time of the next attempt'),
+    'deploy_status': fields.String(description='succeeded, partial or failed, when deploy targets are configured'),
+    'deploy_duration_ms': fields.Integer(description='Time taken by all deployments'),
+    'deployments': fields.List(fields.Raw, description='Per-target deployment results and timings')
+})
+
+certificate_changes_parser = api.parser()
+certificate_changes_parser.add_argument('since', type=int, location='args', default=0, help='Last change sequence number seen')
+certificate_changes_parser.add_argument('limit', type=int, location='args', default=MAX_PAGE_SIZE, help=f'Maximum changes to return (max {MAX_PAGE_SIZE})')
+
+certificate_summary_parser = api.parser()
+certificate_summary_parser.add_argument('soonest', type=int, location='args', default=10, help='Number of soonest-expiring certificates to include')
+
+job_list_parser = api.parser()
+job_list_parser.add_argument('limit', type=int, location='args', default=50, help=f'Maximum jobs to return (max {MAX_PAGE_SIZE})')
+
+rate_limits_parser = api.parser()
+rate_limits_parser.add_argument('domain', type=str, location='args', help='Show every bucket an order for this domain draws from')
+rate_limits_parser.add_argument('renewal', type=inputs.boolean, location='args', default=False, help='Whether the order would be a renewal')
+
 # Define namespaces
 ns_certificates = Namespace('certificates', description='Certificate operations')
 ns_settings = Namespace('settings', description='Settings operations')
 ns_health = Namespace('health', description='Health check')
+ns_jobs = Namespace('jobs', description='Certificate job status, cancellation and logs')
+ns_webhooks = Namespace('webhooks', description='Webhook delivery status')
+ns_tokens = Namespace('tokens', description='Scoped API token issuance and revocation')
+ns_domains = Namespace('domains', description='Add, update and remove configured domains')
 
 api.add_namespace(ns_certificates)
 api.add_namespace(ns_settings)
 api.add_namespace(ns_health)
+api.add_namespace(ns_jobs)
+api.add_namespace(ns_webhooks)
+api.add_namespace(ns_tokens)
+api.add_namespace(ns_domains)
 
 # Health check endpoint
 @ns_health.route('')
@@ -1031,44 +4526,48 @@ class Settings(Resource):
     def post(self):
         """Update settings"""
         data = request.get_json()
-        settings = load_settings()
+        # Held until saved, so concurrent updates are applied in turn
+        with settings_lock():
+            settings = load_settings()
         
-        # Update basic settings
-        if 'cloudflare_token' in data:
-            settings['cloudflare_token'] = data['cloudflare_token']
-            # Also update the new structure for backward compatibility
-            if 'dns_providers' not in settings:
-                settings['dns_providers'] = {}
-            if 'cloudflare' not in settings['dns_providers']:
-                settings['dns_providers']['cloudflare'] = {}
-            settings['dns_providers']['cloudflare']['api_token'] = data['cloudflare_token']
+            # Update basic settings
+            if 'cloudflare_token' in data:
+                settings['cloudflare_token'] = data['cloudflare_token']
+                # Also update the new structure for backward compatibility
+                if 'dns_providers' not in settings:
+                    settings['dns_providers'] = {}
+                if 'cloudflare' not in settings['dns_providers']:
+                    settings['dns_providers']['cloudflare'] = {}
+                settings['dns_providers']['cloudflare']['api_token'] = data['cloudflare_token']
             
-        if 'domains' in data:
-            settings['domains'] = data['domains']
-        if 'email' in data:
-            settings['email'] = data['email']
-        if 'auto_renew' in data:
-            settings['auto_renew'] = data['auto_renew']
-        if 'api_bearer_token' in data:
-            settings['api_bearer_token'] = data['api_bearer_token']
-        if 'dns_provider' in data:
-            settings['dns_provider'] = data['dns_provider']
-        
-        # Update DNS provider configurations
-        if 'dns_providers' in data:
-            if 'dns_providers' not in settings:
-                settings['dns_providers'] = {}
+            if 'domains' in data:
+                settings['domains'] = data['domains']
+            if 'email' in data:
+                settings['email'] = data['email']
+            if 'auto_renew' in data:
+                settings['auto_renew'] = data['auto_renew']
+            if 'api_bearer_token' in data:
+                settings['api_bearer_token'] = data['api_bearer_token']
+            if 'dns_provider' in data:
+                settings['dns_provider'] = data['dns_provider']
+        
+            # Update DNS provider configurations
+            if 'dns_providers' in data:
+                if 'dns_providers' not in settings:
+                    settings['dns_providers'] = {}
             
-            for provider, config in data['dns_providers'].items():
-                if provider not in settings['dns_providers']:
-                    settings['dns_providers'][provider] = {}
+                for provider, config in data['dns_providers'].items():
+                    if provider not in settings['dns_providers']:
+                        settings['dns_providers'][provider] = {}
                 
-                # Only update non-masked values
-                for key, value in config.items():
-                    if value and value != '***masked***':
-                        settings['dns_providers'][provider][key] = value
+                    # Only update non-masked values
+                    for key, value in config.items():
+                        if value and value != '***masked***':
+                            settings['dns_providers'][provider][key] = value
         
-        if save_settings(settings):
+            saved = save_settings(settings)
+        
+        if saved:
             return {'success': True, 'message': 'Settings saved successfully'}
         else:
             return {'success': False, 'message': 'Failed to save settings'}, 500
@@ -1212,20 +4711,149 @@ class DNSProviders(Resource):
 @ns_certificates.route('')
 class CertificateList(Resource):
     @api.doc(security='Bearer')
-    @api.marshal_list_with(certificate_model)
+    @api.expect(certificate_list_parser)
+    @api.response(200, 'Success', [certificate_model])
     @require_auth
     def get(self):
-        """Get all certificates"""
-        settings = load_settings()
-        certificates = []
+        """Get certificates, optionally filtered, sorted and paginated
         
-        for domain_config in settings.get('domains', []):
-            domain_name = domain_config.get('domain') if isinstance(domain_config, dict) else domain_config
-            cert_info = get_certificate_info(domain_name)
-            if cert_info:
-                certificates.append(cert_info)
+        When more results are available the X-Next-Cursor response header
+        holds the cursor for the next page. With format=ndjson (or Accept:
+        application/x-ndjson) the certificates are streamed one per line and
+        no X-Next-Cursor header is sent.
+        """
+        args = certificate_list_parser.parse_args()
+        args.pop('format')
+        try:
+            if wants_ndjson():
+                return ndjson_response(cert_info.to_dict() for cert_info in iter_certificates(**args))
+            certificates, next_cursor = query_certificates(**args)
+        except ValueError as e:
+            api.abort(400, str(e))
+        
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return json_response([cert_info.to_dict() for cert_info in certificates], headers=headers)
+
+@ns_certificates.route('/summary')
+class CertificateSummary(Resource):
+    @api.doc(security='Bearer')
+    @api.expect(certificate_summary_parser)
+    @require_auth
+    def get(self):
+        """Get certificate counts by expiry bucket, DNS provider and status"""
+        args = certificate_summary_parser.parse_args()
+        soonest = args['soonest']
+        if not 0 <= soonest <= MAX_PAGE_SIZE:
+            return {'error': f'soonest must be between 0 and {MAX_PAGE_SIZE}'}, 400
+        return get_certificate_summary(soonest)
+
+@ns_certificates.route('/changes')
+class CertificateChanges(Resource):
+    @api.doc(security='Bearer')
+    @api.expect(certificate_changes_parser)
+    @require_auth
+    @allow_scoped_tokens
+    def get(self):
+        """Get certificates published, replaced or removed since a sequence number"""
+        args = certificate_changes_parser.parse_args()
+        if args['since'] < 0 or not 1 <= args['limit'] <= MAX_PAGE_SIZE:
+            return {'error': f'since must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}'}, 400
+        try:
+            page = get_certificate_changes(args['since'], args['limit'])
+        except ValueError as e:
+            return {'error': str(e)}, 501
+        # Scoped tokens only see their own domains; last_seq still moves past the rest
+        page['changes'] = [change for change in page['changes'] if token_allows_domain(g.api_token, change['domain'])]
+        return page
+
+@ns_certificates.route('/rate-limits')
+class RateLimits(Resource):
+    @api.doc(security='Bearer')
+    @api.expect(rate_limits_parser)
+    @require_auth
+    def get(self):
+        """Get the remaining CA rate limit quota of each ACME account, per registered domain or for one domain"""
+        args = rate_limits_parser.parse_args()
+        if not args['domain']:
+            return rate_limit_overview()
+        
+        is_valid, domain = validate_domain(args['domain'])
+        if not is_valid:
+            return {'error': domain}, 400
+        accounts = {}
+        with rate_limit_ledger(save=False) as entries:
+            for account, cooldown in rank_acme_accounts(get_acme_accounts()):
+                buckets = rate_limit_buckets(entries, order_buckets(domain, args['renewal'], account['name']),
+                                             account['name'])
+                accounts[account['name']] = {
+                    'retry_after_seconds': max(cooldown, *(bucket['retry_after_seconds'] for bucket in buckets.values())),
+                    'cooldown_seconds': cooldown,
+                    'limits': buckets
+                }
+        return {
+            'domain': domain,
+            'registered_domain': registered_domain(domain),
+            'retry_after_seconds': min(account['retry_after_seconds'] for account in accounts.values()),
+            'accounts': accounts
+        }
+
+@ns_certificates.route('/preflight')
+class CertificatePreflight(Resource):
+    @api.doc(security='Bearer')
+    @api.expect(preflight_model)
+    @require_auth
+    def post(self):
+        """Check CAA records, DNS delegation and the domain name of orders before placing them
+        
+        Domains are checked concurrently. A domain's own DNS provider is used
+        unless dns_provider is given.
+        """
+        data = request.get_json(silent=True) or {}
+        domains = data.get('domains')
+        if not isinstance(domains, list) or not domains or not all(isinstance(domain, str) for domain in domains):
+            return {'error': 'domains must be a non-empty list of domain names'}, 400
+        if len(domains) > MAX_DOMAIN_BATCH:
+            return {'error': f'At most {MAX_DOMAIN_BATCH} domains can be checked per request'}, 400
+        dns_provider = data.get('dns_provider')
+        if dns_provider is not None and dns_provider not in SUPPORTED_DNS_PROVIDERS:
+            return {'error': f'Unsupported DNS provider: {dns_provider}'}, 400
+        
+        results = preflight_domains(domains, dns_provider)
+        return json_response({'ok': all(result['ok'] for result in results), 'results': results})
+
+@ns_certificates.route('/import')
+class ImportCertificates(Resource):
+    @api.doc(security='Bearer')
+    @api.expect(import_model)
+    @api.response(202, 'Import started')
+    @require_auth
+    def post(self):
+        """Import existing certificates from a certbot configuration directory or a tree of PEM files
         
-        return certificates
+        Nothing is re-issued. The import runs in the background; poll
+        /api/certificates/import/<import_id> for its result.
+        """
+        data = request.get_json(silent=True) or {}
+        source = data.get('source')
+        if not isinstance(source, str) or not os.path.isabs(source) or not os.path.isdir(source):
+            return {'error': 'source must be the absolute path of a directory on the server'}, 400
+        dns_provider = data.get('dns_provider')
+        if dns_provider is not None and dns_provider not in SUPPORTED_DNS_PROVIDERS:
+            return {'error': f'Unsupported DNS provider: {dns_provider}'}, 400
+        
+        status = start_import(source, dns_provider, bool(data.get('overwrite', False)), bool(data.get('dry_run', False)))
+        return status, 202
+
+@ns_certificates.route('/import/<string:import_id>')
+class ImportStatus(Resource):
+    @api.doc(security='Bearer')
+    @require_auth
+    def get(self, import_id):
+        """Get the status and result of a certificate import"""
+        status = load_import_status(import_id)
+        if status is None:
+            return {'error': 'Import not found'}, 404
+        return status
 
 @ns_certificates.route('/create')
 class CreateCertificate(Resource):
@@ -1241,6 +4869,16 @@ class CreateCertificate(Resource):
         if not domain:
             return {'success': False, 'message': 'Domain is required'}, 400
         
+        is_valid, key_settings = validate_key_settings(data)
+        if not is_valid:
+            return {'success': False, 'message': key_settings}, 400
+        
+        # Don't spend CA rate limit on a name an existing certificate already covers
+        if not data.get('force'):
+            covering = find_covering_certificate(domain)
+            if covering:
+                return covered_certificate_response(domain, covering)
+        
         settings = load_settings()
         email = settings.get('email')
         
@@ -1313,15 +4951,23 @@ class CreateCertificate(Resource):
         if not provider_configured:
             return {'success': False, 'message': f'{dns_provider.title()} DNS provider not configured in settings'}, 400
         
-        # Create certificate in background
-        def create_cert_async():
-            success, message = create_certificate(domain, email, dns_provider, dns_config)
-            logger.info(f"Certificate creation for {domain} using {dns_provider}: {'Success' if success else 'Failed'} - {message}")
+        # Reject orders that cannot succeed before they use CA rate limit
+        if get_preflight_settings()['enabled']:
+            preflight = preflight_domain(domain, dns_provider)
+            if not preflight['ok']:
+                return {'success': False, 'message': f'Preflight failed: {preflight_failure_message(preflight)}',
+                        'preflight': preflight}, 422
         
-        thread = threading.Thread(target=create_cert_async)
-        thread.start()
+        # Key settings are kept with the domain so that renewals use them too
+        if any(value is not None for value in key_settings.values()):
+            if not save_domain_key_settings(domain, dns_provider, key_settings):
+                return {'success': False, 'message': 'Failed to save key settings'}, 500
+        
+        # Create certificate in background
+        job = create_job(domain, 'create', dns_provider)
+        start_job(job)
         
-        return {'success': True, 'message': f'Certificate creation started for {domain} using {dns_provider} DNS provider'}
+        return {'success': True, 'message': f'Certificate creation started for {domain} using {dns_provider} DNS provider', 'job_id': job['id']}
 
 @ns_certificates.route('/<string:domain>/download')
 class DownloadCertificate(Resource):
@@ -1329,19 +4975,12 @@ class DownloadCertificate(Resource):
     @require_auth
     def get(self, domain):
         """Download certificate as ZIP file"""
-        cert_dir = CERT_DIR / domain
-        if not cert_dir.exists():
+        bundle = get_certificate_bundle(domain)
+        if bundle is None:
             return {'error': 'Certificate not found'}, 404
         
-        # Create temporary ZIP file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp_file:
-            with zipfile.ZipFile(tmp_file.name, 'w') as zip_file:
-                for file_name in ['cert.pem', 'chain.pem', 'fullchain.pem', 'privkey.pem']:
-                    file_path = cert_dir / file_name
-                    if file_path.exists():
-                        zip_file.write(file_path, file_name)
-            
-            return send_file(tmp_file.name, as_attachment=True, download_name=f'{domain}-certificates.zip')
+        return send_file(io.BytesIO(bundle), mimetype='application/zip', as_attachment=True,
+                         download_name=f'{domain}-certificates.zip', etag=bundle_etag(bundle))
 
 @ns_certificates.route('/<string:domain>/renew')
 class RenewCertificate(Resource):
@@ -1365,33 +5004,294 @@ class RenewCertificate(Resource):
             return {'success': False, 'message': 'Domain not found in settings'}, 404
         
         # Renew certificate in background
-        def renew_cert_async():
-            success = renew_certificate(domain)
-            logger.info(f"Certificate renewal for {domain}: {'Success' if success else 'Failed'}")
+        job = create_job(domain, 'renew')
+        start_job(job)
+        
+        return {'success': True, 'message': f'Certificate renewal started for {domain}', 'job_id': job['id']}
+
+@ns_jobs.route('')
+class JobList(Resource):
+    @api.doc(security='Bearer')
+    @api.expect(job_list_parser)
+    @api.response(200, 'Success', [job_model])
+    @require_auth
+    def get(self):
+        """List the most recently updated certificate jobs, newest first"""
+        args = job_list_parser.parse_args()
+        if not 1 <= args['limit'] <= MAX_PAGE_SIZE:
+            return {'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}, 400
+        # Only the newest files are parsed; their mtime is the last update
+        job_files = []
+        for entry in os.scandir(JOBS_DIR):
+            if entry.name.endswith('.json'):
+                try:
+                    job_files.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass  # pruned meanwhile
+        jobs = [safe_file_read(path, is_json=True) for _, path in heapq.nlargest(args['limit'], job_files)]
+        return marshal([job for job in jobs if job], job_model)
+
+@ns_jobs.route('/<string:job_id>')
+class Job(Resource):
+    @api.doc(security='Bearer')
+    @require_auth
+    def get(self, job_id):
+        """Get job status and the tail of its output"""
+        job = load_job(job_id)
+        if job is None:
+            return {'error': 'Job not found', 'code': 'JOB_NOT_FOUND'}, 404
+        job['log_tail'] = [line for _, line in read_job_log(job_id)[-JOB_RESULT_LINES:]]
+        return job
+
+@ns_jobs.route('/<string:job_id>/cancel')
+class CancelJob(Resource):
+    @api.doc(security='Bearer')
+    @require_auth
+    def post(self, job_id):
+        """Cancel a queued or running job, killing its certbot process group"""
+        job = cancel_job(job_id)
+        if job is None:
+            return {'error': 'Job not found', 'code': 'JOB_NOT_FOUND'}, 404
+        if job['status'] in JOB_FINISHED_STATUSES:
+            return {'error': f"Job already {job['status']}", 'code': 'JOB_FINISHED'}, 409
+        return {'success': True, 'message': f'Cancellation requested for job {job_id}'}, 202
+
+@ns_jobs.route('/<string:job_id>/logs')
+class JobLogs(Resource):
+    @api.doc(security='Bearer')
+    @require_auth
+    def get(self, job_id):
+        """Stream job output as server-sent events (resumable via Last-Event-ID or after_seq)
+        
+        Streams end after about a minute; reconnect with the id of the last
+        event received until an end event arrives.
+        """
+        if load_job(job_id) is None:
+            return {'error': 'Job not found', 'code': 'JOB_NOT_FOUND'}, 404
+        try:
+            after_seq = int(request.headers.get('Last-Event-ID') or request.args.get('after_seq', 0))
+        except ValueError:
+            after_seq = 0
+        return Response(stream_job_log(job_id, after_seq), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+token_request_model = api.model('TokenRequest', {
+    'name': fields.String(required=True, description='Who or what the token is for, e.g. a host name'),
+    'domains': fields.List(fields.String, description='Domains the token may read ("*.example.com" for subdomains); required unless admin'),
+    'admin': fields.Boolean(description='Full access, like the api_bearer_token setting', default=False),
+    'rate_limit': fields.Raw(description='{"rate": requests per second, "burst": requests}, or null for no limit'),
+    'expires_in_days': fields.Integer(description='Days until the token expires (default never)')
+})
+
+@ns_tokens.route('')
+class ApiTokens(Resource):
+    @api.doc(security='Bearer')
+    @require_auth
+    def get(self):
+        """List issued API tokens (without the tokens themselves)"""
+        return [public_token_record(record) for record in load_api_tokens()]
+    
+    @api.doc(security='Bearer')
+    @api.expect(token_request_model)
+    @require_auth
+    def post(self):
+        """Issue an API token; the token is only returned in this response"""
+        is_valid, fields_or_error = validate_token_request(request.get_json(silent=True))
+        if not is_valid:
+            return {'error': fields_or_error}, 400
+        token, record = issue_api_token(fields_or_error)
+        logger.info(f"Issued API token {record['id']} ({record['name']})")
+        return {'token': token, **public_token_record(record)}, 201
+
+@ns_tokens.route('/<string:token_id>')
+class ApiToken(Resource):
+    @api.doc(security='Bearer')
+    @require_auth
+    def delete(self, token_id):
+        """Revoke an API token"""
+        record = revoke_api_token(token_id)
+        if record is None:
+            return {'error': 'Token not found'}, 404
+        logger.info(f"Revoked API token {record['id']} ({record['name']})")
+        return public_token_record(record)
+
+@ns_webhooks.route('/metrics')
+class WebhookMetrics(Resource):
+    @api.doc(security='Bearer')
+    @require_auth
+    def get(self):
+        """Get webhook backlog, delivery counters and delivery latency"""
+        return webhook_metrics()
+
+domain_entry_model = api.model('DomainEntry', {
+    'dns_provider': fields.String(description='DNS provider for the domain (default: the dns_provider setting)'),
+    'key_type': fields.String(description='rsa or ecdsa'),
+    'key_size': fields.Integer(description='Key size in bits'),
+    'preferred_chain': fields.String(description='Preferred issuer chain')
+})
+
+domain_batch_model = api.model('DomainBatch', {
+    'add': fields.List(fields.Raw, description='Domain names or entries ({"domain": ..., "dns_provider": ...}) to add'),
+    'remove': fields.List(fields.String, description='Domains to remove')
+})
+
+@ns_domains.route('')
+class DomainBatch(Resource):
+    @api.doc(security='Bearer')
+    @api.expect(domain_batch_model)
+    @require_auth
+    def post(self):
+        """Add and remove several domains in one update
+        
+        Nothing is applied if any entry is invalid. Domains already configured
+        (add) or not configured (remove) are reported as skipped.
+        """
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return {'error': 'Expected a JSON object with add and/or remove lists'}, 400
+        add, remove = data.get('add') or [], data.get('remove') or []
+        if not isinstance(add, list) or not isinstance(remove, list):
+            return {'error': 'add and remove must be lists'}, 400
+        if len(add) + len(remove) > MAX_DOMAIN_BATCH:
+            return {'error': f'At most {MAX_DOMAIN_BATCH} domains can be changed per request'}, 400
         
-        thread = threading.Thread(target=renew_cert_async)
-        thread.start()
+        entries = []
+        errors = []
+        for index, entry in enumerate(add):
+            is_valid, entry_or_error = validate_domain_entry(entry)
+            if is_valid:
+                entries.append(entry_or_error)
+            else:
+                errors.append({'field': 'add', 'index': index, 'error': entry_or_error})
+        domains = []
+        for index, domain in enumerate(remove):
+            is_valid, domain_or_error = validate_domain(domain)
+            if is_valid:
+                domains.append(domain_or_error)
+            else:
+                errors.append({'field': 'remove', 'index': index, 'error': domain_or_error})
+        if errors:
+            return {'error': 'Invalid domains, nothing was changed', 'errors': errors}, 400
         
-        return {'success': True, 'message': f'Certificate renewal started for {domain}'}
+        try:
+            result = change_domains(add=entries, remove=domains)
+        except OSError as e:
+            logger.error(f"Error changing domains: {e}")
+            return {'error': 'Failed to save settings'}, 500
+        logger.info(f"Domains changed: {len(result['added'])} added, {len(result['removed'])} removed")
+        return {
+            'added': [entry['domain'] for entry in result['added']],
+            'removed': [entry['domain'] for entry in result['removed']],
+            'skipped': result['skipped']
+        }
+
+@ns_domains.route('/<string:domain>')
+class Domain(Resource):
+    @api.doc(security='Bearer')
+    @require_auth
+    def get(self, domain):
+        """Get a configured domain's entry"""
+        is_valid, domain_or_error = validate_domain(domain)
+        if not is_valid:
+            return {'error': domain_or_error}, 400
+        domain = domain_or_error
+        entry = find_domain_entry(load_settings_cached(), domain)
+        if entry is None:
+            return {'error': 'Domain not configured'}, 404
+        return entry
+    
+    @api.doc(security='Bearer')
+    @api.expect(domain_entry_model)
+    @require_auth
+    def post(self, domain):
+        """Add a domain"""
+        is_valid, entry_or_error = validate_domain_entry({**(request.get_json(silent=True) or {}), 'domain': domain})
+        if not is_valid:
+            return {'error': entry_or_error}, 400
+        try:
+            result = change_domains(add=[entry_or_error])
+        except OSError as e:
+            logger.error(f"Error adding domain {domain}: {e}")
+            return {'error': 'Failed to save settings'}, 500
+        if not result['added']:
+            return {'error': 'Domain already configured'}, 409
+        logger.info(f"Domain {domain} added")
+        return result['added'][0], 201
+    
+    @api.doc(security='Bearer')
+    @api.expect(domain_entry_model)
+    @require_auth
+    def patch(self, domain):
+        """Update a domain's DNS provider or key settings (null clears a field)"""
+        is_valid, domain_or_error = validate_domain(domain)
+        if not is_valid:
+            return {'error': domain_or_error}, 400
+        domain = domain_or_error
+        is_valid, fields_or_error = validate_domain_fields(request.get_json(silent=True))
+        if not is_valid:
+            return {'error': fields_or_error}, 400
+        try:
+            result = change_domains(patch={domain: fields_or_error})
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        except OSError as e:
+            logger.error(f"Error updating domain {domain}: {e}")
+            return {'error': 'Failed to save settings'}, 500
+        if not result['updated']:
+            return {'error': 'Domain not configured'}, 404
+        logger.info(f"Domain {domain} updated")
+        return result['updated'][0]
+    
+    @api.doc(security='Bearer')
+    @require_auth
+    def delete(self, domain):
+        """Remove a domain (its certificate files are kept)"""
+        is_valid, domain_or_error = validate_domain(domain)
+        if not is_valid:
+            return {'error': domain_or_error}, 400
+        domain = domain_or_error
+        try:
+            result = change_domains(remove=[domain])
+        except OSError as e:
+            logger.error(f"Error removing domain {domain}: {e}")
+            return {'error': 'Failed to save settings'}, 500
+        if not result['removed']:
+            return {'error': 'Domain not configured'}, 404
+        logger.info(f"Domain {domain} removed")
+        return result['removed'][0]
 
 # Special download endpoint for easy automation
-@app.route('/<string:domain>/tls')
+@web.route('/<string:domain>/tls')
 @require_auth
 def download_tls(domain):
-    """Download certificate via simple URL with bearer token auth"""
-    cert_dir = CERT_DIR / domain
-    if not cert_dir.exists():
+    """Download certificate via simple URL with bearer token auth (supports If-None-Match)"""
+    bundle = get_certificate_bundle(domain)
+    if bundle is None:
         return jsonify({'error': 'Certificate not found'}), 404
     
-    # Create temporary ZIP file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp_file:
-        with zipfile.ZipFile(tmp_file.name, 'w') as zip_file:
-            for file_name in ['cert.pem', 'chain.pem', 'fullchain.pem', 'privkey.pem']:
-                file_path = cert_dir / file_name
-                if file_path.exists():
-                    zip_file.write(file_path, file_name)
-        
-        return send_file(tmp_file.name, as_attachment=True, download_name=f'{domain}-tls.zip')
+    return send_file(io.BytesIO(bundle), mimetype='application/zip', as_attachment=True,
+                     download_name=f'{domain}-tls.zip', etag=bundle_etag(bundle))
+
+@web.route('/<string:domain>/tls/ocsp')
+@require_auth
+def download_ocsp_response(domain):
+    """Serve the cached OCSP response for stapling (DER, supports If-None-Match)"""
+    der, response = load_ocsp_response(domain)
+    if der is None:
+        return jsonify({'error': 'OCSP response not available'}), 404
+    cert_file = get_certificate_dir(domain) / "cert.pem"
+    metadata = parse_certificate_metadata(cert_file) if cert_file.exists() else None
+    if metadata is None or format(response.serial_number, 'x') != metadata['serial']:
+        return jsonify({'error': 'OCSP response not yet fetched for the current certificate'}), 404
+    
+    ocsp_response = Response(der, mimetype='application/ocsp-response')
+    ocsp_response.set_etag(hashlib.sha256(der).hexdigest())
+    this_update, next_update = ocsp_validity(response)
+    ocsp_response.last_modified = this_update
+    if next_update:
+        max_age = (next_update - datetime.now(timezone.utc)).total_seconds()
+        ocsp_response.cache_control.max_age = max(int(max_age), 0)
+    return ocsp_response.make_conditional(request)
 
 # Configure API security
 api.authorizations = {
@@ -1404,23 +5304,25 @@ api.authorizations = {
 }
 
 # Web interface routes
-@app.route('/')
+@web.route('/')
 def index():
-    """Main dashboard"""
-    settings = load_settings()
-    certificates = []
+    """Main dashboard
     
-    for domain_config in settings.get('domains', []):
-        domain_name = domain_config.get('domain') if isinstance(domain_config, dict) else domain_config
-        cert_info = get_certificate_info(domain_name)
-        if cert_info:
-            certificates.append(cert_info)
+    Only the first page of certificates and the summary counts are rendered;
+    both come from the inventory index, so the page cost does not grow with
+    the number of certificates. Further rows are fetched by the page itself.
+    """
+    settings = load_settings_cached()
+    certificates, next_cursor = query_certificates(limit=DASHBOARD_PAGE_SIZE)
+    summary = get_certificate_summary(soonest=0)
     
     # Get API token for frontend use
     api_token = settings.get('api_bearer_token', 'token-not-configured')
-    return render_template('index.html', certificates=certificates, api_token=api_token)
+    return render_template('index.html', certificates=[cert_info.to_dict() for cert_info in certificates],
+                           next_cursor=next_cursor, summary=summary, page_size=DASHBOARD_PAGE_SIZE,
+                           api_token=api_token)
 
-@app.route('/settings')
+@web.route('/settings')
 def settings_page():
     """Settings page"""
     settings = load_settings()
@@ -1428,13 +5330,13 @@ def settings_page():
     api_token = settings.get('api_bearer_token', 'token-not-configured')
     return render_template('settings.html', settings=settings, api_token=api_token)
 
-@app.route('/help')
+@web.route('/help')
 def help_page():
     """Help and documentation page"""
     return render_template('help.html')
 
 # Health check for Docker
-@app.route('/health')
+@web.route('/health')
 def health_check():
     """Enhanced health check endpoint for Docker and monitoring"""
     try:
@@ -1454,11 +5356,17 @@ def health_check():
         }
         
         # Check scheduler
+        # Only one worker process runs the scheduler
         checks['scheduler'] = {
             'available': scheduler is not None,
-            'running': scheduler.running if scheduler else False
+            'running': scheduler.running if scheduler else False,
+            'scheduler_process': _scheduler_lock_handle is not None
         }
         
+        # Calls merged into an identical in-flight call, counted by this worker:
+        # coalesced within it, shared with another worker
+        checks['singleflight'] = singleflight_stats()
+        
         # Determine overall status
         if not all([
             checks['directories']['cert_dir_writable'],
@@ -1482,7 +5390,7 @@ def health_check():
         }), 500
 
 # Web-specific settings endpoints (no auth required for initial setup)
-@app.route('/api/web/settings', methods=['GET', 'POST'])
+@web.route('/api/web/settings', methods=['GET', 'POST'])
 def web_settings():
     """Web interface settings endpoint (no auth required for initial setup)"""
     if request.method == 'GET':
@@ -1499,52 +5407,45 @@ def web_settings():
     
     elif request.method == 'POST':
         data = request.get_json()
-        settings = load_settings()
+        with settings_lock():
+            settings = load_settings()
+        
+            # Update settings
+            if 'cloudflare_token' in data and data['cloudflare_token']:
+                settings['cloudflare_token'] = data['cloudflare_token']
+            if 'domains' in data:
+                settings['domains'] = data['domains']
+            if 'email' in data:
+                settings['email'] = data['email']
+            if 'auto_renew' in data:
+                settings['auto_renew'] = data['auto_renew']
+            if 'api_bearer_token' in data and data['api_bearer_token']:
+                settings['api_bearer_token'] = data['api_bearer_token']
         
-        # Update settings
-        if 'cloudflare_token' in data and data['cloudflare_token']:
-            settings['cloudflare_token'] = data['cloudflare_token']
-        if 'domains' in data:
-            settings['domains'] = data['domains']
-        if 'email' in data:
-            settings['email'] = data['email']
-        if 'auto_renew' in data:
-            settings['auto_renew'] = data['auto_renew']
-        if 'api_bearer_token' in data and data['api_bearer_token']:
-            settings['api_bearer_token'] = data['api_bearer_token']
-        
-        if save_settings(settings):
+            saved = save_settings(settings)
+        
+        if saved:
             return jsonify({'success': True, 'message': 'Settings saved successfully'})
         else:
             return jsonify({'success': False, 'message': 'Failed to save settings'}), 500
 
 # Web-specific certificates endpoint (no auth required for initial setup)
-@app.route('/api/web/certificates')
+@web.route('/api/web/certificates')
 def web_certificates():
     """Web interface certificates endpoint (no auth required)"""
-    settings = load_settings()
-    
-    # Migrate settings format if needed
-    settings = migrate_domains_format(settings)
-    
-    certificates = []
-    
-    for domain_entry in settings.get('domains', []):
-        # Handle both old format (string) and new format (object)
-        if isinstance(domain_entry, str):
-            domain = domain_entry
-        elif isinstance(domain_entry, dict):
-            domain = domain_entry.get('domain')
-        else:
-            continue  # Skip invalid entries
-            
-        if domain:
-            cert_info = get_certificate_info(domain)
-            certificates.append(cert_info)
+    args = certificate_list_parser.parse_args()
+    args.pop('format')
+    try:
+        if wants_ndjson():
+            return ndjson_response(cert_info.to_dict() for cert_info in iter_certificates(**args))
+        certificates, next_cursor = query_certificates(**args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify(certificates)
+    return json_response([cert_info.to_dict() for cert_info in certificates],
+                         headers={'X-Next-Cursor': next_cursor} if next_cursor else None)
 
-@app.route('/api/web/certificates/create', methods=['POST'])
+@web.route('/api/web/certificates/create', methods=['POST'])
 def web_create_certificate():
     """Web interface create certificate endpoint (no auth required)"""
     data = request.get_json()
@@ -1554,6 +5455,15 @@ def web_create_certificate():
     if not domain:
         return jsonify({'success': False, 'message': 'Domain is required'}), 400
     
+    is_valid, key_settings = validate_key_settings(data)
+    if not is_valid:
+        return jsonify({'success': False, 'message': key_settings}), 400
+    
+    if not data.get('force'):
+        covering = find_covering_certificate(domain)
+        if covering:
+            return jsonify(covered_certificate_response(domain, covering))
+    
     settings = load_settings()
     
     # Migrate settings format if needed
@@ -1605,30 +5515,17 @@ def web_create_certificate():
         if not all(dns_config.get(field) for field in ['username', 'api_key']):
             return jsonify({'success': False, 'message': 'Namecheap credentials not fully configured in settings'}), 400
     
-    # Add domain to settings if not already there (using new format)
-    domains = settings.get('domains', [])
-    domain_exists = False
-    
-    for domain_entry in domains:
-        if isinstance(domain_entry, str):
-            if domain_entry == domain:
-                domain_exists = True
-                break
-        elif isinstance(domain_entry, dict):
-            if domain_entry.get('domain') == domain:
-                domain_exists = True
-                # Update DNS provider if it changed
-                if domain_entry.get('dns_provider') != dns_provider:
-                    domain_entry['dns_provider'] = dns_provider
-                break
+    if get_preflight_settings()['enabled']:
+        preflight = preflight_domain(domain, dns_provider)
+        if not preflight['ok']:
+            return jsonify({'success': False, 'message': f'Preflight failed: {preflight_failure_message(preflight)}',
+                            'preflight': preflight}), 422
     
-    if not domain_exists:
-        domains.append({
-            'domain': domain,
-            'dns_provider': dns_provider
-        })
-        settings['domains'] = domains
-        save_settings(settings)
+    # Add domain to settings if not already there (using new format)
+    if any(value is not None for value in key_settings.values()):
+        save_domain_key_settings(domain, dns_provider, key_settings)
+    elif find_domain_entry(settings, domain) is None:
+        change_domains(add=[{'domain': domain, 'dns_provider': dns_provider}])
     
     # Create certificate using new multi-provider function
     success, message = create_certificate(domain, email, dns_provider, dns_config)
@@ -1639,7 +5536,7 @@ def web_create_certificate():
     else:
         return jsonify({'success': False, 'message': message}), 500
 
-@app.route('/api/web/certificates/<domain>/renew', methods=['POST'])
+@web.route('/api/web/certificates/<domain>/renew', methods=['POST'])
 def web_renew_certificate(domain):
     """Web interface renew certificate endpoint (no auth required)"""
     settings = load_settings()
@@ -1663,31 +5560,20 @@ def web_renew_certificate(domain):
         return jsonify({'success': False, 'message': 'Domain not found in settings'}), 404
     
     # Renew certificate in background
-    def renew_cert_async():
-        success = renew_certificate(domain)
-        logger.info(f"Certificate renewal for {domain}: {'Success' if success else 'Failed'}")
-    
-    thread = threading.Thread(target=renew_cert_async)
-    thread.start()
+    job = create_job(domain, 'renew')
+    start_job(job)
     
-    return jsonify({'success': True, 'message': f'Certificate renewal started for {domain}'})
+    return jsonify({'success': True, 'message': f'Certificate renewal started for {domain}', 'job_id': job['id']})
 
-@app.route('/api/web/certificates/<domain>/download')
+@web.route('/api/web/certificates/<domain>/download')
 def web_download_certificate(domain):
     """Web interface download certificate endpoint (no auth required)"""
-    cert_dir = CERT_DIR / domain
-    if not cert_dir.exists():
+    bundle = get_certificate_bundle(domain)
+    if bundle is None:
         return jsonify({'error': 'Certificate not found'}), 404
     
-    # Create temporary ZIP file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp_file:
-        with zipfile.ZipFile(tmp_file.name, 'w') as zip_file:
-            for file_name in ['cert.pem', 'chain.pem', 'fullchain.pem', 'privkey.pem']:
-                file_path = cert_dir / file_name
-                if file_path.exists():
-                    zip_file.write(file_path, file_name)
-        
-        return send_file(tmp_file.name, as_attachment=True, download_name=f'{domain}-certificates.zip')
+    return send_file(io.BytesIO(bundle), mimetype='application/zip', as_attachment=True,
+                     download_name=f'{domain}-certificates.zip')
 
 def check_ssl_certificate(domain, port=443, timeout=10):
     """Check SSL certificate for a domain"""
@@ -1777,55 +5663,100 @@ def check_ssl_certificate(domain, port=443, timeout=10):
             'timestamp': datetime.now().isoformat()
         }
 
+def get_deployment_status(domain):
+    """Check whether a domain serves a certificate and compare it with our local copy
+    
+    Concurrent checks of the same domain, from any worker, share one TLS probe.
+    """
+    return shared_singleflight('tls_probe', domain, lambda: _get_deployment_status(domain))
+
+def _get_deployment_status(domain):
+    """Probe a domain for get_deployment_status"""
+    logger.info(f"Checking deployment status for domain: {domain}")
+    
+    # Check SSL certificate deployment
+    deployment_status = check_ssl_certificate(domain)
+    
+    # If we have a certificate for this domain, compare with deployed cert
+    cert_file = get_certificate_dir(domain) / "cert.pem"
+    deployment_status['has_local_cert'] = False
+    if cert_file.exists():
+        try:
+            # Load our certificate
+            with open(cert_file, 'rb') as f:
+                our_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
+            deployment_status['has_local_cert'] = True
+            deployment_status['local_cert_expires'] = our_cert.not_valid_after_utc.isoformat()
+        except Exception as e:
+            logger.error(f"Error reading local certificate for {domain}: {e}")
+    
+    return deployment_status
+
+def deployment_check_failed(error):
+    """Deployment status returned when the check itself could not run"""
+    return {
+        'deployed': False,
+        'reachable': False,
+        'certificate_match': False,
+        'error': f'check_failed: {str(error)}',
+        'method': 'ssl-direct',
+        'timestamp': datetime.now().isoformat()
+    }
+
 @ns_certificates.route('/<string:domain>/deployment-status')
 class CertificateDeploymentStatus(Resource):
     def get(self, domain):
         """Check deployment status of a certificate for a domain"""
         try:
-            logger.info(f"Checking deployment status for domain: {domain}")
-            
-            # Check SSL certificate deployment
-            deployment_status = check_ssl_certificate(domain)
-            
-            # If we have a certificate for this domain, compare with deployed cert
-            cert_dir = CERT_DIR / domain
-            if cert_dir.exists():
-                cert_file = cert_dir / "cert.pem"
-                if cert_file.exists():
-                    try:
-                        # Load our certificate
-                        with open(cert_file, 'rb') as f:
-                            our_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
-                        
-                        # If the domain has SSL but doesn't match, check if it's our certificate
-                        if deployment_status['reachable'] and not deployment_status['certificate_match']:
-                            # Additional verification - check certificate fingerprints or other identifiers
-                            deployment_status['has_local_cert'] = True
-                            deployment_status['local_cert_expires'] = our_cert.not_valid_after_utc.isoformat()
-                        else:
-                            deployment_status['has_local_cert'] = True
-                            deployment_status['local_cert_expires'] = our_cert.not_valid_after_utc.isoformat()
-                            
-                    except Exception as e:
-                        logger.error(f"Error reading local certificate for {domain}: {e}")
-                        deployment_status['has_local_cert'] = False
-                else:
-                    deployment_status['has_local_cert'] = False
-            else:
-                deployment_status['has_local_cert'] = False
-            
-            return deployment_status
-            
+            return get_deployment_status(domain)
         except Exception as e:
             logger.error(f"Error checking deployment status for {domain}: {e}")
-            return {
-                'deployed': False,
-                'reachable': False,
-                'certificate_match': False,
-                'error': f'check_failed: {str(e)}',
-                'method': 'ssl-direct',
-                'timestamp': datetime.now().isoformat()
-            }, 500
+            return deployment_check_failed(e), 500
+
+@ns_certificates.route('/deployment-status')
+class BatchDeploymentStatus(Resource):
+    @api.doc(security='Bearer')
+    @api.expect(deployment_batch_model)
+    @require_auth
+    def post(self):
+        """Check deployment status for several domains concurrently
+        
+        With format=ndjson (or Accept: application/x-ndjson) each domain's
+        status is streamed as a line as soon as its check completes.
+        """
+        data = request.get_json() or {}
+        domains = data.get('domains')
+        if not isinstance(domains, list) or not domains:
+            return {'error': 'domains must be a non-empty list'}, 400
+        if len(domains) > MAX_DEPLOYMENT_BATCH:
+            return {'error': f'At most {MAX_DEPLOYMENT_BATCH} domains can be checked per request'}, 400
+        
+        validated = []
+        for domain in domains:
+            is_valid, domain_or_error = validate_domain(domain)
+            if not is_valid:
+                return {'error': f'Invalid domain {domain!r}: {domain_or_error}'}, 400
+            validated.append(domain_or_error)
+        
+        def check(domain):
+            try:
+                return get_deployment_status(domain)
+            except Exception as e:
+                logger.error(f"Error checking deployment status for {domain}: {e}")
+                return deployment_check_failed(e)
+        
+        if wants_ndjson():
+            return ndjson_response(stream_deployment_checks(validated, check))
+        with ThreadPoolExecutor(max_workers=min(len(validated), DEPLOYMENT_CHECK_WORKERS)) as executor:
+            results = dict(zip(validated, executor.map(check, validated)))
+        return json_response({'results': results})
+
+def stream_deployment_checks(domains, check):
+    """Yield {'domain': ..., **status} for each domain as soon as its check completes"""
+    with ThreadPoolExecutor(max_workers=min(len(domains), DEPLOYMENT_CHECK_WORKERS)) as executor:
+        futures = {executor.submit(check, domain): domain for domain in domains}
+        for future in as_completed(futures):
+            yield {'domain': futures[future], **future.result()}
 
 def get_domain_dns_provider(domain, settings):
     """Get the DNS provider used for a specific domain"""
@@ -1845,8 +5776,35 @@ def get_domain_dns_provider(domain, settings):
     # If domain not found, return default provider
     return settings.get('dns_provider', 'cloudflare')
 
-def migrate_domains_format(settings):
-    """Migrate domains from old format (list of strings) to new format (list of objects)"""
+def get_domain_key_settings(domain, settings):
+    """Get the key_type, key_size and preferred_chain configured for a domain
+    
+    Unset values are None; key_size defaults to the smallest size of the key type.
+    """
+    for domain_entry in settings.get('domains', []):
+        if isinstance(domain_entry, dict) and domain_entry.get('domain') == domain:
+            is_valid, key_settings = validate_key_settings(domain_entry)
+            if is_valid:
+                if key_settings['key_type'] and key_settings['key_size'] is None:
+                    key_settings['key_size'] = KEY_SIZES[key_settings['key_type']][0]
+                return key_settings
+            break
+    return {'key_type': None, 'key_size': None, 'preferred_chain': None}
+
+def save_domain_key_settings(domain, dns_provider, key_settings):
+    """Store the DNS provider and key settings in a domain's entry, adding the entry if needed"""
+    try:
+        change_domains(patch={domain: {'dns_provider': dns_provider, **key_settings}}, create_missing=True)
+        return True
+    except (ValueError, OSError) as e:
+        logger.error(f"Error saving key settings for {domain}: {e}")
+        return False
+
+def convert_domain_entries(settings):
+    """Convert old-format domain entries (strings) of settings to objects in place
+    
+    Returns whether any entry was converted.
+    """
     domains = settings.get('domains', [])
     migrated_domains = []
     needs_migration = False
@@ -1854,11 +5812,15 @@ def migrate_domains_format(settings):
     for domain_entry in domains:
         if isinstance(domain_entry, str):
             # Old format - convert to new format
+            needs_migration = True
+            is_valid, domain_or_error = validate_domain(domain_entry)
+            if not is_valid:
+                logger.warning(f"Invalid domain skipped: {domain_or_error}")
+                continue
             migrated_domains.append({
-                'domain': domain_entry,
+                'domain': domain_or_error,
                 'dns_provider': settings.get('dns_provider', 'cloudflare')
             })
-            needs_migration = True
         elif isinstance(domain_entry, dict):
             # Already new format
             migrated_domains.append(domain_entry)
@@ -1868,11 +5830,146 @@ def migrate_domains_format(settings):
     
     if needs_migration:
         settings['domains'] = migrated_domains
-        save_settings(settings)
-        logger.info("Migrated domains to new format")
+    return needs_migration
+
+def migrate_domains_format(settings):
+    """Migrate domains from old format (list of strings) to new format (list of objects)
+    
+    The given settings are converted for the caller, and the stored settings
+    are migrated by a read-modify-write under the settings lock, so changes
+    made since the caller loaded its copy are kept.
+    """
+    if not convert_domain_entries(settings):
+        return settings
     
+    try:
+        with settings_lock():
+            with settings_update() as current:
+                migrated = convert_domain_entries(current)
+            if migrated:
+                inventory_sync_domains(current)
+        if migrated:
+            logger.info("Migrated domains to new format")
+    except OSError as e:
+        logger.error(f"Failed to migrate domains to new format: {e}")
     return settings
 
+# Domain entries
+# /api/domains adds, updates and removes single entries of the domains
+# setting. Only the changed entries are validated, the read-modify-write of
+# settings.json happens under the settings lock, and only the changed rows
+# of the inventory are touched, so an edit costs the same with ten domains
+# or ten thousand and concurrent edits are never lost.
+
+def validate_domain_fields(fields):
+    """Validate the optional fields of a domain entry (None clears a field in a PATCH)"""
+    if not isinstance(fields, dict):
+        return False, "Expected a JSON object"
+    unknown = sorted(set(fields) - set(DOMAIN_FIELDS))
+    if unknown:
+        return False, f"Unknown fields: {', '.join(unknown)}"
+    dns_provider = fields.get('dns_provider')
+    if dns_provider is not None and dns_provider not in SUPPORTED_DNS_PROVIDERS:
+        return False, f"Unsupported DNS provider {dns_provider!r}. Use one of: {', '.join(SUPPORTED_DNS_PROVIDERS)}"
+    return True, fields
+
+def validate_domain_entry(entry):
+    """Validate a domain entry to add, given as a domain name or an object, returning the normalized entry"""
+    if isinstance(entry, str):
+        entry = {'domain': entry}
+    if not isinstance(entry, dict):
+        return False, "Domain entry must be a domain name or an object"
+    fields = {key: value for key, value in entry.items() if key != 'domain'}
+    is_valid, fields_or_error = validate_domain_fields(fields)
+    if not is_valid:
+        return False, fields_or_error
+    is_valid, domain_or_error = validate_domain(entry.get('domain'))
+    if not is_valid:
+        return False, domain_or_error
+    is_valid, key_settings = validate_key_settings(fields)
+    if not is_valid:
+        return False, key_settings
+    
+    normalized = {'domain': domain_or_error}
+    if fields.get('dns_provider'):
+        normalized['dns_provider'] = fields['dns_provider']
+    normalized.update({key: value for key, value in key_settings.items() if value is not None})
+    return True, normalized
+
+def find_domain_entry(settings, domain):
+    """Return the entry of the domains setting for a domain, or None"""
+    for domain_entry in settings.get('domains', []):
+        if domain_entry == domain or (isinstance(domain_entry, dict) and domain_entry.get('domain') == domain):
+            return domain_entry if isinstance(domain_entry, dict) else {'domain': domain}
+    return None
+
+def change_domains(add=(), patch=None, remove=(), create_missing=False):
+    """Add, update and remove entries of the domains setting as one locked update
+    
+    add holds entries from validate_domain_entry, patch maps domains to fields
+    checked by validate_domain_fields (None removes a field) and remove holds
+    domain names. Entries already present (add) or missing (patch, remove)
+    are skipped, unless create_missing adds the patched ones. Raises
+    ValueError, leaving settings unchanged, when a patch makes key settings
+    invalid. Returns the added, updated and removed entries and the skipped
+    domains.
+    """
+    result = {'added': [], 'updated': [], 'removed': [], 'skipped': []}
+    # The inventory is updated before the lock is released, so concurrent
+    # changes reach it in the same order as settings.json
+    with settings_lock():
+        with settings_update() as settings:
+            default_provider = settings.get('dns_provider', 'cloudflare')
+            domains = [
+                {'domain': domain_entry, 'dns_provider': default_provider} if isinstance(domain_entry, str) else domain_entry
+                for domain_entry in settings.get('domains', [])
+            ]
+            by_domain = {domain_entry.get('domain'): domain_entry for domain_entry in domains if isinstance(domain_entry, dict)}
+        
+            for entry in add:
+                if entry['domain'] in by_domain:
+                    result['skipped'].append({'domain': entry['domain'], 'reason': 'already configured'})
+                    continue
+                entry = dict(entry)
+                domains.append(entry)
+                by_domain[entry['domain']] = entry
+                result['added'].append(entry)
+        
+            for domain, fields in (patch or {}).items():
+                entry = by_domain.get(domain)
+                if entry is None and not create_missing:
+                    result['skipped'].append({'domain': domain, 'reason': 'not configured'})
+                    continue
+                merged = {key: value for key, value in {**(entry or {'domain': domain}), **fields}.items()
+                          if value is not None}
+                is_valid, key_settings = validate_key_settings(merged)
+                if not is_valid:
+                    raise ValueError(f"{domain}: {key_settings}")
+                for key in ('key_type', 'key_size', 'preferred_chain'):
+                    merged.pop(key, None)
+                merged.update({key: value for key, value in key_settings.items() if value is not None})
+                if entry is None:
+                    domains.append(merged)
+                    by_domain[domain] = merged
+                    result['added'].append(merged)
+                else:
+                    entry.clear()
+                    entry.update(merged)
+                    result['updated'].append(entry)
+        
+            removed = set()
+            for domain in remove:
+                if domain not in by_domain or domain in removed:
+                    result['skipped'].append({'domain': domain, 'reason': 'not configured'})
+                    continue
+                removed.add(domain)
+                result['removed'].append(by_domain[domain])
+            settings['domains'] = [domain_entry for domain_entry in domains
+                                   if not (isinstance(domain_entry, dict) and domain_entry.get('domain') in removed)]
+    
+        inventory_apply_domain_changes(settings, result['added'], result['updated'], list(removed))
+    return result
+
 # Input validation utilities
 def validate_domain(domain):
     """Validate domain name format and security"""
@@ -1896,6 +5993,34 @@ def validate_domain(domain):
     
     return True, domain
 
+def validate_key_settings(domain_entry):
+    """Validate the key_type, key_size and preferred_chain of a domain entry"""
+    key_type = domain_entry.get('key_type')
+    key_size = domain_entry.get('key_size')
+    preferred_chain = domain_entry.get('preferred_chain')
+    
+    if key_type is None:
+        if key_size is not None:
+            return False, "key_size requires key_type"
+    elif key_type not in KEY_SIZES:
+        return False, f"key_type must be one of: {', '.join(KEY_SIZES)}"
+    elif key_size is not None:
+        try:
+            key_size = int(key_size)
+        except (TypeError, ValueError):
+            return False, "key_size must be an integer"
+        if key_size not in KEY_SIZES[key_type]:
+            return False, f"key_size for {key_type} must be one of: {', '.join(map(str, KEY_SIZES[key_type]))}"
+    
+    if preferred_chain is not None:
+        if not isinstance(preferred_chain, str) or not preferred_chain.strip() or len(preferred_chain) > 200:
+            return False, "preferred_chain must be a non-empty issuer name"
+        if any(char in preferred_chain for char in ['\n', '\r', '\t', ';', '&', '|', '`']):
+            return False, "preferred_chain contains invalid characters"
+        preferred_chain = preferred_chain.strip()
+    
+    return True, {'key_type': key_type, 'key_size': key_size, 'preferred_chain': preferred_chain}
+
 def validate_email(email):
     """Validate email format"""
     if not email or not isinstance(email, str):
@@ -1952,6 +6077,769 @@ def safe_file_read(file_path, is_json=True):
         logger.error(f"Error reading from {file_path}: {e}")
         return None
 
+# Inventory store
+_inventory_local = threading.local()
+
+# Per-worker cache of the certificate summary when the inventory is disabled
+_summary_cache = {}
+_summary_lock = threading.Lock()
+SUMMARY_BUCKET_DAYS = (7, 14, 30)
+SUMMARY_MAX_AGE = 60
+
+# Per-worker SAN coverage index (see get_san_index), keyed by inventory generation
+_san_index_cache = {}
+_san_index_lock = threading.Lock()
+
+# Expiry sort key: certificates that do not exist yet sort after every real expiry
+INVENTORY_EXPIRY_KEY = "COALESCE(expires_at, 1e18)"
+INVENTORY_MISSING_EXPIRY = 1e18
+
+INVENTORY_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS domains (
+        domain TEXT PRIMARY KEY,
+        dns_provider TEXT,
+        expires_at REAL,
+        not_before REAL,
+        serial TEXT,
+        fingerprint TEXT,
+        sans TEXT,
+        updated_at REAL NOT NULL,
+        key_type TEXT,
+        key_size INTEGER,
+        chain_size INTEGER,
+        preferred_chain TEXT
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_domains_expiry ON domains({INVENTORY_EXPIRY_KEY}, domain)",
+    f"CREATE INDEX IF NOT EXISTS idx_domains_provider ON domains(dns_provider, {INVENTORY_EXPIRY_KEY}, domain)",
+    """CREATE TABLE IF NOT EXISTS issuance_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        domain TEXT NOT NULL,
+        action TEXT NOT NULL,
+        success INTEGER NOT NULL,
+        message TEXT,
+        created_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_history_domain ON issuance_history(domain, created_at)",
+    """CREATE TABLE IF NOT EXISTS inventory_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""",
+    # Generation counter bumped on every domain or certificate change, used to
+    # invalidate per-worker caches derived from the inventory
+    "INSERT OR IGNORE INTO inventory_meta (key, value) VALUES ('generation', 0)",
+    *[
+        f"""CREATE TRIGGER IF NOT EXISTS trg_domains_{event.lower()} AFTER {event} ON domains BEGIN
+            UPDATE inventory_meta SET value = value + 1 WHERE key = 'generation';
+        END"""
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ],
+    # Change feed: one row per certificate published, replaced or removed,
+    # read by sync clients through /api/certificates/changes
+    """CREATE TABLE IF NOT EXISTS certificate_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        domain TEXT NOT NULL,
+        fingerprint TEXT,
+        expires_at REAL,
+        changed_at REAL NOT NULL
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS trg_changes_update AFTER UPDATE OF fingerprint ON domains
+        WHEN OLD.fingerprint IS NOT NEW.fingerprint BEGIN
+        INSERT INTO certificate_changes (domain, fingerprint, expires_at, changed_at)
+        VALUES (NEW.domain, NEW.fingerprint, NEW.expires_at, NEW.updated_at);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_changes_delete AFTER DELETE ON domains
+        WHEN OLD.fingerprint IS NOT NULL BEGIN
+        INSERT INTO certificate_changes (domain, fingerprint, expires_at, changed_at)
+        VALUES (OLD.domain, NULL, NULL, strftime('%s', 'now'));
+    END"""
+]
+
+INVENTORY_ADDED_COLUMNS = [
+    ('key_type', 'TEXT'),
+    ('key_size', 'INTEGER'),
+    ('chain_size', 'INTEGER'),
+    ('preferred_chain', 'TEXT')
+]
+
+# Columns read to build certificate info dicts
+INVENTORY_INFO_COLUMNS = "domain, dns_provider, expires_at, key_type, key_size, chain_size, preferred_chain"
+
+# Counters behind the certificate summary, kept current by triggers so that
+# it is answered without scanning the domains table: (name, delta, condition)
+# for every counter a row adds to, written for the row alias {row}
+SUMMARY_COUNTERS = [
+    ("'total'", "1", "1"),
+    ("'missing'", "1", "{row}.expires_at IS NULL"),
+    ("'provider:' || COALESCE({row}.dns_provider, '')", "1", "1"),
+    ("'key:' || COALESCE({row}.key_type || '-' || {row}.key_size, '')", "1", "{row}.expires_at IS NOT NULL"),
+    ("'chain_bytes'", "{row}.chain_size", "{row}.chain_size IS NOT NULL"),
+    ("'chain_count'", "1", "{row}.chain_size IS NOT NULL")
+]
+# Certificates counted by the hour they expire in; expiry buckets add up the
+# hours before their cutoff and read the rows of the cutoff's own hour
+SUMMARY_EXPIRY_HOUR = "CAST({row}.expires_at / 3600 AS INTEGER)"
+SUMMARY_COLUMNS = ('expires_at', 'dns_provider', 'key_type', 'key_size', 'chain_size')
+
+def summary_counter_statements(row, sign):
+    """SQL adding (sign 1) or removing (sign -1) the row alias's share of the summary counters"""
+    counters = " UNION ALL ".join(
+        f"SELECT {name} AS name, {sign} * {delta} AS delta WHERE {condition}".format(row=row)
+        for name, delta, condition in SUMMARY_COUNTERS)
+    hour = SUMMARY_EXPIRY_HOUR.format(row=row)
+    return f"""
+        INSERT INTO summary_counts (name, value) SELECT name, delta FROM ({counters}) WHERE true
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+        INSERT INTO expiry_hours (hour, count) SELECT {hour}, {sign} WHERE {row}.expires_at IS NOT NULL
+            ON CONFLICT(hour) DO UPDATE SET count = count + excluded.count;
+        DELETE FROM expiry_hours WHERE hour = {hour} AND count = 0;"""
+
+INVENTORY_SUMMARY_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS summary_counts (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS expiry_hours (
+        hour INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_domains_chain_size ON domains(chain_size)",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_summary_insert AFTER INSERT ON domains BEGIN
+        {summary_counter_statements('NEW', 1)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_summary_update AFTER UPDATE OF {', '.join(SUMMARY_COLUMNS)} ON domains
+        WHEN {' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in SUMMARY_COLUMNS)} BEGIN
+        {summary_counter_statements('OLD', -1)}
+        {summary_counter_statements('NEW', 1)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_summary_delete AFTER DELETE ON domains BEGIN
+        {summary_counter_statements('OLD', -1)}
+    END"""
+]
+
+def inventory_init_summary_counts(conn):
+    """Fill the summary counters from the domains table once, for inventories
+    created before they existed"""
+    if conn.execute("SELECT 1 FROM inventory_meta WHERE key = 'summary_counts'").fetchone():
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another worker may have filled them while this one waited for the lock
+        if not conn.execute("SELECT 1 FROM inventory_meta WHERE key = 'summary_counts'").fetchone():
+            counters = " UNION ALL ".join(
+                f"SELECT {name} AS name, {delta} AS delta FROM domains AS d WHERE {condition}".format(row='d')
+                for name, delta, condition in SUMMARY_COUNTERS)
+            conn.execute("DELETE FROM summary_counts")
+            conn.execute("DELETE FROM expiry_hours")
+            conn.execute(f"INSERT INTO summary_counts (name, value) SELECT name, SUM(delta) FROM ({counters}) GROUP BY name")
+            conn.execute(f"INSERT INTO expiry_hours (hour, count) SELECT {SUMMARY_EXPIRY_HOUR.format(row='d')}, COUNT(*) "
+                         f"FROM domains AS d WHERE d.expires_at IS NOT NULL GROUP BY 1")
+            conn.execute("INSERT INTO inventory_meta (key, value) VALUES ('summary_counts', ?)", (time.time(),))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def get_inventory_db():
+    """Get the inventory database connection for the current thread and process
+
+    Connections are never shared between threads or forked workers. WAL mode
+    lets readers in every gunicorn worker proceed while one worker writes.
+    """
+    conn = getattr(_inventory_local, 'conn', None)
+    if conn is not None and getattr(_inventory_local, 'pid', None) == os.getpid():
+        return conn
+
+    conn = sqlite3.connect(str(INVENTORY_DB_FILE), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    for statement in INVENTORY_SCHEMA:
+        conn.execute(statement)
+    # Columns added after the first release of the inventory
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(domains)")}
+    for column, column_type in INVENTORY_ADDED_COLUMNS:
+        if column not in columns:
+            try:
+                conn.execute(f"ALTER TABLE domains ADD COLUMN {column} {column_type}")
+                # Have the next startup re-read every certificate to fill it in
+                conn.execute("DELETE FROM inventory_meta WHERE key = 'migrated_at'")
+            except sqlite3.OperationalError:
+                pass  # added concurrently by another worker
+    for statement in INVENTORY_SUMMARY_SCHEMA:
+        conn.execute(statement)
+    inventory_init_summary_counts(conn)
+
+    _inventory_local.conn = conn
+    _inventory_local.pid = os.getpid()
+    return conn
+
+def parse_certificate_metadata(cert_file):
+    """Parse expiry, serial, fingerprint, SANs and key type from a PEM certificate"""
+    try:
+        with open(cert_file, 'rb') as f:
+            cert = x509.load_pem_x509_certificate(f.read(), default_backend())
+    except Exception as e:
+        logger.error(f"Error parsing certificate {cert_file}: {e}")
+        return None
+
+    try:
+        san_extension = cert.extensions.get_extension_for_oid(x509.oid.ExtensionOID.SUBJECT_ALTERNATIVE_NAME)
+        sans = san_extension.value.get_values_for_type(x509.DNSName)
+    except x509.ExtensionNotFound:
+        sans = []
+
+    public_key = cert.public_key()
+    if isinstance(public_key, rsa.RSAPublicKey):
+        key_type, key_size = 'rsa', public_key.key_size
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        key_type, key_size = 'ecdsa', public_key.curve.key_size
+    else:
+        key_type, key_size = None, None
+
+    return {
+        'expires_at': cert.not_valid_after_utc.timestamp(),
+        'not_before': cert.not_valid_before_utc.timestamp(),
+        'serial': format(cert.serial_number, 'x'),
+        'fingerprint': cert.fingerprint(hashes.SHA256()).hex(),
+        'sans': sans,
+        'key_type': key_type,
+        'key_size': key_size
+    }
+
+def certificate_chain_size(cert_dir):
+    """Return the DER size in bytes of the certificate chain a server sends, or None
+    
+    This is what the certificates add to every full TLS handshake.
+    """
+    chain_file = cert_dir / "fullchain.pem"
+    try:
+        pem = chain_file.read_text()
+    except OSError:
+        return None
+    blocks = re.findall(r'-----BEGIN CERTIFICATE-----(.*?)-----END CERTIFICATE-----', pem, re.S)
+    return sum(len(base64.b64decode(''.join(block.split()))) for block in blocks) or None
+
+INVENTORY_UPSERT_DOMAIN = (
+    "INSERT INTO domains (domain, dns_provider, preferred_chain, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(domain) DO UPDATE SET dns_provider = excluded.dns_provider, "
+    "preferred_chain = excluded.preferred_chain, updated_at = excluded.updated_at "
+    "WHERE domains.dns_provider IS NOT excluded.dns_provider "
+    "OR domains.preferred_chain IS NOT excluded.preferred_chain"
+)
+
+def inventory_sync_domains(settings):
+    """Mirror the domains configured in settings into the inventory store"""
+    if not INVENTORY_ENABLED:
+        return
+
+    default_provider = settings.get('dns_provider', 'cloudflare')
+    rows = {}
+    for domain_entry in settings.get('domains', []):
+        if isinstance(domain_entry, str):
+            rows[domain_entry] = (default_provider, None)
+        elif isinstance(domain_entry, dict) and domain_entry.get('domain'):
+            rows[domain_entry['domain']] = (domain_entry.get('dns_provider', default_provider),
+                                            domain_entry.get('preferred_chain'))
+
+    try:
+        conn = get_inventory_db()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = {row['domain'] for row in conn.execute("SELECT domain FROM domains")}
+            added = rows.keys() - existing
+            conn.executemany("DELETE FROM domains WHERE domain = ?", [(d,) for d in existing - rows.keys()])
+            conn.executemany(
+                INVENTORY_UPSERT_DOMAIN,
+                [(domain, provider, preferred_chain, now) for domain, (provider, preferred_chain) in rows.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        # Newly configured domains may already have a certificate on disk
+        for domain in added:
+            if (get_certificate_dir(domain) / "cert.pem").exists():
+                inventory_update_certificate(domain)
+    except Exception as e:
+        logger.error(f"Error syncing domains to inventory: {e}")
+
+def inventory_apply_domain_changes(settings, added, updated, removed):
+    """Apply added, updated and removed domain entries to the inventory store
+    
+    The incremental counterpart of inventory_sync_domains, for edits made
+    through /api/domains: only the changed rows are touched.
+    """
+    if not INVENTORY_ENABLED:
+        return
+
+    default_provider = settings.get('dns_provider', 'cloudflare')
+    try:
+        conn = get_inventory_db()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("DELETE FROM domains WHERE domain = ?", [(domain,) for domain in removed])
+            conn.executemany(
+                INVENTORY_UPSERT_DOMAIN,
+                [(entry['domain'], entry.get('dns_provider', default_provider), entry.get('preferred_chain'), now)
+                 for entry in added + updated]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        for entry in added:
+            if (get_certificate_dir(entry['domain']) / "cert.pem").exists():
+                inventory_update_certificate(entry['domain'])
+    except Exception as e:
+        logger.error(f"Error applying domain changes to inventory: {e}")
+
+def inventory_update_certificate(domain):
+    """Refresh the stored metadata for a domain's certificate from CERT_DIR"""
+    if not INVENTORY_ENABLED:
+        return None
+
+    cert_dir = get_certificate_dir(domain)
+    cert_file = cert_dir / "cert.pem"
+    metadata = parse_certificate_metadata(cert_file) if cert_file.exists() else None
+    if metadata is None:
+        metadata = {'expires_at': None, 'not_before': None, 'serial': None, 'fingerprint': None, 'sans': None,
+                    'key_type': None, 'key_size': None}
+    metadata['chain_size'] = certificate_chain_size(cert_dir) if metadata['expires_at'] is not None else None
+
+    try:
+        get_inventory_db().execute(
+            "UPDATE domains SET expires_at = ?, not_before = ?, serial = ?, fingerprint = ?, sans = ?, "
+            "key_type = ?, key_size = ?, chain_size = ?, updated_at = ? WHERE domain = ?",
+            (metadata['expires_at'], metadata['not_before'], metadata['serial'], metadata['fingerprint'],
+             json.dumps(metadata['sans']) if metadata['sans'] is not None else None,
+             metadata['key_type'], metadata['key_size'], metadata['chain_size'], time.time(), domain)
+        )
+    except Exception as e:
+        logger.error(f"Error updating inventory for {domain}: {e}")
+    return metadata if metadata['expires_at'] is not None else None
+
+def inventory_record_event(domain, action, success, message=None):
+    """Append an issuance or renewal attempt to the inventory history"""
+    if not INVENTORY_ENABLED:
+        return
+
+    try:
+        get_inventory_db().execute(
+            "INSERT INTO issuance_history (domain, action, success, message, created_at) VALUES (?, ?, ?, ?, ?)",
+            (domain, action, int(bool(success)), message, time.time())
+        )
+    except Exception as e:
+        logger.error(f"Error recording {action} history for {domain}: {e}")
+
+def inventory_row_to_info(row):
+    """Convert an inventory row into a CertificateInfo record"""
+    return CertificateInfo(row['domain'], row['expires_at'], row['dns_provider'], row['key_type'],
+                           row['key_size'], row['preferred_chain'], row['chain_size'])
+
+def inventory_list_certificates(expiring_before=None):
+    """List configured domains with their certificate metadata, soonest expiry first"""
+    query = f"SELECT {INVENTORY_INFO_COLUMNS} FROM domains"
+    params = []
+    if expiring_before is not None:
+        query += f" WHERE {INVENTORY_EXPIRY_KEY} < ?"
+        params.append(expiring_before)
+    query += f" ORDER BY {INVENTORY_EXPIRY_KEY}, domain"
+
+    return [inventory_row_to_info(row) for row in get_inventory_db().execute(query, params)]
+
+def encode_cursor(sort_key, domain):
+    """Encode a keyset pagination position as an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps([sort_key, domain]).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_key, domain = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(sort_key), str(domain)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def certificate_sort_key(cert_info, sort):
+    """Compute the keyset sort value of a CertificateInfo for the given sort order"""
+    if sort == 'domain':
+        return 0.0
+    if cert_info.expires_at is None:
+        return INVENTORY_MISSING_EXPIRY
+    return float(cert_info.expires_at)
+
+def parse_certificate_query(limit, cursor, sort):
+    """Validate certificate list paging arguments, returning the decoded cursor position"""
+    if sort not in CERTIFICATE_SORT_ORDERS:
+        raise ValueError(f"Invalid sort order '{sort}'. Use one of: {', '.join(CERTIFICATE_SORT_ORDERS)}")
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return decode_cursor(cursor) if cursor else None
+
+def inventory_certificate_query(sort, after, limit, expiring_within_days, dns_provider, exists, needs_renewal):
+    """Build the inventory query and parameters for a filtered, sorted certificate list"""
+    # Every filter is expressed on the indexed expiry expression so that
+    # both filtering and keyset pagination are index range scans
+    descending = sort == '-expiry'
+    sort_expr = "0" if sort == 'domain' else INVENTORY_EXPIRY_KEY
+    conditions = []
+    params = []
+    if expiring_within_days is not None:
+        conditions.append(f"{INVENTORY_EXPIRY_KEY} < ?")
+        params.append(time.time() + expiring_within_days * 86400)
+    if dns_provider:
+        conditions.append("dns_provider = ?")
+        params.append(dns_provider)
+    if exists is not None:
+        conditions.append(f"{INVENTORY_EXPIRY_KEY} {'<' if exists else '>='} ?")
+        params.append(INVENTORY_MISSING_EXPIRY)
+    if needs_renewal is not None:
+        conditions.append(f"{INVENTORY_EXPIRY_KEY} {'<' if needs_renewal else '>='} ?")
+        params.append(time.time() + RENEWAL_THRESHOLD_DAYS * 86400)
+    if after:
+        conditions.append(f"({sort_expr}, domain) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+
+    direction = "DESC" if descending else "ASC"
+    query = f"SELECT {INVENTORY_INFO_COLUMNS}, {sort_expr} AS sort_key FROM domains"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if sort == 'domain':
+        query += f" ORDER BY domain {direction}"
+    else:
+        query += f" ORDER BY {sort_expr} {direction}, domain {direction}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+def query_certificates(limit=None, cursor=None, sort='expiry', expiring_within_days=None,
+                       dns_provider=None, exists=None, needs_renewal=None):
+    """Return a filtered, sorted page of certificates and the cursor for the next page
+
+    Served from the inventory index when it is enabled. Otherwise the
+    certificate list is built from settings and filtered in memory.
+    """
+    after = parse_certificate_query(limit, cursor, sort)
+    descending = sort == '-expiry'
+
+    if INVENTORY_ENABLED:
+        query, params = inventory_certificate_query(
+            sort, after, limit + 1 if limit is not None else None,
+            expiring_within_days, dns_provider, exists, needs_renewal)
+        rows = get_inventory_db().execute(query, params).fetchall()
+        page = [((row['sort_key'], row['domain']), inventory_row_to_info(row)) for row in rows]
+    else:
+        settings = migrate_domains_format(load_settings())
+        page = []
+        for domain_entry in settings.get('domains', []):
+            domain = domain_entry.get('domain') if isinstance(domain_entry, dict) else domain_entry
+            if not domain:
+                continue
+            cert_info = get_certificate_info(domain)
+            if dns_provider and cert_info.dns_provider != dns_provider:
+                continue
+            if exists is not None and cert_info.exists != exists:
+                continue
+            if needs_renewal is not None and cert_info.needs_renewal != needs_renewal:
+                continue
+            if expiring_within_days is not None and (
+                    cert_info.days_left is None or cert_info.days_left >= expiring_within_days):
+                continue
+            position = (certificate_sort_key(cert_info, sort), domain)
+            if after and (position >= after if descending else position <= after):
+                continue
+            page.append((position, cert_info))
+        page.sort(key=lambda item: item[0], reverse=descending)
+        if limit is not None:
+            page = page[:limit + 1]
+
+    next_cursor = None
+    if limit is not None and len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(*page[-1][0])
+    return [cert_info for _, cert_info in page], next_cursor
+
+def iter_certificates(limit=None, cursor=None, sort='expiry', expiring_within_days=None,
+                      dns_provider=None, exists=None, needs_renewal=None):
+    """Return an iterator over the certificates query_certificates would list
+
+    Arguments are validated before returning, so errors surface before a
+    response starts. With the inventory enabled rows are read from the
+    database as the iterator is consumed; without it the list is built in
+    memory first, as query_certificates does.
+    """
+    after = parse_certificate_query(limit, cursor, sort)
+    if not INVENTORY_ENABLED:
+        certificates, _ = query_certificates(limit, cursor, sort, expiring_within_days,
+                                             dns_provider, exists, needs_renewal)
+        return iter(certificates)
+
+    query, params = inventory_certificate_query(
+        sort, after, limit, expiring_within_days, dns_provider, exists, needs_renewal)
+    rows = get_inventory_db().execute(query, params)
+    return (inventory_row_to_info(row) for row in rows)
+
+def inventory_generation():
+    """Return the inventory change counter (0 when the inventory is disabled)"""
+    if not INVENTORY_ENABLED:
+        return 0
+    row = get_inventory_db().execute("SELECT value FROM inventory_meta WHERE key = 'generation'").fetchone()
+    return int(row['value']) if row else 0
+
+def build_certificate_summary(soonest=10):
+    """Aggregate certificate counts by expiry bucket, DNS provider and status"""
+    now = time.time()
+    renewal_cutoff = now + RENEWAL_THRESHOLD_DAYS * 86400
+    summary = {
+        'total': 0,
+        'by_status': {'missing': 0, 'valid': 0, 'needs_renewal': 0},
+        'expiring_within_days': {str(days): 0 for days in SUMMARY_BUCKET_DAYS},
+        'expired': 0,
+        'by_dns_provider': {},
+        'by_key_type': {},
+        'chain_size_bytes': {'total': 0, 'average': None, 'max': None},
+        'soonest_expiring': [],
+        'generated_at': datetime.now().isoformat()
+    }
+
+    if INVENTORY_ENABLED:
+        conn = get_inventory_db()
+        counts = {row['name']: row['value'] for row in conn.execute("SELECT name, value FROM summary_counts")}
+
+        def expiring_before(timestamp):
+            hour = int(timestamp // 3600)
+            earlier = conn.execute("SELECT SUM(count) FROM expiry_hours WHERE hour < ?", (hour,)).fetchone()[0]
+            same_hour = conn.execute(
+                f"SELECT COUNT(*) FROM domains WHERE {INVENTORY_EXPIRY_KEY} >= ? AND {INVENTORY_EXPIRY_KEY} < ?",
+                (hour * 3600, timestamp)).fetchone()[0]
+            return (earlier or 0) + same_hour
+
+        summary['total'] = counts.get('total', 0)
+        needs_renewal = expiring_before(renewal_cutoff)
+        summary['by_status'] = {'missing': counts.get('missing', 0), 'needs_renewal': needs_renewal,
+                                'valid': summary['total'] - counts.get('missing', 0) - needs_renewal}
+        summary['expired'] = expiring_before(now)
+        for days in SUMMARY_BUCKET_DAYS:
+            summary['expiring_within_days'][str(days)] = expiring_before(now + days * 86400)
+        for name, value in counts.items():
+            group, _, label = name.partition(':')
+            if value and group == 'provider':
+                summary['by_dns_provider'][label or 'unknown'] = value
+            elif value and group == 'key':
+                summary['by_key_type'][label or 'unknown'] = value
+        chain_count = counts.get('chain_count', 0)
+        summary['chain_size_bytes'] = {
+            'total': counts.get('chain_bytes', 0),
+            'average': round(counts['chain_bytes'] / chain_count) if chain_count else None,
+            'max': conn.execute("SELECT MAX(chain_size) FROM domains").fetchone()[0]
+        }
+        # query_certificates rejects a limit of 0
+        if soonest:
+            certificates, _ = query_certificates(limit=soonest, exists=True)
+            summary['soonest_expiring'] = [cert_info.to_dict() for cert_info in certificates]
+        return summary
+
+    certificates, _ = query_certificates()
+    chain_sizes = []
+    for cert_info in certificates:
+        summary['total'] += 1
+        provider = cert_info.dns_provider or 'unknown'
+        summary['by_dns_provider'][provider] = summary['by_dns_provider'].get(provider, 0) + 1
+        if not cert_info.exists:
+            summary['by_status']['missing'] += 1
+            continue
+        days_left = cert_info.days_left
+        summary['by_status']['needs_renewal' if days_left < RENEWAL_THRESHOLD_DAYS else 'valid'] += 1
+        key_label = f"{cert_info.key_type}-{cert_info.key_size}" if cert_info.key_type else 'unknown'
+        summary['by_key_type'][key_label] = summary['by_key_type'].get(key_label, 0) + 1
+        if cert_info.chain_size_bytes:
+            chain_sizes.append(cert_info.chain_size_bytes)
+        if days_left < 0:
+            summary['expired'] += 1
+        for days in SUMMARY_BUCKET_DAYS:
+            if days_left < days:
+                summary['expiring_within_days'][str(days)] += 1
+    if chain_sizes:
+        summary['chain_size_bytes'] = {'total': sum(chain_sizes), 'average': round(sum(chain_sizes) / len(chain_sizes)),
+                                       'max': max(chain_sizes)}
+    summary['soonest_expiring'] = [cert_info.to_dict() for cert_info in certificates if cert_info.exists][:soonest]
+    return summary
+
+def get_certificate_summary(soonest=10):
+    """Return the certificate summary
+
+    With the inventory it is read from counters kept by triggers, which costs
+    the same however many certificates there are. Without it every
+    certificate is read, so the summary is cached per worker and rebuilt once
+    it is older than SUMMARY_MAX_AGE seconds.
+    """
+    if INVENTORY_ENABLED:
+        return build_certificate_summary(soonest)
+
+    with _summary_lock:
+        cached = _summary_cache.get('entry')
+        if cached and cached['soonest'] >= soonest and time.time() - cached['computed_at'] < SUMMARY_MAX_AGE:
+            summary = dict(cached['summary'])
+            summary['soonest_expiring'] = summary['soonest_expiring'][:soonest]
+            return summary
+
+    summary = build_certificate_summary(soonest)
+    with _summary_lock:
+        _summary_cache['entry'] = {
+            'soonest': soonest,
+            'computed_at': time.time(),
+            'summary': summary
+        }
+    return summary
+
+def build_san_index():
+    """Map every SAN (exact and wildcard names) to the (domain, expires_at) of the
+    certificate covering it; the certificate expiring last wins"""
+    index = {}
+    if INVENTORY_ENABLED:
+        rows = ((row['domain'], row['sans'], row['expires_at']) for row in get_inventory_db().execute(
+            "SELECT domain, sans, expires_at FROM domains WHERE sans IS NOT NULL"))
+    else:
+        rows = []
+        for domain_entry in load_settings_cached().get('domains', []):
+            domain = domain_entry.get('domain') if isinstance(domain_entry, dict) else domain_entry
+            cert_file = get_certificate_dir(domain) / "cert.pem" if domain else None
+            metadata = parse_certificate_metadata(cert_file) if cert_file and cert_file.exists() else None
+            if metadata:
+                rows.append((domain, metadata['sans'], metadata['expires_at']))
+
+    for domain, sans, expires_at in rows:
+        if isinstance(sans, str):
+            sans = json.loads(sans)
+        for san in sans:
+            san = san.lower()
+            if san not in index or index[san][1] < expires_at:
+                index[san] = (domain, expires_at)
+    return index
+
+def get_san_index():
+    """Return the SAN coverage index, rebuilt only when the inventory changes
+
+    Without the inventory it is rebuilt from the certificate files at most
+    every SUMMARY_MAX_AGE seconds.
+    """
+    generation = inventory_generation()
+    with _san_index_lock:
+        cached = _san_index_cache.get('entry')
+        if cached and cached['generation'] == generation and (
+                INVENTORY_ENABLED or time.time() - cached['computed_at'] < SUMMARY_MAX_AGE):
+            return cached['index']
+
+    index = build_san_index()
+    with _san_index_lock:
+        _san_index_cache['entry'] = {'generation': generation, 'computed_at': time.time(), 'index': index}
+    return index
+
+def find_covering_certificate(domain):
+    """Return the existing, unexpired certificate covering a domain name, or None
+
+    Checks the exact name and the wildcard for its parent domain, so a lookup
+    costs two dictionary reads however many certificates there are. Returns
+    {'domain', 'san', 'expires_at'} where domain is the certificate's domain.
+    """
+    domain = domain.lower().rstrip('.')
+    index = get_san_index()
+    candidates = [domain]
+    if '.' in domain and not domain.startswith('*.'):
+        candidates.append('*.' + domain.split('.', 1)[1])
+
+    now = time.time()
+    for san in candidates:
+        covering = index.get(san)
+        if covering and covering[1] > now:
+            return {'domain': covering[0], 'san': san, 'expires_at': covering[1]}
+    return None
+
+def covered_certificate_response(domain, covering):
+    """Response body returned instead of issuing a certificate that already exists"""
+    return {
+        'success': True,
+        'message': f'{domain} is already covered by the certificate for {covering["domain"]} '
+                   f'({covering["san"]}); pass force to issue a separate certificate',
+        'covered_by': covering['domain'],
+        'covering_san': covering['san'],
+        'expiry_date': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(covering['expires_at'])),
+        'download_url': f'/{covering["domain"]}/tls'
+    }
+
+def refresh_inventory():
+    """Re-read metadata for every configured domain's certificate"""
+    if not INVENTORY_ENABLED:
+        return
+
+    settings = load_settings()
+    inventory_sync_domains(settings)
+    conn = get_inventory_db()
+    for row in conn.execute("SELECT domain FROM domains").fetchall():
+        inventory_update_certificate(row['domain'])
+    conn.execute("DELETE FROM certificate_changes WHERE seq <= (SELECT MAX(seq) FROM certificate_changes) - ?",
+                 (CHANGE_FEED_RETENTION,))
+    logger.info("Inventory refreshed from certificate directory")
+
+def get_certificate_changes(since=0, limit=MAX_PAGE_SIZE):
+    """Return certificate changes after sequence number since, oldest first
+    
+    A change with a null fingerprint means the certificate was removed.
+    Returns (changes, last_seq); last_seq is the value to pass as since
+    next time. since=0, a value older than the retained feed, or one the
+    feed never reached (the inventory was recreated) returns a reset flag so
+    the client knows to resynchronise fully.
+    """
+    if not INVENTORY_ENABLED:
+        raise ValueError('Change feed requires the inventory store')
+    
+    conn = get_inventory_db()
+    oldest, latest = conn.execute("SELECT MIN(seq), MAX(seq) FROM certificate_changes").fetchone()
+    reset = since == 0 or latest is None or since > latest or since < oldest - 1
+    if latest is None or since > latest:
+        # Start the client over from the beginning of the current feed
+        since = 0
+    rows = conn.execute(
+        "SELECT seq, domain, fingerprint, expires_at, changed_at FROM certificate_changes "
+        "WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit)
+    ).fetchall()
+    changes = [dict(row) for row in rows]
+    return {
+        'changes': changes,
+        'last_seq': changes[-1]['seq'] if changes else max(since, latest or 0),
+        'reset': reset,
+        'more': bool(latest) and bool(changes) and changes[-1]['seq'] < latest
+    }
+
+def migrate_settings_to_inventory():
+    """Populate the inventory store from settings.json and CERT_DIR on first use"""
+    if not INVENTORY_ENABLED:
+        return
+
+    try:
+        conn = get_inventory_db()
+        migrated = conn.execute("SELECT value FROM inventory_meta WHERE key = 'migrated_at'").fetchone()
+
+        settings = migrate_domains_format(load_settings())
+        inventory_sync_domains(settings)
+        if migrated:
+            return
+
+        refresh_inventory()
+        conn.execute(
+            "INSERT OR REPLACE INTO inventory_meta (key, value) VALUES ('migrated_at', ?)",
+            (datetime.now().isoformat(),)
+        )
+        logger.info(f"Migrated settings and certificates into inventory store at {INVENTORY_DB_FILE}")
+    except Exception as e:
+        logger.error(f"Failed to migrate inventory store: {e}")
+
 def is_setup_completed():
     """Check if initial setup has been completed"""
     settings = load_settings()
@@ -1974,9 +6862,137 @@ def require_setup_or_auth(f):
             return require_auth(f)(*args, **kwargs)
     return decorated_function
 
+def acquire_scheduler_lock():
+    """Try to become the single process that runs scheduled jobs
+    
+    Every gunicorn worker imports the app, but renewals and refresh jobs
+    must only run once. The lock is held for the lifetime of the process.
+    """
+    global _scheduler_lock_handle
+    if _scheduler_lock_handle is not None:
+        return True
+    handle = open(SCHEDULER_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    _scheduler_lock_handle = handle
+    return True
+
+def start_scheduler():
+    """Start the background scheduler and register the periodic jobs"""
+    global scheduler
+    try:
+        from apscheduler.schedulers.background import BackgroundScheduler
+        scheduler = BackgroundScheduler()
+        scheduler.start()
+        logger.info("Background scheduler started successfully")
+    except Exception as e:
+        logger.error(f"Failed to start background scheduler: {e}")
+        scheduler = None
+        logger.warning("Background scheduler not available - automatic renewals disabled")
+        return
+    
+    # Schedule renewal check every day at 2 AM
+    try:
+        scheduler.add_job(
+            func=check_renewals,
+            trigger="cron",
+            hour=2,
+            minute=0,
+            id='renewal_check'
+        )
+        logger.info("Automatic renewal check scheduled for 2 AM daily")
+    except Exception as e:
+        logger.error(f"Failed to schedule renewal check: {e}")
+    
+    # Keep the inventory in step with the certificate directory
+    if INVENTORY_ENABLED:
+        try:
+            scheduler.add_job(
+                func=refresh_inventory,
+                trigger="interval",
+                hours=6,
+                id='inventory_refresh'
+            )
+        except Exception as e:
+            logger.error(f"Failed to schedule inventory refresh: {e}")
+    
+    # Keep OCSP responses fresh for stapling
+    try:
+        scheduler.add_job(
+            func=refresh_ocsp_responses,
+            trigger="interval",
+            minutes=OCSP_CHECK_INTERVAL_MINUTES,
+            id='ocsp_refresh',
+            next_run_time=datetime.now()
+        )
+    except Exception as e:
+        logger.error(f"Failed to schedule OCSP refresh: {e}")
+    
+    # Pick up jobs left unfinished by a crashed or restarted worker
+    try:
+        scheduler.add_job(
+            func=resume_jobs,
+            trigger="interval",
+            seconds=JOB_RESUME_INTERVAL_SECONDS,
+            id='job_resume',
+            next_run_time=datetime.now()
+        )
+    except Exception as e:
+        logger.error(f"Failed to schedule job resume: {e}")
+    
+    # Keep the private key pool topped up (no-op unless key_pool is enabled)
+    try:
+        scheduler.add_job(
+            func=refill_key_pool,
+            trigger="interval",
+            minutes=10,
+            id='key_pool_refill',
+            next_run_time=datetime.now()
+        )
+    except Exception as e:
+        logger.error(f"Failed to schedule key pool refill: {e}")
+
+def start_background_services():
+    """Start background work for this process once the app is being served
+    
+    Deferred until after gunicorn forks its workers (post_worker_init in
+    gunicorn.conf.py, or the first request), so a --preload master never
+    starts threads or opens databases that the workers would inherit.
+    Only the worker holding the scheduler lock migrates the inventory and
+    runs scheduled jobs; the others retry for the lock once a minute.
+    """
+    global _background_pid, _background_retry_at
+    pid = os.getpid()
+    if _background_pid == pid and (scheduler is not None or time.time() < _background_retry_at):
+        return
+    
+    with _background_lock:
+        if _background_pid == pid and (scheduler is not None or time.time() < _background_retry_at):
+            return
+        if _background_pid != pid:
+            # Every worker keeps its own caches fresh
+            start_certificate_watcher()
+        _background_pid = pid
+        _background_retry_at = time.time() + 60
+        if not acquire_scheduler_lock():
+            return
+        
+        logger.info(f"Process {pid} runs background services")
+        migrate_settings_to_inventory()
+        start_scheduler()
+        start_webhook_dispatcher()
+
 # Graceful shutdown for scheduler
 def shutdown_scheduler():
-    """Gracefully shutdown the background scheduler"""
+    """Gracefully shutdown the background scheduler, draining certificate jobs first"""
+    stop_webhook_dispatcher()
+    try:
+        drain_jobs()
+    except Exception as e:
+        logger.error(f"Error draining certificate jobs: {e}")
     if scheduler:
         try:
             scheduler.shutdown(wait=True)
@@ -1987,10 +7003,32 @@ def shutdown_scheduler():
 # Register shutdown handler
 atexit.register(shutdown_scheduler)
 
+def create_app():
+    """Application factory
+    
+    Creates the Flask app, binds the API and web routes and prepares the
+    data directories. Background services are not started here; see
+    start_background_services.
+    """
+    app = Flask(__name__)
+    # Generate a secure random secret key if not provided
+    default_secret = os.urandom(32).hex() if not os.getenv('SECRET_KEY') else 'your-secret-key-here'
+    app.secret_key = os.getenv('SECRET_KEY', default_secret)
+    CORS(app)
+    
+    init_directories()
+    api.init_app(app)
+    app.register_blueprint(web)
+    app.before_request(start_background_services)
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
     host = os.getenv('HOST', '127.0.0.1')
     port = int(os.getenv('PORT', 8000))
     debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     
+    start_background_services()
     print(f"Starting CertMate on http://{host}:{port}")
     app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for CertMate
+
+Usage:
+    python benchmark.py startup [--runs N]
+    python benchmark.py keypool [--issuances N] [--key-type rsa2048]
+    python benchmark.py memory [--certificates N]
+
+Each benchmark runs against a throwaway working directory, so existing
+certificates and settings are never touched.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP_PROBE = r'''
+import json, os, resource, sys, time
+
+start = time.perf_counter()
+import app
+import_seconds = time.perf_counter() - start
+import_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def memory_kb():
+    """Private and shared resident memory of this process (Linux only)"""
+    usage = {'private': None, 'shared': None}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line and not line.startswith(' '))
+        usage['private'] = sum(int(fields[k].split()[0]) for k in ('Private_Clean', 'Private_Dirty'))
+        usage['shared'] = sum(int(fields[k].split()[0]) for k in ('Shared_Clean', 'Shared_Dirty'))
+    except (OSError, KeyError, ValueError):
+        pass
+    return usage
+
+# Simulate a gunicorn --preload worker: fork after import and serve a request
+read_fd, write_fd = os.pipe()
+pid = os.fork()
+if pid == 0:
+    os.close(read_fd)
+    start = time.perf_counter()
+    app.app.test_client().get('/health')
+    first_request_seconds = time.perf_counter() - start
+    os.write(write_fd, json.dumps({'first_request_seconds': first_request_seconds, 'worker': memory_kb()}).encode())
+    os._exit(0)
+
+os.close(write_fd)
+worker = json.loads(os.read(read_fd, 65536).decode())
+os.waitpid(pid, 0)
+print(json.dumps({'import_seconds': import_seconds, 'import_max_rss_kb': import_rss_kb, **worker}))
+'''
+
+KEYPOOL_PROBE = r'''
+import json, os, sys, time
+
+key_type, issuances = sys.argv[1], int(sys.argv[2])
+os.makedirs('data', exist_ok=True)
+with open('data/settings.json', 'w') as f:
+    json.dump({'key_pool': {'enabled': True, 'key_types': [key_type], 'default_key_type': key_type,
+                            'low_watermark': 1, 'high_watermark': issuances}}, f)
+
+import app
+app.init_directories()
+domains = ['example.com', '*.example.com']
+
+def issuance_cpu(prepare_key):
+    """CPU and wall time of the key/CSR part of the issuance path"""
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(issuances):
+        key = prepare_key()
+        assert key is not None
+        app.build_csr(key, domains)
+    return time.process_time() - cpu, time.perf_counter() - wall
+
+# Without the pool the key is generated on the issuance path (as certbot does)
+without_cpu, without_wall = issuance_cpu(lambda: app.generate_private_key(key_type))
+
+# With the pool it was generated in the background; issuance only claims and decrypts it
+children = os.times()
+refill_start = time.perf_counter()
+app.refill_key_pool()
+refill_wall = time.perf_counter() - refill_start
+refill_cpu = sum(os.times()[2:4]) - sum(children[2:4])
+with_cpu, with_wall = issuance_cpu(lambda: app.claim_pool_key(key_type))
+
+print(json.dumps({'without_cpu': without_cpu, 'without_wall': without_wall, 'with_cpu': with_cpu,
+                  'with_wall': with_wall, 'refill_cpu': refill_cpu, 'refill_wall': refill_wall}))
+'''
+
+MEMORY_PROBE = r'''
+import json, sys, time, tracemalloc
+
+count = int(sys.argv[1])
+import app
+client = app.app.test_client()
+# Startup syncs the inventory with settings; insert the synthetic domains after it
+client.get('/health')
+conn = app.get_inventory_db()
+now = time.time()
+conn.execute("BEGIN")
+conn.executemany(
+    "INSERT INTO domains (domain, dns_provider, expires_at, updated_at, key_type, key_size, chain_size) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+    ((f"host{i}.example.com", 'cloudflare', now + (i % 90) * 86400, now, 'rsa', 2048, 2600) for i in range(count)))
+conn.execute("COMMIT")
+
+def measure(build):
+    """Memory retained by and peak while building a result, and the time taken"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {'retained': retained, 'peak': peak, 'seconds': seconds}
+
+def stream(url):
+    response = client.get(url, buffered=False)
+    size = sum(len(chunk) for chunk in response.response)
+    response.close()
+    return size
+
+print(json.dumps({
+    'records': measure(lambda: app.query_certificates()[0]),
+    'dicts': measure(lambda: [cert_info.to_dict() for cert_info in app.query_certificates()[0]]),
+    'json': measure(lambda: stream('/api/web/certificates')),
+    'ndjson': measure(lambda: stream('/api/web/certificates?format=ndjson')),
+}))
+'''
+
+
+def run_startup(runs):
+    """Measure cold import time, first request latency and per-worker memory"""
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix='certmate_bench_') as workdir:
+            env = dict(os.environ, PYTHONPATH=REPO_DIR, CERTMATE_INVENTORY_DB=os.path.join(workdir, 'inventory.db'))
+            proc = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=workdir, env=env,
+                                  capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr, file=sys.stderr)
+                sys.exit(1)
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    def median(key, scale=1):
+        values = [r[key] for r in results if r.get(key) is not None]
+        return statistics.median(values) * scale if values else None
+
+    print(f"Startup benchmark ({runs} runs, median)")
+    print(f"  import app:             {median('import_seconds', 1000):8.1f} ms")
+    print(f"  first request (worker): {median('first_request_seconds', 1000):8.1f} ms")
+    print(f"  max RSS after import:   {median('import_max_rss_kb') / 1024:8.1f} MiB")
+    private = [r['worker']['private'] for r in results if r['worker']['private'] is not None]
+    shared = [r['worker']['shared'] for r in results if r['worker']['shared'] is not None]
+    if private and shared:
+        print(f"  preload worker private: {statistics.median(private) / 1024:8.1f} MiB")
+        print(f"  preload worker shared:  {statistics.median(shared) / 1024:8.1f} MiB")
+
+
+def run_keypool(issuances, key_type):
+    """Compare issuance-path CPU time for key and CSR preparation with and without the key pool"""
+    with tempfile.TemporaryDirectory(prefix='certmate_bench_') as workdir:
+        env = dict(os.environ, PYTHONPATH=REPO_DIR, CERTMATE_WATCHER='off',
+                   CERTMATE_INVENTORY_DB=os.path.join(workdir, 'inventory.db'),
+                   CERTMATE_KEY_POOL_PASSPHRASE=os.environ.get('CERTMATE_KEY_POOL_PASSPHRASE') or 'benchmark')
+        proc = subprocess.run([sys.executable, '-c', KEYPOOL_PROBE, key_type, str(issuances)], cwd=workdir, env=env,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            sys.exit(1)
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print(f"Key pool benchmark ({issuances} issuances, {key_type}, key + CSR on the issuance path)")
+    print(f"  without pool: {result['without_cpu'] / issuances * 1000:8.1f} ms CPU/issuance "
+          f"({result['without_wall'] / issuances * 1000:.1f} ms wall)")
+    print(f"  with pool:    {result['with_cpu'] / issuances * 1000:8.1f} ms CPU/issuance "
+          f"({result['with_wall'] / issuances * 1000:.1f} ms wall)")
+    print(f"  background refill: {result['refill_cpu'] * 1000:.0f} ms CPU in pool processes "
+          f"({result['refill_wall'] * 1000:.0f} ms wall)")
+
+
+def run_memory(certificates):
+    """Measure the memory used to list an inventory of the given size"""
+    with tempfile.TemporaryDirectory(prefix='certmate_bench_') as workdir:
+        env = dict(os.environ, PYTHONPATH=REPO_DIR, CERTMATE_WATCHER='off',
+                   CERTMATE_INVENTORY_DB=os.path.join(workdir, 'inventory.db'))
+        proc = subprocess.run([sys.executable, '-c', MEMORY_PROBE, str(certificates)], cwd=workdir, env=env,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            sys.exit(1)
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print(f"Memory benchmark ({certificates} certificates from the inventory)")
+    for label, key in (('CertificateInfo list', 'records'), ('dict list', 'dicts'),
+                       ('JSON response', 'json'), ('NDJSON response', 'ndjson')):
+        entry = result[key]
+        print(f"  {label + ':':22} {entry['retained'] / 2 ** 20:8.1f} MiB retained, "
+              f"{entry['peak'] / 2 ** 20:8.1f} MiB peak, {entry['seconds'] * 1000:8.0f} ms")
+    print(f"  per certificate:       {result['records']['retained'] / certificates:8.0f} B as CertificateInfo, "
+          f"{result['dicts']['retained'] / certificates:.0f} B as dict")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CertMate benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    startup = subparsers.add_parser('startup', help='Cold start time and per-worker memory')
+    startup.add_argument('--runs', type=int, default=5)
+
+    keypool = subparsers.add_parser('keypool', help='Issuance CPU time with and without the key pool')
+    keypool.add_argument('--issuances', type=int, default=20)
+    keypool.add_argument('--key-type', default='rsa2048',
+                         choices=['rsa2048', 'rsa4096', 'ecdsa-p256', 'ecdsa-p384'])
+
+    memory = subparsers.add_parser('memory', help='Memory used to list a large inventory')
+    memory.add_argument('--certificates', type=int, default=100000)
+
+    args = parser.parse_args()
+    if args.benchmark == 'startup':
+        run_startup(args.runs)
+    elif args.benchmark == 'keypool':
+        run_keypool(args.issuances, args.key_type)
+    elif args.benchmark == 'memory':
+        run_memory(args.certificates)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Import existing certificates into CertMate without re-issuing them
+
+Usage:
+    python certmate_import.py SOURCE [--dns-provider cloudflare] [--workers N]
+                              [--overwrite] [--dry-run]
+
+SOURCE is a certbot configuration directory (/etc/letsencrypt: one lineage
+per live/ directory, with its DNS provider read from renewal/<name>.conf) or
+any tree of directories holding cert.pem and privkey.pem (plus chain.pem and
+fullchain.pem when available). Every certificate is checked against its
+private key and chain; the newest valid certificate of each domain is
+published and domains not configured yet are added to the settings. Run it on
+the CertMate host, with the same CERTMATE_* environment as the server.
+"""
+
+import argparse
+import json
+import logging
+import sys
+
+from app import SUPPORTED_DNS_PROVIDERS, import_certificates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import existing certificates into CertMate')
+    parser.add_argument('source', help='certbot configuration directory or directory tree of PEM files')
+    parser.add_argument('--dns-provider', choices=SUPPORTED_DNS_PROVIDERS,
+                        help='DNS provider for new domains without one in their renewal configuration')
+    parser.add_argument('--workers', type=int, help='Parsing processes (default: one per CPU)')
+    parser.add_argument('--overwrite', action='store_true', help='Replace installed certificates even if they expire later')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be imported without changing anything')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        summary = import_certificates(args.source, args.dns_provider, args.overwrite, args.dry_run, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(json.dumps(summary, indent=2))
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
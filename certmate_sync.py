@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+CertMate sync agent: keeps certificates installed on an edge host up to date
+
+Usage:
+    python certmate_sync.py --domain example.com [--domain ...] [--dest /etc/certmate]
+                            [--reload-command "systemctl reload nginx"]
+                            [--interval 300] [--jitter 60] [--once]
+
+Each domain is installed as DEST/<domain>/{cert,chain,fullchain,privkey}.pem.
+The agent follows the server's change feed and only downloads the domains it
+lists as changed, with If-None-Match so an unchanged certificate costs a 304.
+Servers without the change feed (inventory disabled) are polled with
+conditional downloads only. Files are replaced through a temporary file and a
+rename, and the reload command runs only when a file's content changed.
+
+Server URL and token come from CERTMATE_URL and CERTMATE_TOKEN; domains can
+also be given as a comma separated CERTMATE_SYNC_DOMAINS.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import zipfile
+
+import requests
+
+from api_client_example import CertMateClient, write_file_atomic
+
+logger = logging.getLogger('certmate-sync')
+
+CERTIFICATE_FILES = ('cert.pem', 'chain.pem', 'fullchain.pem', 'privkey.pem')
+CHANGE_FEED_PAGE_SIZE = 500
+MAX_BACKOFF_SECONDS = 3600
+
+
+def load_state(path):
+    """Load the agent state (feed position, ETags), or start from scratch"""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable state file {path}: {e}")
+        state = {}
+    state.setdefault('last_seq', 0)
+    state.setdefault('etags', {})
+    state.setdefault('reload_pending', False)
+    return state
+
+
+def save_state(path, state):
+    """Persist the agent state"""
+    write_file_atomic(path, json.dumps(state, indent=2).encode(), mode=0o600)
+
+
+def changed_domains(client, state, domains):
+    """Return the domains to check and the new feed position, following the change feed when the server has one"""
+    since = state['last_seq']
+    candidates = set()
+    while True:
+        page = client.get_certificate_changes(since, CHANGE_FEED_PAGE_SIZE)
+        if page is None:
+            # No change feed: check every domain with a conditional download
+            return set(domains), since
+        if page['reset']:
+            # First run, or we fell behind the retained feed
+            candidates = set(domains)
+        candidates.update(change['domain'] for change in page['changes'] if change['domain'] in domains)
+        since = page['last_seq']
+        if not page['more']:
+            break
+    # Domains not installed yet are fetched whatever the feed says
+    candidates.update(domain for domain in domains if domain not in state['etags'])
+    return candidates, since
+
+
+def install_bundle(dest, domain, bundle):
+    """Install the files of a certificate ZIP, returning whether any file changed"""
+    domain_dir = os.path.join(dest, domain)
+    os.makedirs(domain_dir, mode=0o755, exist_ok=True)
+    changed = False
+    with zipfile.ZipFile(io.BytesIO(bundle)) as zip_file:
+        names = set(zip_file.namelist())
+        for file_name in CERTIFICATE_FILES:
+            if file_name not in names:
+                continue
+            content = zip_file.read(file_name)
+            path = os.path.join(domain_dir, file_name)
+            try:
+                with open(path, 'rb') as f:
+                    if f.read() == content:
+                        continue
+            except FileNotFoundError:
+                pass
+            write_file_atomic(path, content, mode=0o600 if file_name == 'privkey.pem' else 0o644)
+            changed = True
+    return changed
+
+
+def sync_once(client, state, domains, dest):
+    """Bring the installed certificates up to date, flagging a reload when any changed"""
+    candidates, last_seq = changed_domains(client, state, domains)
+    for domain in sorted(candidates):
+        try:
+            bundle, etag = client.download_certificate_if_changed(domain, state['etags'].get(domain))
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                logger.warning(f"No certificate on the server for {domain}")
+                continue
+            raise
+        if bundle is None:
+            continue
+        if install_bundle(dest, domain, bundle):
+            logger.info(f"Installed new certificate for {domain}")
+            state['reload_pending'] = True
+        state['etags'][domain] = etag
+    # Only move past the changes once every domain in them is installed
+    state['last_seq'] = last_seq
+
+
+def run_reload_command(command):
+    """Run the reload hook, returning whether it succeeded"""
+    logger.info(f"Running reload command: {command}")
+    result = subprocess.run(command, shell=True)
+    if result.returncode != 0:
+        logger.error(f"Reload command failed with exit code {result.returncode}")
+    return result.returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep certificates from a CertMate server installed on this host')
+    parser.add_argument('--url', default=os.getenv('CERTMATE_URL', 'http://localhost:8000'), help='CertMate server URL')
+    parser.add_argument('--token', default=os.getenv('CERTMATE_TOKEN'), help='API bearer token')
+    parser.add_argument('--domain', action='append', default=[], help='Domain to install (repeatable)')
+    parser.add_argument('--dest', default='/etc/certmate', help='Directory to install certificates into')
+    parser.add_argument('--state-file', help='Agent state file (default DEST/.certmate-sync.json)')
+    parser.add_argument('--reload-command', help='Shell command to run after certificates changed')
+    parser.add_argument('--interval', type=int, default=300, help='Seconds between checks')
+    parser.add_argument('--jitter', type=int, default=60, help='Random seconds added to each wait, to spread hosts out')
+    parser.add_argument('--once', action='store_true', help='Check once and exit (for cron)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    domains = set(args.domain)
+    domains.update(domain.strip() for domain in os.getenv('CERTMATE_SYNC_DOMAINS', '').split(',') if domain.strip())
+    if not args.token or not domains:
+        parser.error('an API token (--token or CERTMATE_TOKEN) and at least one domain are required')
+
+    os.makedirs(args.dest, mode=0o755, exist_ok=True)
+    state_file = args.state_file or os.path.join(args.dest, '.certmate-sync.json')
+    state = load_state(state_file)
+    client = CertMateClient(args.url, args.token)
+
+    failures = 0
+    if not args.once:
+        # Hosts started together (fleet rollout, reboot) should not poll together
+        time.sleep(random.uniform(0, args.jitter))
+    while True:
+        try:
+            sync_once(client, state, domains, args.dest)
+            failures = 0
+        except (requests.RequestException, ValueError, OSError, zipfile.BadZipFile) as e:
+            failures += 1
+            logger.error(f"Sync failed: {e}")
+        # Certificates installed before a failure still get the reload
+        if state['reload_pending'] and args.reload_command:
+            state['reload_pending'] = not run_reload_command(args.reload_command)
+        save_state(state_file, state)
+        if args.once:
+            return 1 if failures else 0
+
+        delay = args.interval if not failures else min(args.interval * 2 ** (failures - 1), MAX_BACKOFF_SECONDS)
+        time.sleep(delay + random.uniform(0, args.jitter))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
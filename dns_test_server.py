@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Local DNS server for testing CertMate's order preflight checks
+
+Usage:
+    python dns_test_server.py --zones zones.json [--port 5353]
+
+Answers UDP queries from a JSON file of records:
+
+    {
+      "example.com": {
+        "SOA": ["ns1.example.com. hostmaster.example.com. 1 3600 600 86400 60"],
+        "NS": ["ada.ns.cloudflare.com.", "bob.ns.cloudflare.com."],
+        "CAA": ["0 issue \"letsencrypt.org\""]
+      },
+      "_acme-challenge.www.example.com": {"CNAME": ["www.acme.example.net."]}
+    }
+
+Names with an SOA record are zone apexes; missing names are answered with
+NXDOMAIN and the SOA of the enclosing zone, so that negative answers are
+cached as by a real server. Every query is printed, to see what the
+preflight's DNS cache saves. Point CertMate at it with
+"preflight": {"nameservers": ["127.0.0.1:5353"]} in settings.json. This is a
+stand-in for tests only.
+"""
+
+import argparse
+import json
+import socketserver
+
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+RECORD_TTL = 300
+
+
+def load_zones(path):
+    """Load the records file as {name: {rdtype: rrset}}"""
+    with open(path) as f:
+        data = json.load(f)
+    records = {}
+    for name, types in data.items():
+        owner = dns.name.from_text(name)
+        records[owner] = {
+            dns.rdatatype.from_text(rdtype): dns.rrset.from_text_list(owner, RECORD_TTL, 'IN', rdtype, values)
+            for rdtype, values in types.items()
+        }
+    return records
+
+
+def enclosing_soa(records, name):
+    """Return the SOA rrset of the zone holding name, or None"""
+    while True:
+        soa = records.get(name, {}).get(dns.rdatatype.SOA)
+        if soa is not None or name == dns.name.root:
+            return soa
+        name = name.parent()
+
+
+def answer(records, query):
+    """Build the response to a query"""
+    response = dns.message.make_response(query)
+    response.flags |= 0x0400  # authoritative
+    question = query.question[0]
+    name, rdtype = question.name, question.rdtype
+
+    # Follow CNAMEs inside the records file
+    for _ in range(8):
+        types = records.get(name, {})
+        if rdtype in types:
+            response.answer.append(types[rdtype])
+            return response
+        cname = types.get(dns.rdatatype.CNAME)
+        if cname is None:
+            break
+        response.answer.append(cname)
+        name = cname[0].target
+
+    exists = name in records or any(owner.is_subdomain(name) for owner in records)
+    if not exists:
+        response.set_rcode(dns.rcode.NXDOMAIN)
+    soa = enclosing_soa(records, name)
+    if soa is not None:
+        response.authority.append(soa)
+    return response
+
+
+def make_handler(records):
+    """Build the UDP request handler for the given records"""
+
+    class DNSHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            data, sock = self.request
+            try:
+                query = dns.message.from_wire(data)
+            except Exception:
+                return
+            question = query.question[0]
+            print(f"{question.name} {dns.rdatatype.to_text(question.rdtype)}", flush=True)
+            sock.sendto(answer(records, query).to_wire(), self.client_address)
+
+    return DNSHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local DNS server for preflight tests')
+    parser.add_argument('--zones', required=True, help='JSON file of records')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5353)
+    args = parser.parse_args()
+
+    server = socketserver.ThreadingUDPServer((args.host, args.port), make_handler(load_zones(args.zones)))
+    print(f"DNS server listening on {args.host}:{args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+# Gunicorn configuration for CertMate
+# Picked up automatically when gunicorn is started from the application directory.
+
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# Import the application once in the master so workers share its memory
+# pages copy-on-write instead of each importing it again.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def post_worker_init(worker):
+    """Start background services (scheduler, inventory migration) in the worker"""
+    from app import start_background_services
+    start_background_services()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Local OCSP responder for testing CertMate's OCSP stapling support
+
+Usage:
+    python ocsp_responder.py --issuer-cert ca.pem --issuer-key ca-key.pem [--port 8888]
+                             [--validity 3600] [--revoked SERIAL ...]
+
+Answers every request for a certificate of the given issuer with a signed
+"good" response (or "revoked" for the listed hex serials). Point CertMate at
+it with "ocsp_responder_url": "http://127.0.0.1:8888" in settings.json.
+This is a stand-in for tests only, never for production use. Requires
+cryptography 43 or newer.
+"""
+
+import argparse
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.x509 import ocsp
+
+
+def make_handler(issuer_cert, issuer_key, validity, revoked):
+    """Build the request handler class for the given issuer"""
+
+    class OCSPHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                request = ocsp.load_der_ocsp_request(body)
+            except ValueError:
+                self.send_reply(ocsp.OCSPResponseBuilder.build_unsuccessful(
+                    ocsp.OCSPResponseStatus.MALFORMED_REQUEST))
+                return
+
+            now = datetime.datetime.now(datetime.timezone.utc)
+            serial = format(request.serial_number, 'x')
+            status = ocsp.OCSPCertStatus.REVOKED if serial in revoked else ocsp.OCSPCertStatus.GOOD
+            builder = ocsp.OCSPResponseBuilder().add_response_by_hash(
+                issuer_name_hash=request.issuer_name_hash,
+                issuer_key_hash=request.issuer_key_hash,
+                serial_number=request.serial_number,
+                algorithm=request.hash_algorithm,
+                cert_status=status,
+                this_update=now,
+                next_update=now + datetime.timedelta(seconds=validity),
+                revocation_time=now if status == ocsp.OCSPCertStatus.REVOKED else None,
+                revocation_reason=None
+            ).responder_id(ocsp.OCSPResponderEncoding.HASH, issuer_cert)
+            self.send_reply(builder.sign(issuer_key, hashes.SHA256()))
+
+        def send_reply(self, response):
+            data = response.public_bytes(serialization.Encoding.DER)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/ocsp-response')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return OCSPHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local OCSP responder for tests')
+    parser.add_argument('--issuer-cert', required=True, help='PEM certificate of the issuing CA')
+    parser.add_argument('--issuer-key', required=True, help='PEM private key of the issuing CA')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--validity', type=int, default=3600, help='Seconds until nextUpdate')
+    parser.add_argument('--revoked', nargs='*', default=[], help='Hex serial numbers to report as revoked')
+    args = parser.parse_args()
+
+    with open(args.issuer_cert, 'rb') as f:
+        issuer_cert = x509.load_pem_x509_certificate(f.read())
+    with open(args.issuer_key, 'rb') as f:
+        issuer_key = serialization.load_pem_private_key(f.read(), None)
+
+    handler = make_handler(issuer_cert, issuer_key, args.validity, {serial.lower() for serial in args.revoked})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"OCSP responder listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
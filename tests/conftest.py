@@ -0,0 +1,109 @@
+"""
+Shared fixtures for CertMate's tests
+
+app keeps its data relative to the working directory, so it is imported
+from an empty temporary directory and never touches a real installation.
+The local stand-ins (dns_test_server.py, ocsp_responder.py,
+webhook_receiver.py) are started as subprocesses on free ports.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def pytest_configure(config):
+    """Prepare the environment app is imported into (by the test modules)"""
+    os.environ.setdefault('CERTMATE_WATCHER', 'off')
+    os.environ.setdefault('API_BEARER_TOKEN', 'certmate-tests-' + 'x' * 32)
+    os.chdir(tempfile.mkdtemp(prefix='certmate_tests_'))
+    sys.path.insert(0, str(REPO_DIR))
+
+
+def free_port(kind=socket.SOCK_STREAM):
+    """Return a local port that is currently free"""
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def stand_in(tmp_path):
+    """Start a stand-in server script, returning its port; stopped after the test
+
+    Usage: port = stand_in('webhook_receiver.py', '--secret', 's')
+    The script's output is kept in stand_in.output(port).
+    """
+    processes = {}
+
+    def start(script, *args, udp=False):
+        port = free_port(socket.SOCK_DGRAM if udp else socket.SOCK_STREAM)
+        log_file = tmp_path / f"{script}.{port}.log"
+        with open(log_file, 'w') as log:
+            process = subprocess.Popen([sys.executable, '-u', str(REPO_DIR / script), *args, '--port', str(port)],
+                                       stdout=log, stderr=subprocess.STDOUT)
+        processes[port] = (process, log_file)
+        deadline = time.time() + 10
+        while 'listening on' not in log_file.read_text():
+            if process.poll() is not None or time.time() > deadline:
+                raise RuntimeError(f"{script} did not start: {log_file.read_text()}")
+            time.sleep(0.05)
+        return port
+
+    start.output = lambda port: processes[port][1].read_text()
+    yield start
+    for process, _ in processes.values():
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@pytest.fixture
+def settings():
+    """Update settings.json for one test, restoring it afterwards
+
+    Usage: settings(webhooks=[...]); returns the settings as saved.
+    """
+    import app as certmate
+
+    original = certmate.SETTINGS_FILE.read_bytes() if certmate.SETTINGS_FILE.exists() else None
+
+    def update(**changes):
+        current = certmate.load_settings()
+        current.update(changes)
+        assert certmate.save_settings(current)
+        # The cache is keyed by mtime and size, which a quick rewrite may not change
+        certmate._settings_cache.clear()
+        return current
+
+    yield update
+    if original is None:
+        certmate.SETTINGS_FILE.unlink(missing_ok=True)
+    else:
+        certmate.SETTINGS_FILE.write_bytes(original)
+    certmate._settings_cache.clear()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Flask test client that does not start the background services"""
+    import app as certmate
+
+    monkeypatch.setattr(certmate, '_background_pid', os.getpid())
+    monkeypatch.setattr(certmate, '_background_retry_at', float('inf'))
+    return certmate.app.test_client()
+
+
+@pytest.fixture
+def auth_headers():
+    """Authorization header with the admin token"""
+    import app as certmate
+
+    return {'Authorization': f"Bearer {certmate.load_settings_cached()['api_bearer_token']}"}
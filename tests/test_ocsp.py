@@ -0,0 +1,277 @@
+"""OCSP stapling against the local OCSP responder (ocsp_responder.py)"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.x509 import ocsp
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+import app as certmate
+
+CA_NAME = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'CertMate Test CA')])
+
+
+def make_certificate(subject, key, issuer_key, issuer_name=CA_NAME, ca=False, usages=None, days=30):
+    now = datetime.now(timezone.utc)
+    builder = (x509.CertificateBuilder()
+               .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)]) if isinstance(subject, str) else subject)
+               .issuer_name(issuer_name)
+               .public_key(key.public_key())
+               .serial_number(x509.random_serial_number())
+               .not_valid_before(now - timedelta(days=1))
+               .not_valid_after(now + timedelta(days=days)))
+    if ca:
+        builder = builder.add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+    if usages:
+        builder = builder.add_extension(x509.ExtendedKeyUsage(usages), critical=False)
+    return builder.sign(issuer_key, hashes.SHA256())
+
+
+def pem(certificate):
+    return certificate.public_bytes(serialization.Encoding.PEM)
+
+
+class Issuer:
+    """A test CA that issues certificates into CERT_DIR"""
+
+    def __init__(self, directory):
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.cert = make_certificate(CA_NAME, self.key, self.key, ca=True)
+        self.cert_file = directory / 'ca.pem'
+        self.key_file = directory / 'ca-key.pem'
+        self.cert_file.write_bytes(pem(self.cert))
+        self.key_file.write_bytes(self.key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                                         serialization.NoEncryption()))
+
+    def issue(self, domain):
+        """Install a new certificate for domain, as certbot would, returning it"""
+        key = ec.generate_private_key(ec.SECP256R1())
+        cert = make_certificate(domain, key, self.key)
+        domain_dir = certmate.CERT_DIR / domain
+        domain_dir.mkdir(parents=True, exist_ok=True)
+        (domain_dir / 'cert.pem').write_bytes(pem(cert))
+        (domain_dir / 'chain.pem').write_bytes(pem(self.cert))
+        (domain_dir / 'fullchain.pem').write_bytes(pem(cert) + pem(self.cert))
+        (domain_dir / 'privkey.pem').write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                                                   serialization.NoEncryption()))
+        return cert
+
+    def response(self, cert, signer=None, signer_key=None, certificates=None, validity=timedelta(hours=1),
+                 issuer_name_hash=None):
+        """Build a good OCSP response for cert, signed by the CA unless a signer is given"""
+        this_update = datetime.now(timezone.utc) - timedelta(minutes=1)
+        request = ocsp.OCSPRequestBuilder().add_certificate(cert, self.cert, hashes.SHA1()).build()
+        builder = (ocsp.OCSPResponseBuilder()
+                   .add_response_by_hash(issuer_name_hash=issuer_name_hash or request.issuer_name_hash,
+                                         issuer_key_hash=request.issuer_key_hash,
+                                         serial_number=cert.serial_number, algorithm=hashes.SHA1(),
+                                         cert_status=ocsp.OCSPCertStatus.GOOD, this_update=this_update,
+                                         next_update=this_update + validity,
+                                         revocation_time=None, revocation_reason=None)
+                   .responder_id(ocsp.OCSPResponderEncoding.HASH, signer or self.cert))
+        if certificates:
+            builder = builder.certificates(certificates)
+        return builder.sign(signer_key or self.key, hashes.SHA256())
+
+
+class StaticSession:
+    """Stands in for a requests session that always answers with the same DER"""
+
+    def __init__(self, response):
+        self.content = response.public_bytes(serialization.Encoding.DER)
+
+    def post(self, *args, **kwargs):
+        return self
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def issuer(tmp_path):
+    return Issuer(tmp_path)
+
+
+@pytest.fixture
+def responder(issuer, stand_in, settings):
+    """Start the OCSP responder for the test CA and point CertMate at it
+
+    Returns a function starting it with extra arguments (e.g. --validity),
+    optionally for another CA.
+    """
+    def start(*args, ca=issuer):
+        port = stand_in('ocsp_responder.py', '--issuer-cert', str(ca.cert_file), '--issuer-key', str(ca.key_file), *args)
+        settings(ocsp_responder_url=f"http://127.0.0.1:{port}")
+        return port
+
+    return start
+
+
+def test_fetch_stores_a_good_response(issuer, responder):
+    responder()
+    cert = issuer.issue('good.test')
+    assert certmate.fetch_ocsp_response('good.test') == (True, "OCSP status GOOD for good.test")
+    der, response = certmate.load_ocsp_response('good.test')
+    assert der == (certmate.CERT_DIR / 'good.test' / certmate.OCSP_RESPONSE_FILE).read_bytes()
+    assert response.serial_number == cert.serial_number
+
+
+def test_fetch_stores_a_revoked_response(issuer, responder):
+    cert = issuer.issue('revoked.test')
+    responder('--revoked', format(cert.serial_number, 'x'))
+    assert certmate.fetch_ocsp_response('revoked.test') == (True, "OCSP status REVOKED for revoked.test")
+
+
+def test_fetch_rejects_a_responder_of_another_ca(issuer, responder, tmp_path):
+    issuer.issue('other.test')
+    # Same name, other key: the responder answers with the right hashes but signs with its own key
+    impostor_dir = tmp_path / 'impostor'
+    impostor_dir.mkdir()
+    responder(ca=Issuer(impostor_dir))
+    success, message = certmate.fetch_ocsp_response('other.test')
+    assert success is False
+    assert message == ("OCSP response for other.test rejected: "
+                       "it is not signed by the issuer and includes no responder certificate")
+    assert certmate.load_ocsp_response('other.test') == (None, None)
+
+
+def test_fetch_rejects_a_response_for_another_serial(issuer, settings):
+    settings(ocsp_responder_url='http://127.0.0.1:9/')
+    other = issuer.issue('serial.test')
+    issuer.issue('serial.test')
+    success, message = certmate.fetch_ocsp_response('serial.test', StaticSession(issuer.response(other)))
+    assert (success, message) == (False, "OCSP response for serial.test is for another certificate")
+
+
+def test_fetch_rejects_a_response_for_another_issuer_name(issuer, settings):
+    settings(ocsp_responder_url='http://127.0.0.1:9/')
+    cert = issuer.issue('issuer.test')
+    response = issuer.response(cert, issuer_name_hash=b'\0' * 20)
+    success, message = certmate.fetch_ocsp_response('issuer.test', StaticSession(response))
+    assert (success, message) == (False, "OCSP response for issuer.test is for another certificate")
+
+
+def test_fetch_rejects_an_expired_response(issuer, settings):
+    settings(ocsp_responder_url='http://127.0.0.1:9/')
+    cert = issuer.issue('expired.test')
+    # Signed a minute ago, valid for 30 seconds
+    response = issuer.response(cert, validity=timedelta(seconds=30))
+    success, message = certmate.fetch_ocsp_response('expired.test', StaticSession(response))
+    assert (success, message) == (False, "OCSP response for expired.test is not currently valid")
+
+
+def test_verify_signature_of_the_issuer(issuer):
+    cert = issuer.issue('sig.test')
+    assert certmate.verify_ocsp_signature(issuer.response(cert), issuer.cert) is None
+
+
+def test_verify_signature_of_a_delegated_responder(issuer):
+    cert = issuer.issue('sig.test')
+    key = ec.generate_private_key(ec.SECP256R1())
+    delegate = make_certificate('OCSP responder', key, issuer.key, usages=[ExtendedKeyUsageOID.OCSP_SIGNING])
+    response = issuer.response(cert, signer=delegate, signer_key=key, certificates=[delegate])
+    assert certmate.verify_ocsp_signature(response, issuer.cert) is None
+
+
+def test_verify_rejects_a_delegate_without_ocsp_signing(issuer):
+    cert = issuer.issue('sig.test')
+    key = ec.generate_private_key(ec.SECP256R1())
+    delegate = make_certificate('OCSP responder', key, issuer.key, usages=[ExtendedKeyUsageOID.SERVER_AUTH])
+    response = issuer.response(cert, signer=delegate, signer_key=key, certificates=[delegate])
+    assert (certmate.verify_ocsp_signature(response, issuer.cert)
+            == "its responder certificate is not issued by the issuer for OCSP signing")
+
+
+def test_verify_rejects_a_delegate_not_issued_by_the_issuer(issuer):
+    cert = issuer.issue('sig.test')
+    key = ec.generate_private_key(ec.SECP256R1())
+    delegate = make_certificate('OCSP responder', key, key, usages=[ExtendedKeyUsageOID.OCSP_SIGNING])
+    response = issuer.response(cert, signer=delegate, signer_key=key, certificates=[delegate])
+    assert (certmate.verify_ocsp_signature(response, issuer.cert)
+            == "its responder certificate is not issued by the issuer for OCSP signing")
+
+
+def test_verify_rejects_a_forged_signature(issuer):
+    cert = issuer.issue('sig.test')
+    # Without responder certificates the signature is the end of the response
+    der = bytearray(issuer.response(cert).public_bytes(serialization.Encoding.DER))
+    der[-1] ^= 1
+    response = ocsp.load_der_ocsp_response(bytes(der))
+    assert certmate.verify_ocsp_signature(response, issuer.cert) == "its signature does not verify"
+
+
+def test_refresh_due_at_half_validity(issuer):
+    cert = issuer.issue('due.test')
+    serial = format(cert.serial_number, 'x')
+    response = issuer.response(cert, validity=timedelta(hours=2))
+    this_update, next_update = certmate.ocsp_validity(response)
+    assert next_update - this_update == timedelta(hours=2)
+
+    assert certmate.ocsp_refresh_due(response, serial, now=this_update + timedelta(minutes=59)) is False
+    assert certmate.ocsp_refresh_due(response, serial, now=this_update + timedelta(minutes=60)) is True
+    assert certmate.ocsp_refresh_due(response, 'ab' + serial, now=this_update) is True
+    assert certmate.ocsp_refresh_due(None, serial) is True
+
+
+def test_refresh_fetches_only_due_responses(issuer, responder):
+    # Half of a 4 second validity passes after 2 seconds
+    responder('--validity', '4')
+    issuer.issue('refresh.test')
+    certmate.refresh_ocsp_responses(['refresh.test'])
+    first, _ = certmate.load_ocsp_response('refresh.test')
+    assert first is not None
+
+    certmate.refresh_ocsp_responses(['refresh.test'])
+    assert certmate.load_ocsp_response('refresh.test')[0] == first
+
+    time.sleep(2.2)
+    certmate.refresh_ocsp_responses(['refresh.test'])
+    assert certmate.load_ocsp_response('refresh.test')[0] != first
+
+
+def test_refresh_follows_a_new_certificate(issuer, responder):
+    responder()
+    issuer.issue('renewed.test')
+    certmate.refresh_ocsp_responses(['renewed.test'])
+    cert = issuer.issue('renewed.test')
+    certmate.refresh_ocsp_responses(['renewed.test'])
+    assert certmate.load_ocsp_response('renewed.test')[1].serial_number == cert.serial_number
+
+
+def test_route_serves_the_response_with_etag(issuer, responder, client, auth_headers):
+    responder()
+    issuer.issue('route.test')
+    assert client.get('/route.test/tls/ocsp', headers=auth_headers).status_code == 404
+
+    certmate.fetch_ocsp_response('route.test')
+    reply = client.get('/route.test/tls/ocsp', headers=auth_headers)
+    assert reply.status_code == 200
+    assert reply.mimetype == 'application/ocsp-response'
+    assert reply.data == certmate.load_ocsp_response('route.test')[0]
+    assert 0 < reply.cache_control.max_age <= 3600
+    etag = reply.headers['ETag']
+
+    reply = client.get('/route.test/tls/ocsp', headers={**auth_headers, 'If-None-Match': etag})
+    assert reply.status_code == 304
+    assert reply.data == b''
+
+    reply = client.get('/route.test/tls/ocsp', headers={**auth_headers, 'If-None-Match': '"stale"'})
+    assert reply.status_code == 200
+
+
+def test_route_hides_the_response_of_a_replaced_certificate(issuer, responder, client, auth_headers):
+    responder()
+    issuer.issue('replaced.test')
+    certmate.fetch_ocsp_response('replaced.test')
+    issuer.issue('replaced.test')
+    reply = client.get('/replaced.test/tls/ocsp', headers=auth_headers)
+    assert reply.status_code == 404
+    assert reply.json['error'] == 'OCSP response not yet fetched for the current certificate'
+
+
+def test_route_requires_auth(client):
+    assert client.get('/route.test/tls/ocsp').status_code == 401
@@ -0,0 +1,160 @@
+"""Order preflight checks against the local DNS stand-in (dns_test_server.py)"""
+
+import json
+
+import pytest
+
+pytest.importorskip('dns.resolver')
+
+import app as certmate  # noqa: E402
+
+CLOUDFLARE_NS = ["ada.ns.cloudflare.com.", "bob.ns.cloudflare.com."]
+OTHER_NS = ["ns1.example-dns.net.", "ns2.example-dns.net."]
+
+
+def zone(name, nameservers, caa=None):
+    records = {
+        'SOA': [f"ns1.{name}. hostmaster.{name}. 1 3600 600 86400 60"],
+        'NS': nameservers
+    }
+    if caa:
+        records['CAA'] = caa
+    return records
+
+
+ZONES = {
+    # Served by Cloudflare, CAA allows Let's Encrypt
+    'ok.test': zone('ok.test', CLOUDFLARE_NS, ['0 issue "letsencrypt.org"']),
+    # Only another CA may issue
+    'caa.test': zone('caa.test', CLOUDFLARE_NS, ['0 issue "digicert.com"']),
+    # Let's Encrypt may issue, but nobody may issue wildcards
+    'nowild.test': zone('nowild.test', CLOUDFLARE_NS, ['0 issue "letsencrypt.org"', '0 issuewild ";"']),
+    # Wildcards have their own issuer list
+    'wild.test': zone('wild.test', CLOUDFLARE_NS, ['0 issue "digicert.com"', '0 issuewild "letsencrypt.org"']),
+    # Not served by Cloudflare...
+    'other.test': zone('other.test', OTHER_NS),
+    # ...except for a delegated subzone
+    'sub.other.test': zone('sub.other.test', CLOUDFLARE_NS),
+    # The challenge record is delegated to a Cloudflare zone with a CNAME
+    'cname.test': zone('cname.test', OTHER_NS),
+    '_acme-challenge.cname.test': {'CNAME': ["cname.test.acme.ok.test."]},
+    'cname.test.acme.ok.test': {'TXT': ['"placeholder"']},
+}
+
+
+@pytest.fixture
+def dns_server(tmp_path, stand_in, settings):
+    """Serve ZONES and point the preflight at them, returning the server's port"""
+    zones_file = tmp_path / 'zones.json'
+    zones_file.write_text(json.dumps(ZONES))
+    port = stand_in('dns_test_server.py', '--zones', str(zones_file), udp=True)
+    settings(dns_provider='cloudflare', preflight={'nameservers': [f"127.0.0.1:{port}"], 'timeout': 5})
+    return port
+
+
+def queries(stand_in, port):
+    """Return the queries the DNS stand-in has answered"""
+    return [line for line in stand_in.output(port).splitlines() if 'listening on' not in line]
+
+
+def test_preflight_passes(dns_server):
+    result = certmate.preflight_domain('ok.test')
+    assert result['ok'] is True
+    assert result['checks']['caa']['status'] == 'pass'
+    assert result['checks']['delegation']['status'] == 'pass'
+    assert result['checks']['delegation']['zone'] == 'ok.test'
+
+
+def test_caa_issue_forbids_the_ca(dns_server):
+    result = certmate.preflight_domain('caa.test')
+    assert result['ok'] is False
+    assert result['checks']['caa']['status'] == 'fail'
+    assert result['checks']['caa']['message'] == "CAA records only allow digicert.com to issue for caa.test"
+    assert certmate.preflight_failure_message(result) == result['checks']['caa']['message']
+
+
+def test_caa_issuewild_forbids_wildcards(dns_server):
+    result = certmate.preflight_domain('nowild.test')
+    assert result['ok'] is False
+    assert result['checks']['caa']['message'] == "CAA records forbid every CA to issue for *.nowild.test"
+
+
+def test_caa_issuewild_overrides_issue_for_wildcards(dns_server):
+    # issue forbids Let's Encrypt for the domain itself, issuewild allows it for *.wild.test
+    result = certmate.preflight_domain('wild.test')
+    assert result['checks']['caa']['message'] == "CAA records only allow digicert.com to issue for wild.test"
+
+
+def test_caa_is_inherited_from_the_parent(dns_server):
+    result = certmate.preflight_domain('www.caa.test')
+    assert result['checks']['caa']['status'] == 'fail'
+    assert result['checks']['caa']['message'].endswith("to issue for www.caa.test")
+
+
+def test_caa_identities_of_other_accounts(dns_server, settings):
+    settings(acme_accounts=[{'name': 'digicert', 'server': 'https://acme.digicert.test/v2/acme/directory',
+                             'caa_identities': ['digicert.com']}])
+    result = certmate.preflight_domain('caa.test')
+    assert result['checks']['caa'] == {'status': 'pass', 'message': "CAA allows ACME account(s) digicert",
+                                       'accounts': ['digicert']}
+
+
+def test_zone_not_delegated_to_the_provider(dns_server):
+    result = certmate.preflight_domain('www.other.test')
+    assert result['ok'] is False
+    delegation = result['checks']['delegation']
+    assert delegation['status'] == 'fail'
+    assert delegation['zone'] == 'other.test'
+    assert delegation['nameservers'] == ['ns1.example-dns.net', 'ns2.example-dns.net']
+    assert delegation['message'] == ("Zone other.test is served by ns1.example-dns.net, ns2.example-dns.net, "
+                                     "not by cloudflare")
+
+
+def test_delegated_subzone(dns_server):
+    # zone_for_name stops at the zone cut of sub.other.test
+    result = certmate.preflight_domain('www.sub.other.test')
+    assert result['checks']['delegation']['status'] == 'pass'
+    assert result['checks']['delegation']['zone'] == 'sub.other.test'
+
+
+def test_challenge_delegated_with_cname(dns_server):
+    result = certmate.preflight_domain('cname.test')
+    assert result['checks']['delegation']['status'] == 'pass'
+    assert result['checks']['delegation']['zone'] == 'ok.test'
+
+
+def test_provider_nameservers_setting(dns_server, settings):
+    result = certmate.preflight_domain('other.test', dns_provider='powerdns')
+    assert result['checks']['delegation']['status'] == 'skipped'
+
+    settings(preflight={'nameservers': certmate.get_preflight_settings()['nameservers'],
+                        'provider_nameservers': {'powerdns': ['example-dns.net']}})
+    result = certmate.preflight_domain('other.test', dns_provider='powerdns')
+    assert result['checks']['delegation']['status'] == 'pass'
+
+
+def test_batch_results_in_order(dns_server):
+    domains = ['ok.test', 'caa.test', 'www.other.test', 'www.sub.other.test', 'not a domain']
+    results = certmate.preflight_domains(domains)
+    assert [result['ok'] for result in results] == [True, False, False, True, False]
+    assert [result['domain'] for result in results[:4]] == domains[:4]
+
+
+def test_batch_answers_are_cached(dns_server, stand_in):
+    domains = [f"host{index}.ok.test" for index in range(20)]
+    assert all(result['ok'] for result in certmate.preflight_domains(domains))
+    first_run = len(queries(stand_in, dns_server))
+    # The shared ok.test lookups (CAA, SOA, NS) are made once, not once per domain
+    assert first_run < 10 * len(domains)
+    assert sum(line == 'ok.test. NS' for line in queries(stand_in, dns_server)) == 1
+
+    assert all(result['ok'] for result in certmate.preflight_domains(domains))
+    assert len(queries(stand_in, dns_server)) == first_run
+
+
+def test_unreachable_nameserver_skips_checks(settings):
+    settings(preflight={'nameservers': ['127.0.0.1:9'], 'timeout': 1})
+    result = certmate.preflight_domain('ok.test')
+    assert result['ok'] is True
+    assert result['checks']['caa']['status'] == 'skipped'
+    assert result['checks']['caa']['message'].startswith('DNS lookup failed')
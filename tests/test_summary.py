@@ -0,0 +1,135 @@
+"""Certificate summary counters kept by inventory triggers"""
+
+import random
+import sqlite3
+import time
+
+import pytest
+
+import app as certmate
+
+PROVIDERS = ['cloudflare', 'route53', 'digitalocean', None]
+KEYS = [('rsa', 2048), ('rsa', 4096), ('ecdsa', 256), ('ecdsa', 384)]
+NOW = time.time()
+
+
+@pytest.fixture
+def inventory(tmp_path, monkeypatch):
+    """Use an inventory database of this test, returning its path"""
+    path = tmp_path / 'inventory.db'
+    monkeypatch.setattr(certmate, 'INVENTORY_ENABLED', True)
+    monkeypatch.setattr(certmate, 'INVENTORY_DB_FILE', path)
+    monkeypatch.setattr(certmate._inventory_local, 'conn', None, raising=False)
+    yield path
+    certmate._inventory_local.conn.close()
+
+
+def certificate_columns(rng):
+    """Random (expires_at, not_before, key_type, key_size, chain_size), or Nones for a missing certificate"""
+    if rng.random() < 0.15:
+        return None, None, None, None, None
+    # Half past an hour, so that no expiry is within seconds of a bucket cutoff
+    expires_at = (int(NOW // 3600) + rng.randint(-10 * 24, 60 * 24)) * 3600 + 1800
+    key_type, key_size = rng.choice(KEYS)
+    return expires_at, expires_at - 90 * 86400, key_type, key_size, rng.choice([None, 2500, 3100, 4200])
+
+
+def insert(conn, rng, domain):
+    conn.execute("INSERT OR IGNORE INTO domains (domain, dns_provider, expires_at, not_before, key_type, key_size, "
+                 "chain_size, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                 (domain, rng.choice(PROVIDERS), *certificate_columns(rng), time.time()))
+
+
+def mutate(conn, rng, domains):
+    """Apply one random insert, update or delete to the domains table"""
+    domain = rng.choice(domains)
+    operation = rng.random()
+    if operation < 0.3:
+        insert(conn, rng, domain)
+    elif operation < 0.55:
+        # A certificate issued, renewed or removed
+        conn.execute("UPDATE domains SET expires_at = ?, not_before = ?, key_type = ?, key_size = ?, chain_size = ?, "
+                     "updated_at = ? WHERE domain = ?", (*certificate_columns(rng), time.time(), domain))
+    elif operation < 0.7:
+        # Settings changes go through the upsert, which only touches changed rows
+        conn.execute(certmate.INVENTORY_UPSERT_DOMAIN, (domain, rng.choice(PROVIDERS), None, time.time()))
+    elif operation < 0.8:
+        # Columns outside the summary leave the counters alone
+        conn.execute("UPDATE domains SET serial = ?, updated_at = ? WHERE domain = ?",
+                     (format(rng.getrandbits(64), 'x'), time.time(), domain))
+    else:
+        conn.execute("DELETE FROM domains WHERE domain = ?", (domain,))
+
+
+def scanned_summary(monkeypatch):
+    """The summary built the way it is without the inventory: from every certificate"""
+    rows = certmate.get_inventory_db().execute(
+        f"SELECT {certmate.INVENTORY_INFO_COLUMNS} FROM domains ORDER BY {certmate.INVENTORY_EXPIRY_KEY}, domain")
+    certificates = [certmate.inventory_row_to_info(row) for row in rows]
+    with monkeypatch.context() as patch:
+        patch.setattr(certmate, 'INVENTORY_ENABLED', False)
+        patch.setattr(certmate, 'query_certificates', lambda **kwargs: (certificates, None))
+        return certmate.build_certificate_summary(soonest=5)
+
+
+def assert_summaries_match(monkeypatch):
+    counted = certmate.build_certificate_summary(soonest=5)
+    scanned = scanned_summary(monkeypatch)
+    for summary in (counted, scanned):
+        del summary['generated_at']
+    assert counted == scanned
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_counters_match_a_full_scan(inventory, monkeypatch, seed):
+    rng = random.Random(seed)
+    domains = [f"host{index}.summary.test" for index in range(300)]
+    conn = certmate.get_inventory_db()
+    for domain in domains[:200]:
+        insert(conn, rng, domain)
+    assert_summaries_match(monkeypatch)
+
+    for _ in range(10):
+        conn.execute("BEGIN")
+        for _ in range(100):
+            mutate(conn, rng, domains)
+        conn.execute("COMMIT")
+        assert_summaries_match(monkeypatch)
+
+    assert conn.execute("SELECT COUNT(*) FROM expiry_hours WHERE count <= 0").fetchone()[0] == 0
+
+
+def test_rolled_back_changes_leave_the_counters(inventory):
+    rng = random.Random(4)
+    domains = [f"host{index}.summary.test" for index in range(50)]
+    conn = certmate.get_inventory_db()
+    for domain in domains:
+        insert(conn, rng, domain)
+    before = certmate.build_certificate_summary(soonest=0)
+
+    conn.execute("BEGIN")
+    for _ in range(100):
+        mutate(conn, rng, domains)
+    conn.execute("ROLLBACK")
+    after = certmate.build_certificate_summary(soonest=0)
+    assert {**before, 'generated_at': None} == {**after, 'generated_at': None}
+
+
+def test_counters_are_filled_for_an_existing_inventory(inventory, monkeypatch):
+    # An inventory created before the counters existed
+    rng = random.Random(5)
+    conn = sqlite3.connect(str(inventory), isolation_level=None)
+    for statement in certmate.INVENTORY_SCHEMA:
+        conn.execute(statement)
+    for index in range(200):
+        insert(conn, rng, f"host{index}.summary.test")
+    conn.close()
+
+    certmate.get_inventory_db()
+    assert_summaries_match(monkeypatch)
+
+    # Filled once: a second connection does not count the rows again
+    certmate._inventory_local.conn.close()
+    certmate._inventory_local.conn = None
+    certmate.get_inventory_db()
+    assert_summaries_match(monkeypatch)
@@ -0,0 +1,225 @@
+"""Webhook delivery against the local webhook receiver (webhook_receiver.py)"""
+
+import json
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+import app as certmate
+
+SECRET = 'webhook-test-secret-0123456789'
+
+
+@pytest.fixture(autouse=True)
+def clean_webhooks():
+    """Leave an empty outbox and a stopped dispatcher after every test"""
+    yield
+    state = certmate._webhook_dispatcher
+    certmate.stop_webhook_dispatcher()
+    if state['thread'] is not None:
+        state['thread'].join(timeout=30)
+        state['thread'] = None
+    state['next_attempt'].clear()
+    shutil.rmtree(certmate.WEBHOOK_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def receiver(stand_in, settings):
+    """Start a receiver and configure a webhook for it
+
+    Returns a function taking the webhook name, the receiver's arguments and
+    the secret CertMate signs with; it returns the receiver's port.
+    """
+    webhooks = []
+
+    def start(name='test', *args, secret=SECRET):
+        port = stand_in('webhook_receiver.py', '--secret', SECRET, *args)
+        webhooks.append({'name': name, 'url': f"http://127.0.0.1:{port}/", 'secret': secret})
+        settings(webhooks=webhooks)
+        return port
+
+    return start
+
+
+def outbox():
+    return sorted((certmate.WEBHOOK_DIR / "outbox").glob('*.json'))
+
+
+def received(stand_in, port):
+    """Return (delivery id, event, domain) of each delivery the receiver accepted"""
+    lines = stand_in.output(port).splitlines()
+    return [tuple(line.split(' ', 3)[:3]) for line in lines
+            if not line.startswith(('Webhook receiver', 'Rejected', 'Failing'))]
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_delivery_is_signed(receiver, stand_in):
+    port = receiver()
+    certmate.queue_webhook_event('certificate.issued', 'signed.test', {'serial': 'ab'})
+    [path] = outbox()
+    delivery = json.loads(path.read_text())
+    assert json.loads(delivery['body'])['data'] == {'serial': 'ab'}
+
+    certmate.deliver_webhook(path)
+    assert outbox() == []
+    assert received(stand_in, port) == [(delivery['id'], 'certificate.issued', 'signed.test')]
+
+
+def test_signature_covers_timestamp_and_body():
+    signature = certmate.sign_webhook(SECRET, '1700000000', '{"event": "x"}')
+    assert signature == certmate.sign_webhook(SECRET, '1700000000', '{"event": "x"}')
+    assert signature != certmate.sign_webhook(SECRET, '1700000001', '{"event": "x"}')
+    assert signature != certmate.sign_webhook(SECRET, '1700000000', '{"event": "y"}')
+    assert signature != certmate.sign_webhook(SECRET + 'x', '1700000000', '{"event": "x"}')
+
+
+def test_bad_signature_is_retried(receiver, stand_in):
+    port = receiver('test', secret='another-secret-0123456789')
+    certmate.queue_webhook_event('certificate.issued', 'badsig.test')
+    [path] = outbox()
+    certmate.deliver_webhook(path)
+
+    delivery = json.loads(path.read_text())
+    assert delivery['attempts'] == 1
+    assert delivery['last_error'] == 'HTTP 401'
+    assert 'Rejected delivery' in stand_in.output(port)
+    assert received(stand_in, port) == []
+
+
+def test_retry_backoff_doubles_until_dead_letter(receiver):
+    receiver('test', '--fail-rate', '1')
+    certmate.queue_webhook_event('certificate.failed', 'retry.test')
+    [path] = outbox()
+
+    for attempt in range(1, certmate.WEBHOOK_MAX_ATTEMPTS):
+        before = time.time()
+        certmate.deliver_webhook(path)
+        delivery = json.loads(path.read_text())
+        assert delivery['attempts'] == attempt
+        assert delivery['last_error'] == 'HTTP 500'
+        delay = min(certmate.WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempt - 1), certmate.WEBHOOK_RETRY_MAX_SECONDS)
+        assert 0.8 * delay <= delivery['next_attempt_at'] - before <= 1.2 * delay + 1
+
+    certmate.deliver_webhook(path)
+    assert outbox() == []
+    [dead] = (certmate.WEBHOOK_DIR / "dead").glob('*.json')
+    assert dead.name == path.name
+    assert json.loads(dead.read_text())['attempts'] == certmate.WEBHOOK_MAX_ATTEMPTS
+    assert certmate.webhook_metrics()['dead_letters'] == 1
+
+
+def test_unreachable_receiver_is_retried(settings):
+    settings(webhooks=[{'name': 'down', 'url': 'http://127.0.0.1:9/', 'secret': SECRET}])
+    certmate.queue_webhook_event('certificate.issued', 'down.test')
+    [path] = outbox()
+    certmate.deliver_webhook(path)
+    assert json.loads(path.read_text())['attempts'] == 1
+
+
+def test_removed_webhook_drops_its_deliveries(receiver, settings):
+    receiver()
+    certmate.queue_webhook_event('certificate.issued', 'removed.test')
+    settings(webhooks=[])
+    certmate.deliver_webhook(outbox()[0])
+    assert outbox() == []
+
+
+def test_subscriptions(settings):
+    settings(webhooks=[{'name': 'renewals', 'url': 'http://127.0.0.1:9/', 'secret': SECRET,
+                        'events': ['certificate.renewed']},
+                       {'name': 'one-domain', 'url': 'http://127.0.0.1:9/', 'secret': SECRET,
+                        'domains': ['one.test']}])
+    certmate.queue_webhook_event('certificate.issued', 'other.test')
+    assert outbox() == []
+    certmate.queue_webhook_event('certificate.renewed', 'one.test')
+    assert sorted(json.loads(path.read_text())['webhook'] for path in outbox()) == ['one-domain', 'renewals']
+
+
+def test_dispatcher_waits_for_the_next_attempt(receiver, stand_in):
+    port = receiver()
+    certmate.queue_webhook_event('certificate.issued', 'later.test')
+    [later] = outbox()
+    delivery = json.loads(later.read_text())
+    later.write_text(json.dumps({**delivery, 'attempts': 1, 'next_attempt_at': time.time() + 3600}))
+
+    certmate.start_webhook_dispatcher()
+    certmate.queue_webhook_event('certificate.issued', 'now.test')
+    wait_for(lambda: len(received(stand_in, port)) == 1)
+    assert received(stand_in, port)[0][2] == 'now.test'
+    assert outbox() == [later]
+
+
+def test_slow_receiver_does_not_hold_up_others(receiver, stand_in):
+    slow_port = receiver('slow', '--delay', '3')
+    fast_port = receiver('fast')
+    certmate.start_webhook_dispatcher()
+    started = time.time()
+    certmate.queue_webhook_event('certificate.issued', 'slow.test')
+
+    wait_for(lambda: received(stand_in, fast_port))
+    assert time.time() - started < 2
+    assert received(stand_in, slow_port) == []
+    wait_for(lambda: received(stand_in, slow_port))
+    wait_for(lambda: outbox() == [])
+
+
+def make_certificate(directory, domain, days):
+    """Write a self-signed certificate into a certbot live directory"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domain)])
+    now = datetime.now(timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now).not_valid_after(now + timedelta(days=days))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName(domain)]), critical=False)
+            .sign(key, hashes.SHA256()))
+    directory.mkdir(parents=True, exist_ok=True)
+    pem = cert.public_bytes(serialization.Encoding.PEM)
+    # certbot replaces the files rather than writing into them
+    for name, data in (('cert.pem', pem), ('chain.pem', pem), ('fullchain.pem', pem),
+                       ('privkey.pem', key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                                         serialization.NoEncryption()))):
+        (directory / name).unlink(missing_ok=True)
+        (directory / name).write_bytes(data)
+    return cert
+
+
+def test_slow_receiver_does_not_block_renewal(receiver, stand_in, monkeypatch):
+    port = receiver('slow', '--delay', '5')
+    domain = 'renew.test'
+    config_dir, _ = certmate.certbot_dir_args()
+    live_dir = config_dir / "live" / domain
+    make_certificate(live_dir, domain, days=20)
+    (config_dir / "renewal").mkdir(parents=True, exist_ok=True)
+    (config_dir / "renewal" / f"{domain}.conf").write_text(f"server = {certmate.LETSENCRYPT_DEFAULT_SERVER}\n")
+    certmate.install_certificate_version(domain, live_dir)
+
+    renewed = []
+
+    def fake_certbot(cmd, job, env=None):
+        renewed.append(make_certificate(live_dir, domain, days=90))
+        return 0, 'Congratulations, all renewals succeeded'
+
+    monkeypatch.setattr(certmate, 'run_certbot', fake_certbot)
+    certmate.start_webhook_dispatcher()
+    started = time.time()
+    assert certmate.renew_certificate(domain) is True
+    assert time.time() - started < 3
+
+    wait_for(lambda: received(stand_in, port), timeout=15)
+    [(_, event, event_domain)] = received(stand_in, port)
+    assert (event, event_domain) == ('certificate.renewed', domain)
+    body = json.loads(stand_in.output(port).splitlines()[-1].split(' ', 3)[3])
+    assert body['serial'] == format(renewed[0].serial_number, 'x')
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Local webhook receiver for testing CertMate's webhooks
+
+Usage:
+    python webhook_receiver.py --secret SECRET [--port 9999] [--delay 0] [--fail-rate 0]
+
+Verifies the X-CertMate-Signature of every delivery and prints its event.
+--delay makes it a slow receiver and --fail-rate answers that fraction of
+deliveries with a 500, to exercise retries. Point a webhook at it with
+"url": "http://127.0.0.1:9999/" in settings.json. This is a stand-in for
+tests only.
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(secret, delay, fail_rate):
+    """Build the request handler class for the given secret"""
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            timestamp = self.headers.get('X-CertMate-Timestamp', '')
+            expected = hmac.new(secret.encode(), timestamp.encode() + b'.' + body, hashlib.sha256).hexdigest()
+            signature = self.headers.get('X-CertMate-Signature', '')
+            if not hmac.compare_digest(signature, f"sha256={expected}"):
+                print(f"Rejected delivery {self.headers.get('X-CertMate-Delivery')}: bad signature")
+                self.reply(401)
+                return
+
+            time.sleep(delay)
+            if random.random() < fail_rate:
+                print(f"Failing delivery {self.headers.get('X-CertMate-Delivery')} on purpose")
+                self.reply(500)
+                return
+
+            event = json.loads(body)
+            print(f"{self.headers.get('X-CertMate-Delivery')} {event['event']} {event['domain']} {json.dumps(event['data'])}")
+            self.reply(204)
+
+        def reply(self, status):
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local webhook receiver for tests')
+    parser.add_argument('--secret', required=True, help='Secret of the webhook in settings.json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--delay', type=float, default=0, help='Seconds to wait before answering')
+    parser.add_argument('--fail-rate', type=float, default=0, help='Fraction of deliveries to answer with a 500')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.secret, args.delay, args.fail_rate))
+    print(f"Webhook receiver listening on http://{args.host}:{args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()